@@ -0,0 +1,127 @@
+""" Score a large census-format CSV file offline with model/model.pkl.
+
+The input is read in chunks with `pd.read_csv(chunksize=...)` and the chunks are
+fanned out to a process pool. Each worker loads the encoder and model once, then
+encodes chunks with `process_data` and scores them with `inference`. Predictions
+are written in the original row order, and a throughput summary is printed.
+
+Example:
+
+    python batch_score.py data/census.csv predictions.csv --workers 4
+"""
+import argparse
+import collections
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from ml.data import apply_labels, process_data
+from ml.model import inference, load_model
+
+cat_features = [
+    "workclass",
+    "education",
+    "marital-status",
+    "occupation",
+    "relationship",
+    "race",
+    "sex",
+    "native-country",
+]
+
+# Loaded once per worker process by `_init_worker`.
+_encoder = None
+_model = None
+
+
+def _init_worker(encoder_path, model_path):
+    global _encoder, _model
+    _encoder = load_model(encoder_path)
+    _model = load_model(model_path)
+
+
+def _score_chunk(data, label):
+    if label in data.columns:
+        data = data.drop(columns=[label])
+    X, _, _, _ = process_data(data, categorical_features=cat_features, encoder=_encoder, training=False)
+    return apply_labels(inference(_model, X))
+
+
+def score_file(input_path, output_path, encoder_path, model_path, workers=None, chunksize=50000,
+               label="salary", with_features=False):
+    """ Score `input_path` chunk by chunk on a process pool and write `output_path`.
+
+    At most two chunks per worker are in flight, so memory stays bounded by the
+    chunk size rather than the file size.
+
+    Inputs
+    ------
+    input_path : str
+        CSV file in the schema of data/census.csv; the label column is optional.
+    output_path : str
+        CSV file written with a `prediction` column, one row per input row.
+    encoder_path : str
+        Path of the saved encoder.
+    model_path : str
+        Path of the saved model.
+    workers : int
+        Number of worker processes (default=cpu count).
+    chunksize : int
+        Rows per chunk.
+    label : str
+        Name of the label column, dropped before scoring if present.
+    with_features : bool
+        Also write the input columns next to the prediction.
+    Returns
+    -------
+    summary : dict
+        Rows scored, chunks, workers, seconds and rows per second.
+    """
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    rows = chunks = 0
+    pending = collections.deque()
+
+    def write(data, future):
+        nonlocal rows
+        out = data if with_features else pd.DataFrame(index=data.index)
+        out = out.assign(prediction=future.result())
+        out.to_csv(output_path, mode="a", header=rows == 0, index=False)
+        rows += len(data)
+
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(encoder_path, model_path)) as pool:
+        for data in pd.read_csv(input_path, chunksize=chunksize, skipinitialspace=True):
+            pending.append((data, pool.submit(_score_chunk, data, label)))
+            chunks += 1
+            if len(pending) >= 2 * workers:
+                write(*pending.popleft())
+        while pending:
+            write(*pending.popleft())
+
+    elapsed = time.perf_counter() - start
+    return {"rows": rows, "chunks": chunks, "workers": workers, "seconds": elapsed,
+            "rows_per_sec": rows / elapsed if elapsed else 0.0}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="census-format CSV file to score")
+    parser.add_argument("output", help="CSV file to write the predictions to")
+    parser.add_argument("--model", default=os.path.join("model", "model.pkl"))
+    parser.add_argument("--encoder", default=os.path.join("model", "encoder.pkl"))
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunksize", type=int, default=50000)
+    parser.add_argument("--label", default="salary")
+    parser.add_argument("--with-features", action="store_true", help="copy the input columns to the output")
+    args = parser.parse_args()
+
+    summary = score_file(args.input, args.output, args.encoder, args.model, workers=args.workers,
+                         chunksize=args.chunksize, label=args.label, with_features=args.with_features)
+    print(f"Scored {summary['rows']:,} rows in {summary['chunks']} chunks on {summary['workers']} workers: "
+          f"{summary['seconds']:.2f} s, {summary['rows_per_sec']:,.0f} rows/s", file=sys.stderr)
@@ -0,0 +1,96 @@
+""" Compare the inline, thread and process execution backends of the inference API.
+
+Drives POST /inference/ in-process at a fixed concurrency for every backend and
+reports requests per second, p50/p99 latency, and the p99 latency of GET / probes
+sent while the load runs (a blocked event loop shows up there first).
+
+Run from the project root:
+
+    python -m benchmarks.backends --requests 2000 --concurrency 32
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+import numpy as np
+
+import main
+from ml.executor import BACKENDS, InferenceBackend
+
+SAMPLE = {
+    "age": 37,
+    "workclass": "Private",
+    "fnlgt": 178356,
+    "education": "HS-grad",
+    "education-num": 10,
+    "marital-status": "Married-civ-spouse",
+    "occupation": "Prof-specialty",
+    "relationship": "Husband",
+    "race": "White",
+    "sex": "Male",
+    "capital-gain": 0,
+    "capital-loss": 0,
+    "hours-per-week": 40,
+    "native-country": "United-States",
+}
+
+
+async def drive(n_requests, concurrency):
+    latencies, probes = [], []
+    queue = iter(range(n_requests))
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker():
+            for _ in queue:
+                start = time.perf_counter()
+                r = await client.post("/inference/", json=SAMPLE)
+                r.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+        async def probe(done):
+            while not done.is_set():
+                start = time.perf_counter()
+                await client.get("/")
+                probes.append(time.perf_counter() - start)
+                await asyncio.sleep(0.01)
+
+        done = asyncio.Event()
+        probe_task = asyncio.create_task(probe(done))
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await probe_task
+    return np.array(latencies), np.array(probes), elapsed
+
+
+def main_(args):
+    # Every request posts the same SAMPLE: without the prediction cache each one
+    # reaches the backend under test.
+    main.cache.maxsize = 0
+    main.batcher.max_batch_size = args.max_batch_size
+    print(f"{'backend':<8} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'GET / p99 ms':>13}")
+    for mode in args.modes:
+        old, main.backend = main.backend, InferenceBackend(
+            mode, main.model_dir, main.cat_features,
+            main.continuous_features, max_workers=args.workers, engine=main.engine,
+        )
+        old.shutdown()
+        asyncio.run(drive(args.concurrency, args.concurrency))  # warm up pools and workers
+        latencies, probes, elapsed = asyncio.run(drive(args.requests, args.concurrency))
+        print(f"{mode:<8} {len(latencies) / elapsed:>9.1f} "
+              f"{1000 * np.percentile(latencies, 50):>8.2f} {1000 * np.percentile(latencies, 99):>8.2f} "
+              f"{1000 * np.percentile(probes, 99) if len(probes) else float('nan'):>13.2f}")
+    main.backend.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000, help="requests per backend")
+    parser.add_argument("--concurrency", type=int, default=32, help="in-flight requests")
+    parser.add_argument("--workers", type=int, default=None, help="pool size for thread/process")
+    parser.add_argument("--max-batch-size", type=int, default=1,
+                        help="micro-batch size (1 isolates the backend from batching)")
+    parser.add_argument("--modes", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    main_(parser.parse_args())
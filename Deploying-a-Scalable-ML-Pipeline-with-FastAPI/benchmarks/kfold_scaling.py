@@ -0,0 +1,50 @@
+""" Wall-clock scaling of `kfold_train` from 1 to N worker processes.
+
+Encodes data/census.csv once, then trains the same K fold models with 1, 2, ...
+N processes and reports the wall clock, the speedup over one process and the
+mean fold F1 (identical across worker counts).
+
+Run from the project root:
+
+    python -m benchmarks.kfold_scaling --folds 5 --workers 1 2 4
+"""
+import argparse
+import os
+
+import pandas as pd
+
+from ml.data import process_data
+from ml.kfold import kfold_train
+
+cat_features = [
+    "workclass",
+    "education",
+    "marital-status",
+    "occupation",
+    "relationship",
+    "race",
+    "sex",
+    "native-country",
+]
+
+
+def main_(args):
+    data = pd.read_csv("data/census.csv")
+    X, y, _, _ = process_data(data, categorical_features=cat_features, label="salary", training=True)
+    params = {"n_estimators": 30, "max_depth": 5, "min_samples_split": 50, "learning_rate": 1.0}
+    print(f"{os.cpu_count()} cpus, {args.folds} folds, X {X.shape[0]:,} x {X.shape[1]}")
+    print(f"{'workers':>7} {'wall s':>8} {'speedup':>8} {'mean F1':>8}")
+    base = None
+    for workers in args.workers:
+        result = kfold_train(X, y, params=params, n_splits=args.folds, workers=workers)
+        base = base or result["seconds"]
+        print(f"{workers:>7} {result['seconds']:>8.2f} {base / result['seconds']:>8.2f} "
+              f"{result['mean']['fbeta']:>8.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted({1, 2, os.cpu_count() or 1}))
+    main_(parser.parse_args())
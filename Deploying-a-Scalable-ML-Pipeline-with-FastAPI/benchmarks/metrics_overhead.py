@@ -0,0 +1,61 @@
+""" Measure the cost of the latency instrumentation, enabled and disabled.
+
+Reports the cost of a single `Metrics.observe` hook in both states, then drives
+POST /inference/ in-process with metrics on and off and compares latency.
+
+Run from the project root:
+
+    python -m benchmarks.metrics_overhead --requests 2000
+"""
+import argparse
+import asyncio
+import time
+import timeit
+
+import httpx
+import numpy as np
+
+import main
+from benchmarks.backends import SAMPLE
+from ml.metrics import Metrics
+
+
+def hook_cost(enabled, number=200000):
+    metrics = Metrics(enabled=enabled)
+    seconds = timeit.timeit(lambda: metrics.observe("x", 0.001, stage="encode"), number=number)
+    return 1e9 * seconds / number
+
+
+async def drive(n_requests):
+    latencies = []
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for _ in range(n_requests):
+            start = time.perf_counter()
+            r = await client.post("/inference/", json=SAMPLE)
+            r.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+    return np.array(latencies)
+
+
+def main_(args):
+    print(f"observe() enabled:  {hook_cost(True):8.1f} ns/call")
+    print(f"observe() disabled: {hook_cost(False):8.1f} ns/call")
+
+    # Score every request so the whole instrumented path runs each time.
+    main.cache.maxsize = 0
+    main.batcher.max_batch_size = 1
+    print(f"{'metrics':<9} {'mean us':>9} {'p50 us':>9} {'p99 us':>9}")
+    for enabled in (False, True, False, True):
+        main.metrics.enabled = enabled
+        asyncio.run(drive(50))
+        latencies = asyncio.run(drive(args.requests))
+        print(f"{'on' if enabled else 'off':<9} {1e6 * latencies.mean():>9.1f} "
+              f"{1e6 * np.percentile(latencies, 50):>9.1f} {1e6 * np.percentile(latencies, 99):>9.1f}")
+    main.backend.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000, help="sequential requests per run")
+    main_(parser.parse_args())
@@ -0,0 +1,58 @@
+""" Compare the model backends and search modes of `train_model`.
+
+For each backend and search mode, encodes the train split of data/census.csv the
+way train_model.py does, runs `train_model`, and reports the search time, the width
+of the model input, the test F1 and the time to score the test set.
+
+Run from the project root:
+
+    python -m benchmarks.model_backends --backends gradient_boosting hist --searches grid halving
+"""
+import argparse
+import time
+
+import pandas as pd
+from sklearn.model_selection import train_test_split
+
+from ml.data import process_data
+from ml.model import MODEL_BACKENDS, SEARCH_MODES, compute_model_metrics, inference, train_model
+
+cat_features = [
+    "workclass",
+    "education",
+    "marital-status",
+    "occupation",
+    "relationship",
+    "race",
+    "sex",
+    "native-country",
+]
+
+
+def main_(args):
+    data = pd.read_csv("data/census.csv")
+    train, test = train_test_split(data, test_size=0.20, random_state=10, stratify=data["salary"])
+    print(f"{'backend':<18} {'search':<8} {'width':>6} {'train s':>8} {'score ms':>9} {'F1':>7}")
+    for backend, search in [(b, s) for b in args.backends for s in args.searches]:
+        encoding = "ordinal" if backend == "hist" else "onehot"
+        X_train, y_train, encoder, lb = process_data(train, categorical_features=cat_features, label="salary",
+                                                     training=True, encoding=encoding)
+        X_test, y_test, _, _ = process_data(test, categorical_features=cat_features, label="salary",
+                                            training=False, encoder=encoder, lb=lb)
+        start = time.perf_counter()
+        model = train_model(X_train, y_train, backend=backend, n_categorical=len(cat_features),
+                            search=search, budget=args.budget)
+        fit = time.perf_counter() - start
+        start = time.perf_counter()
+        preds = inference(model, X_test)
+        score = time.perf_counter() - start
+        _, _, fb = compute_model_metrics(y_test, preds)
+        print(f"{backend:<18} {search:<8} {X_train.shape[1]:>6} {fit:>8.1f} {score * 1000:>9.1f} {fb:>7.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", choices=MODEL_BACKENDS, default=list(MODEL_BACKENDS))
+    parser.add_argument("--searches", nargs="+", choices=SEARCH_MODES, default=["grid"])
+    parser.add_argument("--budget", type=float, default=None, help="budget in seconds of the halving search")
+    main_(parser.parse_args())
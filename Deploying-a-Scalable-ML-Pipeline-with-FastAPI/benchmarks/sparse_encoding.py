@@ -0,0 +1,68 @@
+""" Compare dense and sparse (CSR) one hot encoding at growing data sizes.
+
+Resamples data/census.csv to each scale factor and, for both modes, reports the
+time and peak traced memory of `process_data(training=True)`, the size of the
+resulting X, and optionally the time to fit one GradientBoostingClassifier.
+
+Run from the project root:
+
+    python -m benchmarks.sparse_encoding --scales 1 10 100 --train-scales 1 10
+"""
+import argparse
+import time
+import tracemalloc
+
+import pandas as pd
+from sklearn.ensemble import GradientBoostingClassifier
+
+from ml.data import process_data
+
+cat_features = [
+    "workclass",
+    "education",
+    "marital-status",
+    "occupation",
+    "relationship",
+    "race",
+    "sex",
+    "native-country",
+]
+
+
+def nbytes(X):
+    if hasattr(X, "indptr"):
+        return X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+    return X.nbytes
+
+
+def main_(args):
+    census = pd.read_csv("data/census.csv")
+    print(f"{'scale':>5} {'rows':>10} {'mode':<7} {'encode s':>9} {'peak MiB':>9} {'X MiB':>8} {'fit s':>7}")
+    for scale in args.scales:
+        data = census.sample(n=len(census) * scale, replace=scale > 1, random_state=0)
+        for sparse in [mode == "sparse" for mode in args.modes]:
+            tracemalloc.start()
+            start = time.perf_counter()
+            X, y, _, _ = process_data(data, categorical_features=cat_features, label="salary",
+                                      training=True, sparse=sparse)
+            encode = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            fit = float("nan")
+            if scale in args.train_scales:
+                start = time.perf_counter()
+                GradientBoostingClassifier(n_estimators=10, max_depth=5, random_state=0).fit(X, y)
+                fit = time.perf_counter() - start
+            print(f"{scale:>5} {len(data):>10,} {'sparse' if sparse else 'dense':<7} {encode:>9.2f} "
+                  f"{peak / 2**20:>9.1f} {nbytes(X) / 2**20:>8.1f} {fit:>7.2f}")
+            del X, y
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--train-scales", type=int, nargs="*", default=[1, 10],
+                        help="scales at which a model is also fitted")
+    parser.add_argument("--modes", nargs="+", default=["dense", "sparse"], choices=["dense", "sparse"])
+    main_(parser.parse_args())
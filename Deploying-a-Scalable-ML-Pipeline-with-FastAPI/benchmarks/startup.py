@@ -0,0 +1,63 @@
+""" Report start-up time and per-worker memory for each model loading engine.
+
+Starts N worker processes per engine, like `uvicorn --workers N`, each importing
+main.py and scoring one record. Every worker reports its import+load time, the
+latency of its first prediction, and its RSS and PSS (proportional set size, which
+splits shared pages between the processes mapping them) from /proc.
+
+Run from the project root (Linux only):
+
+    python -m benchmarks.startup --workers 4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+WORKER = """
+import json, time
+start = time.perf_counter()
+import main
+from ml.executor import predict_records
+loaded = time.perf_counter()
+example = {f.alias or n: f.json_schema_extra["example"] for n, f in main.Data.model_fields.items()}
+predict_records([example])
+first = time.perf_counter()
+memory = {}
+with open("/proc/self/smaps_rollup") as f:
+    for line in f:
+        name, _, value = line.partition(":")
+        if name in ("Rss", "Pss"):
+            memory[name] = int(value.split()[0]) / 1024
+input()  # stay alive (and mapped) until the parent collects the result
+print(json.dumps({"startup": loaded - start, "first": first - loaded, **memory}), flush=True)
+"""
+
+
+def run_workers(engine, n_workers):
+    env = dict(os.environ, INFERENCE_ENGINE=engine, INFERENCE_BACKEND="inline", PYTHONWARNINGS="ignore")
+    procs = [subprocess.Popen([sys.executable, "-c", WORKER], env=env, stdin=subprocess.PIPE,
+                              stdout=subprocess.PIPE, text=True) for _ in range(n_workers)]
+    results = [json.loads(p.communicate("\n")[0]) for p in procs]
+    return results
+
+
+def main_(args):
+    print(f"{'engine':<9} {'startup s':>10} {'first ms':>9} {'RSS MiB':>8} {'PSS MiB':>8}  (mean per worker, "
+          f"{args.workers} workers)")
+    for engine in args.engines:
+        results = run_workers(engine, args.workers)
+        mean = {k: np.mean([r[k] for r in results]) for k in results[0]}
+        print(f"{engine:<9} {mean['startup']:>10.3f} {1000 * mean['first']:>9.2f} "
+              f"{mean['Rss']:>8.1f} {mean['Pss']:>8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--engines", nargs="+", default=["sklearn", "compiled", "mmap"],
+                        choices=["sklearn", "compiled", "mmap"])
+    main_(parser.parse_args())
@@ -0,0 +1,270 @@
+""" Benchmark suite of the census pipeline hot paths, with a baseline comparison.
+
+Cases, on data/census.csv resampled with replacement to each scale factor:
+
+  process_data/train, process_data/inference   dense and sparse, per scale
+  train_model/<search>                         per --train-scales
+  inference                                    shipped model, per batch size
+  slices/per_slice, slices/grouped             performance_on_categorical_slice
+                                               over every slice vs compute_slice_metrics
+  handler/inference                            POST /inference/ through TestClient,
+                                               uncached and unbatched
+
+Each case records the min and median wall clock of its repeats and, where it
+makes sense, rows per second. Results are written as JSON, and `--compare`
+prints the ratio of every case to a stored baseline and exits with status 1 if
+one is slower than the threshold allows.
+
+Run from the project root:
+
+    python -m benchmarks.suite --out benchmarks/results.json --compare benchmarks/baseline.json
+    python -m benchmarks.suite --scales 1 10 --out benchmarks/baseline.json   # refresh the baseline
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from ml.data import process_data
+from ml.model import (
+    compute_slice_metrics,
+    inference,
+    load_model,
+    performance_on_categorical_slice,
+    train_model,
+)
+
+cat_features = [
+    "workclass",
+    "education",
+    "marital-status",
+    "occupation",
+    "relationship",
+    "race",
+    "sex",
+    "native-country",
+]
+
+
+def resample(census, scale):
+    return census.sample(n=int(len(census) * scale), replace=scale > 1, random_state=0)
+
+
+def measure(fn, repeat):
+    """ Call `fn` `repeat` times; returns the seconds of each call."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+class Suite:
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = []
+
+    def run(self, name, fn, rows=None, repeat=None, **params):
+        times = measure(fn, repeat or self.repeat)
+        result = {"name": name, "params": params, "repeat": len(times),
+                  "min": min(times), "median": statistics.median(times)}
+        if rows:
+            result["rows_per_sec"] = rows / result["min"]
+        self.results.append(result)
+        print(f"{name:<45} {result['min'] * 1000:>11.2f} ms" + (
+            f" {result['rows_per_sec']:>14,.0f} rows/s" if rows else ""), file=sys.stderr)
+        return result
+
+    def skip(self, name, reason, **params):
+        self.results.append({"name": name, "params": params, "skipped": reason})
+        print(f"{name:<45} skipped: {reason}", file=sys.stderr)
+
+
+def bench_process_data(suite, census, args):
+    width = None
+    for scale in args.scales:
+        data = resample(census, scale)
+        for sparse in (False, True):
+            mode = "sparse" if sparse else "dense"
+            if not sparse and width and len(data) * width * 8 > args.max_dense_bytes:
+                for kind in ("train", "inference"):
+                    suite.skip(f"process_data/{kind}/{mode}/x{scale}", "dense X over --max-dense-bytes")
+                continue
+            fitted = {}
+
+            def train():
+                fitted["out"] = process_data(data, categorical_features=cat_features, label="salary",
+                                             training=True, sparse=sparse)
+
+            suite.run(f"process_data/train/{mode}/x{scale}", train, rows=len(data), scale=scale, sparse=sparse)
+            X, _, encoder, lb = fitted.pop("out")
+            width = X.shape[1]
+            del X
+            suite.run(f"process_data/inference/{mode}/x{scale}",
+                      lambda: process_data(data, categorical_features=cat_features, label="salary",
+                                           training=False, encoder=encoder, lb=lb, sparse=sparse),
+                      rows=len(data), scale=scale, sparse=sparse)
+
+
+def bench_train_model(suite, census, args):
+    for scale in args.train_scales:
+        X, y, _, _ = process_data(resample(census, scale), categorical_features=cat_features,
+                                  label="salary", training=True)
+        suite.run(f"train_model/{args.search}/x{scale}",
+                  lambda: train_model(X, y, search=args.search, budget=args.budget),
+                  rows=len(y), repeat=1, scale=scale, search=args.search)
+
+
+def bench_inference(suite, census, encoder, model, args):
+    pool = resample(census, max(args.batch_sizes) / len(census))
+    X, _, _, _ = process_data(pool.drop(columns=["salary"]), categorical_features=cat_features,
+                              training=False, encoder=encoder)
+    for size in args.batch_sizes:
+        batch = X[:size]
+        suite.run(f"inference/batch{size}", lambda: inference(model, batch), rows=size, batch_size=size)
+
+
+def bench_slices(suite, census, encoder, lb, model, args):
+    for scale in args.slice_scales:
+        data = resample(census, scale)
+
+        def per_slice():
+            for col in cat_features:
+                for value in sorted(data[col].unique()):
+                    performance_on_categorical_slice(data, col, value, cat_features, "salary",
+                                                     encoder, lb, model)
+
+        def grouped():
+            X, y, _, _ = process_data(data, categorical_features=cat_features, label="salary",
+                                      training=False, encoder=encoder, lb=lb)
+            compute_slice_metrics(data, cat_features, y, inference(model, X))
+
+        suite.run(f"slices/per_slice/x{scale}", per_slice, rows=len(data), repeat=1, scale=scale)
+        suite.run(f"slices/grouped/x{scale}", grouped, rows=len(data), scale=scale)
+
+
+def bench_handler(suite, census, args):
+    # Distinct payloads, and no prediction cache, so every request is scored; one
+    # request at a time, so batches of one: no request waits out the batch window.
+    from fastapi.testclient import TestClient
+
+    import main
+
+    main.cache.maxsize = 0
+    main.batcher.max_batch_size = 1
+
+    payloads = census.drop(columns=["salary"]).head(args.requests).to_dict(orient="records")
+    latencies = []
+    with TestClient(main.app) as client:
+        for payload in payloads[:20]:
+            client.post("/inference/", json=payload).raise_for_status()
+
+        def post_all():
+            for payload in payloads:
+                start = time.perf_counter()
+                client.post("/inference/", json=payload).raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+        result = suite.run("handler/inference", post_all, rows=len(payloads), repeat=1,
+                           requests=len(payloads))
+    result["p50_ms"] = 1000 * float(np.percentile(latencies, 50))
+    result["p99_ms"] = 1000 * float(np.percentile(latencies, 99))
+
+
+def compare(results, baseline, threshold):
+    """ Print the ratio of every case to the baseline; returns the regressed case names."""
+    base = {r["name"]: r for r in baseline["results"] if "min" in r}
+    regressions = []
+    print(f"{'case':<45} {'baseline ms':>12} {'now ms':>10} {'ratio':>7}")
+    for result in results["results"]:
+        if "min" not in result or result["name"] not in base:
+            continue
+        ratio = result["min"] / base[result["name"]]["min"]
+        flag = ""
+        if ratio > 1 + threshold:
+            regressions.append(result["name"])
+            flag = "  REGRESSION"
+        print(f"{result['name']:<45} {base[result['name']]['min'] * 1000:>12.2f} "
+              f"{result['min'] * 1000:>10.2f} {ratio:>7.2f}{flag}")
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main_(args):
+    census = pd.read_csv("data/census.csv")
+    encoder = load_model("model/encoder.pkl")
+    model = load_model("model/model.pkl")
+    _, _, _, lb = process_data(census, categorical_features=cat_features, label="salary", training=True)
+
+    suite = Suite(args.repeat)
+    if "process_data" in args.cases:
+        bench_process_data(suite, census, args)
+    if "train_model" in args.cases:
+        bench_train_model(suite, census, args)
+    if "inference" in args.cases:
+        bench_inference(suite, census, encoder, model, args)
+    if "slices" in args.cases:
+        bench_slices(suite, census, encoder, lb, model, args)
+    if "handler" in args.cases:
+        bench_handler(suite, census, args)
+
+    results = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        },
+        "results": suite.results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+        f.write("\n")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} case(s) slower than the baseline by more than "
+                  f"{args.threshold:.0%}: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    cases = ("process_data", "train_model", "inference", "slices", "handler")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", nargs="+", choices=cases, default=list(cases))
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--train-scales", type=int, nargs="+", default=[1])
+    parser.add_argument("--slice-scales", type=int, nargs="+", default=[1, 10])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 10, 100, 1000, 10000, 100000])
+    parser.add_argument("--search", choices=["grid", "halving"], default="grid",
+                        help="train_model search mode, grid by default like train_model.py")
+    parser.add_argument("--budget", type=float, default=None, help="train_model halving budget in seconds")
+    parser.add_argument("--requests", type=int, default=500, help="requests of the handler case")
+    parser.add_argument("--repeat", type=int, default=3, help="repeats of the fast cases")
+    parser.add_argument("--max-dense-bytes", type=float, default=2**30,
+                        help="skip the dense process_data cases whose X would exceed this")
+    parser.add_argument("--out", default="benchmarks/results.json")
+    parser.add_argument("--compare", default=None, help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed slowdown over the baseline before failing (default 25%%)")
+    main_(parser.parse_args())
@@ -0,0 +1,65 @@
+""" Compare sklearn's GridSearchCV.predict with the compiled array-backed engine.
+
+Encodes data/census.csv with the saved encoder, checks that both engines agree on
+every row, then reports the mean latency of one predict call per batch size.
+
+Run from the project root:
+
+    python -m benchmarks.tree_engine --batch-sizes 1 64 4096
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from ml.compiled import compile_model
+from ml.data import process_data
+from ml.model import inference, load_model
+
+cat_features = [
+    "workclass",
+    "education",
+    "marital-status",
+    "occupation",
+    "relationship",
+    "race",
+    "sex",
+    "native-country",
+]
+
+
+def mean_latency(model, X, repeat):
+    inference(model, X)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        inference(model, X)
+    return (time.perf_counter() - start) / repeat
+
+
+def main_(args):
+    data = pd.read_csv("data/census.csv").drop(columns=["salary"])
+    encoder = load_model("model/encoder.pkl")
+    model = load_model("model/model.pkl")
+    X, _, _, _ = process_data(data, categorical_features=cat_features, encoder=encoder, training=False)
+
+    start = time.perf_counter()
+    compiled = compile_model(model)
+    print(f"compiled {len(compiled.roots)} trees / {len(compiled.feature)} nodes "
+          f"in {1000 * (time.perf_counter() - start):.1f} ms")
+    assert np.array_equal(inference(model, X), inference(compiled, X)), "engines disagree"
+
+    print(f"{'batch':>6} {'sklearn us':>11} {'compiled us':>12} {'speedup':>8}")
+    for size in args.batch_sizes:
+        batch = X[np.arange(size) % len(X)]
+        repeat = max(5, args.rows // size)
+        sk = mean_latency(model, batch, repeat)
+        comp = mean_latency(compiled, batch, repeat)
+        print(f"{size:>6} {1e6 * sk:>11.1f} {1e6 * comp:>12.1f} {sk / comp:>7.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 64, 4096])
+    parser.add_argument("--rows", type=int, default=20000, help="rows scored per batch size")
+    main_(parser.parse_args())
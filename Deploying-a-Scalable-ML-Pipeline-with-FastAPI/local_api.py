@@ -1,16 +1,40 @@
-import json
-import requests
+""" Smoke test and asyncio load generator for the inference API.
+
+Drives both GET / and POST /inference/ for --duration seconds (or --requests
+requests) and reports throughput, p50/p95/p99 latency and error rates per
+endpoint. With --smoke it first sends one GET / and one POST /inference/ with the
+sample payload and prints the answers (to stderr with --json, so the report stays
+valid JSON). Every failed request, whatever the exception, is counted as an error
+of its endpoint instead of stopping the run.
 
+The load is closed-loop by default: --concurrency clients each send their next
+request as soon as the previous one returns. With --rps the load is open-loop:
+requests are started on a fixed schedule (still at most --concurrency in flight),
+and latency is measured from the scheduled start, so a server falling behind
+shows up as queueing delay instead of a lower request rate.
 
-# TODO: send a GET using the URL http://127.0.0.1:8000
-r = requests.get("http://127.0.0.1:8000")
+POST payloads are randomized census rows, except for a --sample-fraction of them
+that use the sample payload below. --in-process serves main.app through an ASGI
+transport, lifespan included, so no server or network is needed.
 
-# TODO: print the status code
-print("Status Code:", r.status_code)
+Examples:
 
-# TODO: print the welcome message
-print("Welcome Message:", r.json()["message"])
+    python local_api.py --smoke                          # against uvicorn on :8000
+    python local_api.py --in-process --duration 10 --concurrency 64
+    python local_api.py --url http://10.0.0.5:8000 --rps 500 --duration 30
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import sys
+import time
 
+import httpx
+import numpy as np
+import pandas as pd
 
 data = {
     "age": 37,
@@ -29,11 +53,205 @@ data = {
     "native-country": "United-States",
 }
 
-# TODO: send a POST using the data above
-r = requests.post("http://127.0.0.1:8000/inference/", json=data)
 
-# TODO: print the status code
-print("Status Code:", r.status_code)
+async def smoke(client, file=sys.stdout):
+    # TODO: send a GET using the URL http://127.0.0.1:8000
+    r = await client.get("/")
+
+    # TODO: print the status code
+    print("Status Code:", r.status_code, file=file)
+
+    # TODO: print the welcome message
+    print("Welcome Message:", r.json()["message"], file=file)
+
+    # TODO: send a POST using the data above
+    r = await client.post("/inference/", json=data)
+
+    # TODO: print the status code
+    print("Status Code:", r.status_code, file=file)
+
+    # TODO: print the result
+    print("Prediction Result:", r.json()["result"], file=file)
+
+
+class LoadGenerator:
+    """ Picks the next request and records the outcome of every request sent.
+
+    Inputs
+    ------
+    client : httpx.AsyncClient
+        Client bound to the API.
+    rows : list[dict]
+        Census rows to post, without the label.
+    get_fraction : float
+        Share of the requests that are GET / instead of POST /inference/.
+    sample_fraction : float
+        Share of the POSTs that send the sample payload instead of a census row.
+    seed : int
+        Seed of the request mix.
+    """
+
+    def __init__(self, client, rows, get_fraction=0.1, sample_fraction=0.1, seed=0):
+        self.client = client
+        self.rows = rows
+        self.get_fraction = get_fraction
+        self.sample_fraction = sample_fraction
+        self.rng = random.Random(seed)
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.defaultdict(collections.Counter)
+
+    async def send(self, scheduled=None):
+        """ Send one request; latency runs from `scheduled` if given, else from now."""
+        if self.rng.random() < self.get_fraction:
+            path, request = "/", self.client.get("/")
+        else:
+            payload = data if not self.rows or self.rng.random() < self.sample_fraction else self.rng.choice(self.rows)
+            path, request = "/inference/", self.client.post("/inference/", json=payload)
+        start = scheduled if scheduled is not None else time.perf_counter()
+        try:
+            r = await request
+            if r.status_code >= 400:
+                self.errors[path][f"HTTP {r.status_code}"] += 1
+        except Exception as exc:
+            # connection errors, timeouts, or an exception raised by an in-process app
+            self.errors[path][type(exc).__name__] += 1
+        self.latencies[path].append(time.perf_counter() - start)
+
+    async def closed_loop(self, concurrency, deadline, n_requests):
+        remaining = [n_requests]
+
+        async def client():
+            while time.perf_counter() < deadline and remaining[0] != 0:
+                remaining[0] -= 1
+                await self.send()
+
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+
+    async def open_loop(self, rps, concurrency, deadline, n_requests):
+        slots = asyncio.Semaphore(concurrency)
+        tasks = set()
+        start = time.perf_counter()
+        i = 0
+
+        async def scheduled_send(at):
+            try:
+                await self.send(scheduled=at)
+            finally:
+                slots.release()
+
+        while n_requests < 0 or i < n_requests:
+            at = start + i / rps
+            if at >= deadline:
+                break
+            await asyncio.sleep(max(0.0, at - time.perf_counter()))
+            await slots.acquire()
+            task = asyncio.create_task(scheduled_send(at))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            i += 1
+        await asyncio.gather(*tasks)
+
+    def report(self, elapsed):
+        """ Return throughput, latency percentiles and errors per endpoint and overall."""
+        paths = sorted(self.latencies)
+        report = {}
+        for path in paths + ["total"]:
+            # the empty array keeps the total valid when no request completed
+            latencies = (np.concatenate([np.empty(0)] + [self.latencies[p] for p in paths]) if path == "total"
+                         else np.array(self.latencies[path]))
+            errors = (sum((self.errors[p] for p in paths), collections.Counter()) if path == "total"
+                      else self.errors[path])
+            n = len(latencies)
+            report[path] = {
+                "requests": n,
+                "rps": n / elapsed if elapsed else 0.0,
+                "p50_ms": 1000 * float(np.percentile(latencies, 50)) if n else None,
+                "p95_ms": 1000 * float(np.percentile(latencies, 95)) if n else None,
+                "p99_ms": 1000 * float(np.percentile(latencies, 99)) if n else None,
+                "errors": sum(errors.values()),
+                "error_rate": sum(errors.values()) / n if n else 0.0,
+                "error_kinds": dict(errors),
+            }
+        return report
+
+
+def load_rows(path):
+    if not os.path.exists(path):
+        return []
+    return pd.read_csv(path, skipinitialspace=True).drop(columns=["salary"], errors="ignore").to_dict(orient="records")
+
+
+async def run(args):
+    rows = load_rows(args.census)
+    if args.in_process:
+        import main
+
+        transport = httpx.ASGITransport(app=main.app)
+        lifespan = main.app.router.lifespan_context(main.app)
+        base_url = "http://in-process"
+    else:
+        transport = None
+        lifespan = None
+        base_url = args.url
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=args.timeout,
+                                 limits=limits) as client:
+        if lifespan is not None:
+            await lifespan.__aenter__()
+        try:
+            if args.smoke:
+                out = sys.stderr if args.json else sys.stdout
+                try:
+                    await smoke(client, file=out)
+                except Exception as exc:
+                    print(f"Smoke test failed: {type(exc).__name__}: {exc}", file=out)
+            load = LoadGenerator(client, rows, args.get_fraction, args.sample_fraction, args.seed)
+            start = time.perf_counter()
+            deadline = start + args.duration if args.requests < 0 else float("inf")
+            if args.rps:
+                await load.open_loop(args.rps, args.concurrency, deadline, args.requests)
+            else:
+                await load.closed_loop(args.concurrency, deadline, args.requests)
+            elapsed = time.perf_counter() - start
+        finally:
+            if lifespan is not None:
+                await lifespan.__aexit__(None, None, None)
+    return load.report(elapsed), elapsed
+
+
+def print_report(report, elapsed):
+    print(f"\n{'endpoint':<12} {'requests':>9} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>8}")
+    for path, stats in report.items():
+        if not stats["requests"]:
+            continue
+        print(f"{path:<12} {stats['requests']:>9} {stats['rps']:>9.1f} {stats['p50_ms']:>8.2f} "
+              f"{stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f} {stats['error_rate']:>8.2%}")
+        for kind, count in stats["error_kinds"].items():
+            print(f"{'':<12} {kind}: {count}")
+    print(f"in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--in-process", action="store_true", help="serve main.app in this process, no network")
+    parser.add_argument("--concurrency", type=int, default=32, help="clients, or requests in flight with --rps")
+    parser.add_argument("--rps", type=float, default=None, help="open-loop target requests per second")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load")
+    parser.add_argument("--requests", type=int, default=-1, help="stop after this many requests instead")
+    parser.add_argument("--get-fraction", type=float, default=0.1, help="share of GET / requests")
+    parser.add_argument("--sample-fraction", type=float, default=0.1,
+                        help="share of POSTs sending the sample payload instead of a census row")
+    parser.add_argument("--census", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "census.csv"))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=10.0, help="per-request timeout in seconds")
+    parser.add_argument("--smoke", action="store_true", help="print one GET / and one POST /inference/ first")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
 
-# TODO: print the result
-print("Prediction Result:", r.json()["result"])
+    report, elapsed = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps({"seconds": elapsed, "endpoints": report}, indent=2))
+    else:
+        print_report(report, elapsed)
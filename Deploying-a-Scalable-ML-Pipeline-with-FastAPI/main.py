@@ -1,12 +1,31 @@
+import asyncio
+import hmac
+import json
 import os
+import pickle
 import requests
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional
 
 import pandas as pd
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel, Field
 
-from ml.data import apply_label, process_data
-from ml.model import inference, load_model
+from ml.batching import MicroBatcher
+from ml.cache import PredictionCache
+from ml.data import apply_label, apply_labels
+from ml.executor import (
+    InferenceBackend,
+    artifact_paths,
+    load_state,
+    predict_dataframe,
+    predict_frame,
+    predict_records,
+)
+from ml.metrics import SIZE_BUCKETS, Metrics, MetricsMiddleware
+from ml.streaming import FORMATS, DuplexStreamingResponse, iter_frames
 
 # DO NOT MODIFY
 class Data(BaseModel):
@@ -29,19 +48,122 @@ class Data(BaseModel):
                                 alias="native-country")
 
 
-project_path = os.getcwd()
+cat_features = [
+    "workclass",
+    "education",
+    "marital-status",
+    "occupation",
+    "relationship",
+    "race",
+    "sex",
+    "native-country",
+]
 
-path = os.path.join(project_path, "model", "encoder.pkl")  # TODO: enter the path for the saved encoder
-encoder = load_model(path)
+# Artifacts are read from INFERENCE_MODEL_DIR, by default the model/ directory next
+# to this file (not the working directory).
+model_dir = os.environ.get(
+    "INFERENCE_MODEL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "model")
+)
+# By default the tree arrays exported to model/compiled/ are memory-mapped read-only
+# and shared by all workers, without loading model.pkl or sklearn. "compiled"
+# flattens model.pkl in memory at start-up; "sklearn" serves the GridSearchCV. A
+# model trained with `train_model.py --backend hist` has no compiled export and is
+# served by "sklearn" on integer coded categoricals.
+# INFERENCE_BUNDLE serves a single-file model bundle (see ml/bundle.py) instead,
+# with the "sklearn" engine by default; POST /admin/reload swaps it at run time.
+bundle_path = os.environ.get("INFERENCE_BUNDLE") or None
+engine = os.environ.get(
+    "INFERENCE_ENGINE",
+    "mmap" if bundle_path is None and os.path.isdir(os.path.join(model_dir, "compiled")) else "sklearn",
+)
+# INFERENCE_SPARSE=1 keeps the one hot block of DataFrame-encoded batches in CSR form.
+sparse_encoding = os.environ.get("INFERENCE_SPARSE", "0") == "1"
+encoder_path, model_path = artifact_paths(model_dir, engine)
 
+continuous_features = [
+    field.alias or name for name, field in Data.model_fields.items()
+    if (field.alias or name) not in cat_features
+]
+# Load the model and the precompiled lookup table for single-record inference.
+load_state(model_dir, engine, cat_features, continuous_features, sparse=sparse_encoding,
+           bundle_path=bundle_path)
+
+# The encode+predict stage runs "inline" on the event loop, in a "thread" pool, or
+# in a "process" pool whose workers each load the artifacts once.
+backend = InferenceBackend(
+    os.environ.get("INFERENCE_BACKEND", "thread"),
+    model_dir,
+    cat_features,
+    continuous_features,
+    max_workers=int(os.environ.get("INFERENCE_WORKERS", 0)) or None,
+    engine=engine,
+    sparse=sparse_encoding,
+    bundle_path=bundle_path,
+)
+
+
+# Per-stage latency histograms and request counters, served at GET /metrics.
+# INFERENCE_METRICS=0 turns every hook into an early return.
+metrics = Metrics(enabled=os.environ.get("INFERENCE_METRICS", "1") != "0")
+metrics.describe("inference_stage_seconds", "Time spent in each stage of the inference path.")
+metrics.describe("inference_batch_size", "Number of records scored per model call.")
+metrics.describe("inference_cache_requests_total", "Prediction cache lookups by result.")
+metrics.describe("http_request_duration_seconds", "End-to-end HTTP request latency by path.")
+metrics.describe("http_requests_total", "HTTP requests by path and status code.")
+metrics.describe("inference_file_rows_total", "Rows scored through /inference/file.")
+
+
+async def predict_batch(records):
+    preds, timings = await backend.run(predict_records, records)
+    metrics.observe_stages(timings)
+    metrics.observe("inference_batch_size", len(records), buckets=SIZE_BUCKETS)
+    return preds
+
+
+# Concurrent /inference/ calls are coalesced into one model call per batch. A batch
+# is flushed when it is full or when its first request has waited max_wait_ms.
+# Setting INFERENCE_MAX_BATCH_SIZE=1 scores every request on its own.
+batcher = MicroBatcher(
+    predict_batch,
+    max_batch_size=int(os.environ.get("INFERENCE_MAX_BATCH_SIZE", 32)),
+    max_wait_ms=float(os.environ.get("INFERENCE_MAX_WAIT_MS", 2.0)),
+)
+
+
+# Predictions of repeated payloads are served from an LRU cache keyed on the
+# feature values. It is cleared whenever the served artifacts change on disk.
+# INFERENCE_CACHE_SIZE=0 disables it; INFERENCE_CACHE_TTL=0 keeps entries until evicted.
+cache = PredictionCache(
+    [field.alias or name for name, field in Data.model_fields.items()],
+    maxsize=int(os.environ.get("INFERENCE_CACHE_SIZE", 10000)),
+    ttl=float(os.environ.get("INFERENCE_CACHE_TTL", 3600)) or None,
+    artifact_paths=[bundle_path] if bundle_path else [encoder_path, model_path],
+)
+
+# POST /admin/reload is refused unless INFERENCE_ADMIN_TOKEN is set and sent back
+# in the X-Admin-Token header.
+admin_token = os.environ.get("INFERENCE_ADMIN_TOKEN") or None
+reload_lock = asyncio.Lock()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Score the schema example on every backend worker before taking traffic.
+    example = {
+        field.alias or name: field.json_schema_extra["example"]
+        for name, field in Data.model_fields.items()
+    }
+    await backend.warm_up([example])
+    yield
+    backend.shutdown()
 
-path = os.path.join(project_path, "model", "model.pkl")  # TODO: enter the path for the saved model
-model = load_model(path)
 
 # TODO: create a RESTful API using FastAPI
 app = FastAPI(title = "Inference API",
                description = "API for sampling and inference",
-                version = "1.0.0") # your code here
+                version = "1.0.0",
+               lifespan=lifespan) # your code here
+app.add_middleware(MetricsMiddleware, metrics=metrics)
 
 # TODO: create a GET on the root giving a welcome message
 @app.get("/")
@@ -52,34 +174,160 @@ async def get_root():
 
 # TODO: create a POST on a different path that does model inference
 @app.post("/inference/")
-async def post_inference(data: Data):
-    # DO NOT MODIFY: turn the Pydantic model into a dict.
-    data_dict = data.dict()
-    # DO NOT MODIFY: clean up the dict to turn it into a Pandas DataFrame.
-    # The data has names with hyphens and Python does not allow those as variable names.
-    # Here it uses the functionality of FastAPI/Pydantic/etc to deal with this.
-    data = {k.replace("_", "-"): [v] for k, v in data_dict.items()}
-    data = pd.DataFrame.from_dict(data)
-
-    cat_features = [
-        "workclass",
-        "education",
-        "marital-status",
-        "occupation",
-        "relationship",
-        "race",
-        "sex",
-        "native-country",
-    ]
-    data_processed, _, _, _ = process_data(
-        # your code here
-        data,
-        categorical_features=cat_features,
-        encoder=encoder,
-        training=False,
-        # use data as data input
-        # use training = False
-        # do not need to pass lb as input
-    )
-    _inference = inference(model,data_processed) # your code here to predict the result using data_processed
-    return {"result": apply_label(_inference)}
\ No newline at end of file
+async def post_inference(data: Data, request: Request):
+    start = time.perf_counter()
+    if metrics.enabled:
+        # time from arrival (set by MetricsMiddleware) to here: routing and validation
+        arrived = getattr(request.state, "start_time", start)
+        metrics.observe("inference_stage_seconds", start - arrived, stage="validation")
+    # The payload is encoded straight into a numpy row with the precompiled lookup
+    # table on the backend; this gives the same output as
+    # process_data(training=False) without building a DataFrame.
+    record = data.dict(by_alias=True)
+    key = cache.key(record)
+    result = cache.get(key)
+    looked_up = time.perf_counter()
+    metrics.observe("inference_stage_seconds", looked_up - start, stage="cache_lookup")
+    metrics.inc("inference_cache_requests_total", result="miss" if result is None else "hit")
+    if result is None:
+        generation = backend.generation
+        _inference = await batcher.submit(record)
+        metrics.observe("inference_stage_seconds", time.perf_counter() - looked_up, stage="batch_wait")
+        result = apply_label(_inference)
+        # a prediction that raced a bundle swap may come from the old model
+        if backend.generation == generation:
+            cache.put(key, result)
+    return {"result": result}
+
+
+@app.post("/inference/file")
+async def post_inference_file(
+    request: Request,
+    format: str = Query(None, description="csv or ndjson; defaults from the Content-Type"),
+    chunk_rows: int = Query(10000, ge=1, le=100000),
+):
+    """ Score a streamed CSV or NDJSON upload in the schema of data/census.csv.
+
+    The upload is parsed in chunks of `chunk_rows` rows; each chunk is encoded with
+    the saved encoder, scored, and its labels are streamed back as one NDJSON line
+    `{"results": [...]}` before the next chunk is read, so memory stays bounded
+    whatever the file size. A chunk that cannot be scored (e.g. a non-numeric value
+    in a numeric column) is reported in-band as `{"error": ..., "rows": ...,
+    "chunk_rows": ...}` and the next chunk is scored. A final line reports the rows
+    scored, the rows that failed and rows/sec.
+    """
+    if format is None:
+        content_type = request.headers.get("content-type", "")
+        format = "ndjson" if "json" in content_type else "csv"
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {FORMATS}")
+
+    start = time.perf_counter()
+    frames = iter_frames(request.stream(), format, cache.columns, chunk_rows)
+    # Read the first chunk up front so a bad header is still reported as a 400.
+    try:
+        first = await frames.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    async def score():
+        rows = failed = 0
+        data = first
+        while data is not None:
+            try:
+                _inference, timings = await backend.run(predict_dataframe, data)
+            except Exception as exc:
+                # the status line is already sent, so report the chunk in-band
+                failed += len(data)
+                yield json.dumps({"error": f"{type(exc).__name__}: {exc}", "rows": rows,
+                                  "chunk_rows": len(data)}) + "\n"
+            else:
+                metrics.observe_stages(timings)
+                metrics.inc("inference_file_rows_total", len(data))
+                rows += len(data)
+                yield json.dumps({"results": apply_labels(_inference)}) + "\n"
+            try:
+                data = await frames.__anext__()
+            except StopAsyncIteration:
+                data = None
+            except ValueError as exc:
+                # the status line is already sent, so report bad rows in-band
+                yield json.dumps({"error": str(exc), "rows": rows}) + "\n"
+                return
+
+        elapsed = time.perf_counter() - start
+        yield json.dumps({"rows": rows, "failed_rows": failed, "seconds": elapsed,
+                          "rows_per_sec": rows / elapsed if elapsed else 0.0}) + "\n"
+
+    return DuplexStreamingResponse(score(), media_type="application/x-ndjson")
+
+
+@app.get("/inference/stats")
+async def get_inference_stats():
+    """ Report batch-size and queue-wait statistics of the micro-batcher."""
+    return batcher.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """ Expose stage latency histograms and counters in Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/inference/cache")
+async def get_cache_stats():
+    """ Report hit/miss/eviction counters of the prediction cache."""
+    return cache.stats()
+
+
+@app.post("/inference/batch")
+async def post_inference_batch(data: List[Data]):
+    """ Score a list of records with one encoding pass and one model call.
+
+    The labels are returned in the same order as the input records.
+    """
+    if not data:
+        return {"results": []}
+    records = [{k.replace("_", "-"): v for k, v in item.dict().items()} for item in data]
+    _inference, timings = await backend.run(predict_frame, records)
+    metrics.observe_stages(timings)
+    return {"results": apply_labels(_inference)}
+
+
+class Reload(BaseModel):
+    path: Optional[str] = None
+
+
+@app.post("/admin/reload")
+async def post_admin_reload(reload: Reload, x_admin_token: Optional[str] = Header(None)):
+    """ Atomically swap the served model bundle without restarting workers.
+
+    Loads the bundle at `path` (by default the served bundle path again, e.g. after
+    it was replaced on disk), checks its checksums and feature order, and only then
+    switches new requests over to it. Requests already being scored finish on the
+    old model, and the prediction cache is cleared. A bad bundle is rejected with a
+    400 and the old one keeps serving.
+    """
+    if admin_token is None or x_admin_token is None or not hmac.compare_digest(
+            x_admin_token.encode(), admin_token.encode()):
+        raise HTTPException(status_code=403, detail="admin token required")
+    path = reload.path or backend.bundle_path
+    if path is None:
+        raise HTTPException(status_code=400, detail="no bundle path given or served")
+    async with reload_lock:
+        try:
+            manifest = await backend.reload(path)
+        except (OSError, ValueError, KeyError, EOFError, pickle.UnpicklingError, AttributeError,
+                ImportError) as exc:
+            # the unpickling errors come from a bundle written by an incompatible library version
+            raise HTTPException(status_code=400, detail=f"cannot load bundle {path}: {exc}")
+        cache.artifact_paths = [path]
+        cache.clear()
+    return {
+        "path": path,
+        "version": manifest["version"],
+        "bundle_id": manifest["bundle_id"],
+        "generation": backend.generation,
+    }
@@ -0,0 +1,113 @@
+import asyncio
+import inspect
+import time
+
+import numpy as np
+
+
+class MicroBatcher:
+    """ Coalesces concurrent single-record requests into batched model calls.
+
+    Records submitted while a batch is open are collected and scored together with
+    one call to `predict_fn`. A batch is flushed as soon as it holds `max_batch_size`
+    records or `max_wait_ms` milliseconds after its first record arrived, whichever
+    comes first. Each caller gets back the prediction for its own record.
+
+    Inputs
+    ------
+    predict_fn : callable
+        Takes a list of records and returns one prediction per record. It may also
+        return an awaitable resolving to the predictions.
+    max_batch_size : int
+        Largest number of records scored in one call. Values <= 1 disable coalescing.
+    max_wait_ms : float
+        Longest time the first record of a batch waits for others to join it.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=32, max_wait_ms=2.0):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_ms = float(max_wait_ms)
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+        self.reset_stats()
+
+    def reset_stats(self):
+        """ Reset the batch-size and queue-wait statistics."""
+        self._batches = 0
+        self._requests = 0
+        self._batch_sizes = {}
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    async def submit(self, record):
+        """ Queue one record for scoring and wait for its prediction.
+
+        Inputs
+        ------
+        record : object
+            One record in the format expected by `predict_fn`.
+        Returns
+        -------
+        preds : np.array
+            Prediction for the record, as an array of shape (1,).
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((record, future, time.perf_counter()))
+
+        if len(self._pending) >= self.max_batch_size or self.max_wait_ms <= 0:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_ms / 1000.0, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        start = time.perf_counter()
+        self._record(len(batch), [start - enqueued for _, _, enqueued in batch])
+        try:
+            preds = self.predict_fn([record for record, _, _ in batch])
+            if inspect.isawaitable(preds):
+                preds = await preds
+            preds = np.asarray(preds)
+        except Exception as exc:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for i, (_, future, _) in enumerate(batch):
+            if not future.done():
+                future.set_result(preds[i:i + 1])
+
+    def _record(self, size, waits):
+        self._batches += 1
+        self._requests += size
+        self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+        self._wait_total += sum(waits)
+        self._wait_max = max(self._wait_max, max(waits))
+
+    def stats(self):
+        """ Return batch-size and queue-wait statistics as a dict."""
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "pending": len(self._pending),
+            "batches": self._batches,
+            "requests": self._requests,
+            "mean_batch_size": self._requests / self._batches if self._batches else 0.0,
+            "batch_size_counts": {str(k): v for k, v in sorted(self._batch_sizes.items())},
+            "mean_queue_wait_ms": 1000.0 * self._wait_total / self._requests if self._requests else 0.0,
+            "max_queue_wait_ms": 1000.0 * self._wait_max,
+        }
@@ -0,0 +1,169 @@
+""" Versioned single-file model bundle.
+
+A bundle is a zip archive holding everything needed to serve or evaluate one
+trained model:
+
+    manifest.json   format version, bundle version and id, feature order, label,
+                    training metadata and the SHA-256 of every member
+    encoder.pkl     fitted encoder of `process_data`
+    lb.pkl          fitted LabelBinarizer
+    model.pkl       trained model
+
+Opening a bundle only reads its manifest; each pickle is read, checked against
+its checksum and unpickled on first access. The archive stays open, so members
+loaded later still come from the same file even if the path is atomically
+replaced in the meantime.
+"""
+import datetime
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import zipfile
+
+FORMAT_VERSION = 1
+MEMBERS = ("encoder", "lb", "model")
+
+
+def save_bundle(path, model, encoder, lb, categorical_features, continuous_features, label="salary",
+                version=None, metadata=None):
+    """ Write a bundle to `path` atomically and return its manifest.
+
+    Inputs
+    ------
+    path : str
+        Bundle file to write; replaced in one step if it exists.
+    model
+        Trained machine learning model.
+    encoder : sklearn.preprocessing._encoders.OneHotEncoder or OrdinalEncoder
+        Trained encoder the model was fitted with.
+    lb : sklearn.preprocessing._label.LabelBinarizer
+        Trained LabelBinarizer.
+    categorical_features: list[str]
+        Names of the categorical features, in encoder order.
+    continuous_features: list[str]
+        Names of the continuous features, in training column order.
+    label : str
+        Name of the label column (default="salary").
+    version : str
+        Human readable version (default=UTC creation time).
+    metadata : dict
+        JSON-serializable training metadata, e.g. hyperparameters and metrics.
+    Returns
+    -------
+    manifest : dict
+    """
+    created = datetime.datetime.now(datetime.timezone.utc)
+    payloads = {name: pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+                for name, obj in zip(MEMBERS, (encoder, lb, model))}
+    checksums = {name: hashlib.sha256(data).hexdigest() for name, data in payloads.items()}
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "version": version or created.strftime("%Y%m%dT%H%M%SZ"),
+        "bundle_id": hashlib.sha256(json.dumps(checksums, sort_keys=True).encode()).hexdigest()[:16],
+        "created": created.isoformat(timespec="seconds"),
+        "categorical_features": list(categorical_features),
+        "continuous_features": list(continuous_features),
+        "label": label,
+        "metadata": metadata or {},
+        "checksums": checksums,
+    }
+
+    fd, tmp = tempfile.mkstemp(prefix=".bundle-", dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "wb") as f, zipfile.ZipFile(f, "w", zipfile.ZIP_STORED) as archive:
+            archive.writestr("manifest.json", json.dumps(manifest, indent=2))
+            for name, data in payloads.items():
+                archive.writestr(name + ".pkl", data)
+        # mkstemp creates the file private to this user
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return manifest
+
+
+class ModelBundle:
+    """ Lazily loaded bundle written by `save_bundle`; use `ModelBundle.open(path)`."""
+
+    def __init__(self, path, archive, manifest):
+        self.path = path
+        self.manifest = manifest
+        self._archive = archive
+        self._loaded = {}
+
+    @classmethod
+    def open(cls, path):
+        """ Read the manifest of the bundle at `path`."""
+        try:
+            archive = zipfile.ZipFile(path)
+        except zipfile.BadZipFile as exc:
+            raise ValueError(f"{path} is not a model bundle: {exc}") from exc
+        try:
+            manifest = json.loads(archive.read("manifest.json"))
+        except (KeyError, ValueError) as exc:
+            archive.close()
+            raise ValueError(f"{path} is not a model bundle: {exc}") from exc
+        if manifest.get("format_version") != FORMAT_VERSION:
+            archive.close()
+            raise ValueError(f"Unsupported bundle format {manifest.get('format_version')!r} in {path}.")
+        return cls(path, archive, manifest)
+
+    @property
+    def version(self):
+        return self.manifest["version"]
+
+    @property
+    def bundle_id(self):
+        return self.manifest["bundle_id"]
+
+    @property
+    def categorical_features(self):
+        return self.manifest["categorical_features"]
+
+    @property
+    def continuous_features(self):
+        return self.manifest["continuous_features"]
+
+    @property
+    def metadata(self):
+        return self.manifest["metadata"]
+
+    @property
+    def encoder(self):
+        return self._member("encoder")
+
+    @property
+    def lb(self):
+        return self._member("lb")
+
+    @property
+    def model(self):
+        return self._member("model")
+
+    def _read(self, name):
+        data = self._archive.read(name + ".pkl")
+        if hashlib.sha256(data).hexdigest() != self.manifest["checksums"][name]:
+            raise ValueError(f"Checksum mismatch for {name} in {self.path}.")
+        return data
+
+    def _member(self, name):
+        if name not in self._loaded:
+            self._loaded[name] = pickle.loads(self._read(name))
+        return self._loaded[name]
+
+    def verify(self):
+        """ Check the checksum of every member without unpickling it."""
+        for name in MEMBERS:
+            self._read(name)
+
+    def check_features(self, categorical_features, continuous_features):
+        """ Raise ValueError unless the bundle was trained on these features, in order."""
+        if (self.categorical_features != list(categorical_features)
+                or self.continuous_features != list(continuous_features)):
+            raise ValueError(f"Features in {self.path} do not match the served schema.")
+
+    def close(self):
+        self._archive.close()
@@ -0,0 +1,123 @@
+import os
+import time
+from collections import OrderedDict
+
+
+def artifact_fingerprint(paths):
+    """ Return a cheap fingerprint (mtime, size, inode) of the given artifact files.
+
+    A directory contributes the fingerprint of every file directly inside it.
+    """
+    fingerprint = []
+    for path in paths:
+        if os.path.isdir(path):
+            fingerprint.append(artifact_fingerprint(sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+            )))
+            continue
+        try:
+            st = os.stat(path)
+            fingerprint.append((path, st.st_mtime_ns, st.st_size, st.st_ino))
+        except FileNotFoundError:
+            fingerprint.append((path, None, None, None))
+    return tuple(fingerprint)
+
+
+class PredictionCache:
+    """ Bounded LRU cache with an optional TTL for predictions of repeated records.
+
+    Records are keyed on a canonical tuple of their feature values in a fixed column
+    order, so payloads that differ only in key order share an entry. The cache keeps
+    a fingerprint of the artifact files the predictions came from and clears itself
+    when any of them changes on disk.
+
+    Inputs
+    ------
+    columns : list[str]
+        Feature names, in the order used to build the key.
+    maxsize : int
+        Largest number of entries kept. 0 disables the cache.
+    ttl : float
+        Seconds an entry stays valid. None keeps entries until they are evicted.
+    artifact_paths : list[str]
+        Files whose change invalidates every cached prediction (default=[]).
+    check_interval : float
+        Seconds between two checks of the artifact files (default=1.0).
+    """
+
+    def __init__(self, columns, maxsize=10000, ttl=None, artifact_paths=(), check_interval=1.0):
+        self.columns = list(columns)
+        self.maxsize = max(0, int(maxsize))
+        self.ttl = ttl
+        self.artifact_paths = list(artifact_paths)
+        self.check_interval = check_interval
+        self._entries = OrderedDict()
+        self._fingerprint = artifact_fingerprint(self.artifact_paths)
+        self._next_check = time.monotonic() + check_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def key(self, record):
+        """ Build the canonical cache key of a record."""
+        return tuple(record[c] for c in self.columns)
+
+    def get(self, key):
+        """ Return the cached prediction for `key`, or None on a miss."""
+        if not self.maxsize:
+            return None
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._check_artifacts(now)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires = entry
+        if expires is not None and now >= expires:
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """ Store a prediction, evicting the least recently used entries if full."""
+        if not self.maxsize:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        self._entries[key] = (value, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """ Drop every entry and take a fresh fingerprint of the artifacts."""
+        self._entries.clear()
+        self._fingerprint = artifact_fingerprint(self.artifact_paths)
+        self.invalidations += 1
+
+    def _check_artifacts(self, now):
+        self._next_check = now + self.check_interval
+        if artifact_fingerprint(self.artifact_paths) != self._fingerprint:
+            self.clear()
+
+    def stats(self):
+        """ Return hit/miss/eviction counters as a dict."""
+        lookups = self.hits + self.misses
+        return {
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,170 @@
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+ARRAYS = ("roots", "feature", "threshold", "children", "value", "classes")
+
+
+class CompiledGradientBoosting:
+    """ Array-backed scoring engine for a binary GradientBoostingClassifier.
+
+    The trees of the fitted model are flattened into contiguous numpy arrays of node
+    features, thresholds, children and leaf values. A whole batch is then scored
+    level by level: at each level every (row, tree) pair moves one step down its
+    tree with a single vectorized comparison. Leaves point to themselves, so rows
+    that reach a leaf early simply stay there.
+
+    Children are stored interleaved, `children[2 * node]` being the left and
+    `children[2 * node + 1]` the right child, so one gather picks the next node.
+    The arrays are used as they are, which lets `load(..., mmap_mode="r")` share
+    them read-only between worker processes through the page cache.
+
+    Use `compile_model` to build one from a trained model.
+    """
+
+    def __init__(self, roots, feature, threshold, children, value, classes, base, max_depth,
+                 n_features_in):
+        self.roots = roots
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.value = value
+        self.classes = classes
+        self.base = float(base)
+        self.max_depth = int(max_depth)
+        self.n_features_in_ = int(n_features_in)
+
+    @property
+    def left(self):
+        return self.children[0::2]
+
+    @property
+    def right(self):
+        return self.children[1::2]
+
+    def decision_function(self, X):
+        """ Return the raw boosting score (log-odds of the positive class) per row.
+
+        A scipy.sparse X is densified first; serving batches are bounded in size, so
+        this costs at most one batch of dense rows.
+        """
+        if hasattr(X, "toarray"):
+            X = X.toarray()
+        # sklearn trees compare float32 features against float64 thresholds.
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"X has shape {X.shape}, expected (n, {self.n_features_in_}).")
+        flat = np.ascontiguousarray(X).ravel()
+        row_start = (np.arange(X.shape[0]) * X.shape[1])[:, None]
+        node = np.broadcast_to(self.roots, (X.shape[0], len(self.roots)))
+        for _ in range(self.max_depth):
+            go_right = ~(flat[row_start + self.feature[node]] <= self.threshold[node])
+            node = self.children[2 * node + go_right]
+        return self.base + self.value[node].sum(axis=1)
+
+    def predict(self, X):
+        """ Predict class labels, like `GradientBoostingClassifier.predict`."""
+        return self.classes[(self.decision_function(X) > 0).astype(np.intp)]
+
+    def save(self, path, record_encoder=None):
+        """ Write the engine to directory `path` as one .npy file per array.
+
+        The files are written to a new directory next to `path`, which then
+        replaces it. Serving workers keep reading the files they have mapped from
+        the old directory; no mapped file is ever rewritten. `record_encoder`, a
+        RecordEncoder, is written along as `encoder.json` so that both change
+        together.
+        """
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=".compiled-", dir=parent)
+        try:
+            for name in ARRAYS:
+                np.save(os.path.join(staging, f"{name}.npy"), getattr(self, name))
+            meta = {"base": self.base, "max_depth": self.max_depth, "n_features_in": self.n_features_in_}
+            with open(os.path.join(staging, "meta.json"), "w") as f:
+                json.dump(meta, f)
+            if record_encoder is not None:
+                record_encoder.save(os.path.join(staging, "encoder.json"))
+            # mkdtemp creates the directory private to this user
+            os.chmod(staging, 0o755)
+            # a directory cannot replace a non-empty one: move the old one aside first
+            old = staging + ".old"
+            if os.path.exists(path):
+                os.rename(path, old)
+            os.rename(staging, path)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        shutil.rmtree(old, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        """ Load an engine written by `save`, optionally memory-mapping the arrays."""
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode, allow_pickle=False)
+            for name in ARRAYS
+        }
+        return cls(**arrays, **meta)
+
+
+def compile_model(model):
+    """ Flatten the trees of a trained model into a CompiledGradientBoosting.
+
+    Inputs
+    ------
+    model : GridSearchCV, HalvingSearch or GradientBoostingClassifier
+        Trained binary gradient boosting model, as returned by `train_model`.
+    Returns
+    -------
+    compiled : CompiledGradientBoosting
+        Engine giving the same predictions as `model.predict`.
+    """
+    # sklearn is only needed to compile, not to serve a compiled engine.
+    from sklearn.dummy import DummyClassifier
+
+    # GridSearchCV, or the HalvingSearch of train_model(search="halving").
+    model = getattr(model, "best_estimator_", model)
+    if len(model.classes_) != 2:
+        raise ValueError("Only binary GradientBoostingClassifier models can be compiled.")
+    if not (model.init_ == "zero" or isinstance(model.init_, DummyClassifier)):
+        raise ValueError("Only models with the default or 'zero' init estimator can be compiled.")
+
+    roots, features, thresholds, children, values = [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for estimator in model.estimators_[:, 0]:
+        tree = estimator.tree_
+        nodes = np.arange(tree.node_count)
+        is_leaf = tree.children_left == -1
+        roots.append(offset)
+        features.append(np.where(is_leaf, 0, tree.feature))
+        thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+        left = np.where(is_leaf, nodes, tree.children_left) + offset
+        right = np.where(is_leaf, nodes, tree.children_right) + offset
+        children.append(np.stack([left, right], axis=1).ravel())
+        values.append(np.where(is_leaf, tree.value[:, 0, 0] * model.learning_rate, 0.0))
+        offset += tree.node_count
+        max_depth = max(max_depth, tree.max_depth)
+
+    compiled = CompiledGradientBoosting(
+        roots=np.asarray(roots, dtype=np.intp),
+        feature=np.concatenate(features).astype(np.intp),
+        threshold=np.concatenate(thresholds).astype(np.float64),
+        children=np.concatenate(children).astype(np.intp),
+        value=np.concatenate(values).astype(np.float64),
+        classes=np.asarray(model.classes_),
+        base=0.0,
+        max_depth=max_depth,
+        n_features_in=model.n_features_in_,
+    )
+    # The initial estimator's raw prediction does not depend on X for the default
+    # prior init, so it is recovered as the gap between sklearn and the trees alone.
+    X0 = np.zeros((1, model.n_features_in_))
+    compiled.base = float(model.decision_function(X0)[0] - compiled.decision_function(X0)[0])
+    return compiled
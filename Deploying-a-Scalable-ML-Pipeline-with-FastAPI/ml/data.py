@@ -1,5 +1,6 @@
+import json
+
 import numpy as np
-from sklearn.preprocessing import LabelBinarizer, OneHotEncoder
 
 
 def process_data(
@@ -8,7 +9,9 @@ def process_data(
         label=None,
         training=True,
         encoder=None,
-        lb=None):
+        lb=None,
+        sparse=False,
+        encoding="onehot"):
     """ Process the data used in the machine learning pipeline.
 
     Processes the data using one hot encoding for the categorical features and a
@@ -33,15 +36,24 @@ def process_data(
         Trained sklearn OneHotEncoder, only used if training=False.
     lb : sklearn.preprocessing._label.LabelBinarizer
         Trained sklearn LabelBinarizer, only used if training=False.
+    sparse : bool
+        If True, keep the one hot block sparse and return X as a scipy.sparse CSR
+        matrix instead of a dense array (default=False). The columns are the same
+        either way, and an encoder fitted in one mode can be used in the other.
+    encoding : str
+        "onehot" to one hot encode the categorical features, or "ordinal" to replace
+        each by a single integer code column for models with native categorical
+        support; unknown categories become NaN (default="onehot"). Only used if
+        training=True; otherwise the kind of `encoder` decides.
 
     Returns
     -------
-    X : np.array
+    X : np.array or scipy.sparse.csr_matrix
         Processed data.
     y : np.array
         Processed labels if labeled=True, otherwise empty np.array.
-    encoder : sklearn.preprocessing._encoders.OneHotEncoder
-        Trained OneHotEncoder if training is True, otherwise returns the encoder passed
+    encoder : sklearn.preprocessing._encoders.OneHotEncoder or OrdinalEncoder
+        Trained encoder if training is True, otherwise returns the encoder passed
         in.
     lb : sklearn.preprocessing._label.LabelBinarizer
         Trained LabelBinarizer if training is True, otherwise returns the binarizer
@@ -54,11 +66,21 @@ def process_data(
     else:
         y = np.array([])
 
+    # Imported here so serving from precompiled artifacts does not load sklearn.
+    from sklearn.preprocessing import LabelBinarizer, OneHotEncoder, OrdinalEncoder
+
     X_categorical = X[categorical_features].values
     X_continuous = X.drop(*[categorical_features], axis=1)
 
     if training is True:
-        encoder = OneHotEncoder(sparse_output=False, handle_unknown="ignore")
+        if sparse and encoding == "ordinal":
+            raise ValueError("sparse=True only applies to the onehot encoding.")
+        if encoding == "ordinal":
+            encoder = OrdinalEncoder(handle_unknown="use_encoded_value", unknown_value=np.nan)
+        elif encoding == "onehot":
+            encoder = OneHotEncoder(sparse_output=sparse, handle_unknown="ignore")
+        else:
+            raise ValueError(f"Unknown encoding {encoding!r}, expected 'onehot' or 'ordinal'.")
         lb = LabelBinarizer()
         X_categorical = encoder.fit_transform(X_categorical)
         y = lb.fit_transform(y.values).ravel()
@@ -70,7 +92,15 @@ def process_data(
         except AttributeError:
             pass
 
-    X = np.concatenate([X_continuous, X_categorical], axis=1)
+    if sparse:
+        from scipy import sparse as sp
+
+        X = sp.hstack([sp.csr_matrix(X_continuous.to_numpy(dtype=np.float64)),
+                       sp.csr_matrix(X_categorical)], format="csr")
+    else:
+        if hasattr(X_categorical, "toarray"):
+            X_categorical = X_categorical.toarray()
+        X = np.concatenate([X_continuous, X_categorical], axis=1)
     return X, y, encoder, lb
 
 
@@ -80,3 +110,171 @@ def apply_label(inference):
         return ">50K"
     elif inference[0] == 0:
         return "<=50K"
+
+
+def apply_labels(inference):
+    """ Convert an array of binary labels into a list of string outputs."""
+    return np.where(np.asarray(inference) == 1, ">50K", "<=50K").tolist()
+
+
+def extend_encoder(encoder, X, categorical_features, n_continuous):
+    """ Refit a trained encoder so that it also knows the new categories in `X`.
+
+    The known categories keep their order and the new ones are appended after
+    them, feature by feature, so ordinal codes are unchanged. One hot columns
+    shift, since every feature block after the first may grow; `column_map` gives
+    the new position of each column of the old `process_data` output, so a model
+    trained on the old layout can be carried over (see `warm_start_model`).
+
+    Inputs
+    ------
+    encoder : sklearn.preprocessing._encoders.OneHotEncoder or OrdinalEncoder
+        Trained encoder, as returned by `process_data(training=True)`.
+    X : pd.DataFrame
+        Data that may hold unseen categories.
+    categorical_features: list[str]
+        Names of the categorical features, in the order the encoder was fitted on.
+    n_continuous : int
+        Number of continuous columns in front of the encoded block.
+    Returns
+    -------
+    encoder : sklearn.preprocessing._encoders.OneHotEncoder or OrdinalEncoder
+        New trained encoder with the same parameters.
+    column_map : np.array
+        Old column index -> new column index.
+    """
+    from sklearn.base import clone
+
+    categories = []
+    for known, name in zip(encoder.categories_, categorical_features):
+        seen = set(known.tolist())
+        categories.append(list(known) + sorted(v for v in set(X[name]) if v not in seen))
+    extended = clone(encoder).set_params(categories=categories).fit(X[categorical_features].values)
+
+    column_map = [np.arange(n_continuous)]
+    if hasattr(encoder, "unknown_value"):
+        column_map.append(np.arange(n_continuous, n_continuous + len(categories)))
+    else:
+        offset = n_continuous
+        for known, values in zip(encoder.categories_, categories):
+            column_map.append(np.arange(offset, offset + len(known)))
+            offset += len(values)
+    return extended, np.concatenate(column_map)
+
+
+class RecordEncoder:
+    """ Precompiled encoder that writes single records straight into numpy rows.
+
+    Built once from a fitted OneHotEncoder, it replaces the DataFrame construction,
+    `X.drop`, `OneHotEncoder.transform` and `np.concatenate` done by
+    `process_data(training=False)` with a category-to-column lookup table. The output
+    is identical to `process_data`: continuous features first, in the given order,
+    followed by the one hot encoded categorical features. Unknown categories leave
+    their block at zero, like `handle_unknown="ignore"`.
+
+    Built from an OrdinalEncoder (`process_data(encoding="ordinal")`), the lookup
+    table maps each category to its integer code instead, and unknown categories are
+    written as the encoder's `unknown_value`.
+
+    Inputs
+    ------
+    encoder : sklearn.preprocessing._encoders.OneHotEncoder or OrdinalEncoder
+        Trained sklearn encoder, as returned by `process_data(training=True)`.
+    categorical_features: list[str]
+        Names of the categorical features, in the order used to fit `encoder`.
+    continuous_features: list[str]
+        Names of the continuous features, in the column order used for training.
+    """
+
+    def __init__(self, encoder, categorical_features, continuous_features):
+        if getattr(encoder, "drop", None) is not None or getattr(encoder, "_infrequent_enabled", False):
+            raise ValueError("RecordEncoder only supports encoders without drop or infrequent categories.")
+        encoding = "ordinal" if hasattr(encoder, "unknown_value") else "onehot"
+        self._build([list(c) for c in encoder.categories_], categorical_features,
+                    continuous_features, encoder.handle_unknown, encoding,
+                    getattr(encoder, "unknown_value", None))
+
+    def _build(self, categories, categorical_features, continuous_features, handle_unknown,
+               encoding="onehot", unknown_value=None):
+        self.categories = categories
+        self.categorical_features = list(categorical_features)
+        self.continuous_features = list(continuous_features)
+        self.handle_unknown = handle_unknown
+        self.encoding = encoding
+        self.unknown_value = unknown_value
+
+        offset = len(self.continuous_features)
+        self.lookup = []
+        for values in categories:
+            if encoding == "ordinal":
+                self.lookup.append({value: float(i) for i, value in enumerate(values)})
+            else:
+                self.lookup.append({value: offset + i for i, value in enumerate(values)})
+                offset += len(values)
+        self.width = offset + len(categories) if encoding == "ordinal" else offset
+
+    def save(self, path):
+        """ Write the lookup table to a JSON file, so serving needs no pickled encoder."""
+        with open(path, "w") as f:
+            json.dump({
+                "categorical_features": self.categorical_features,
+                "continuous_features": self.continuous_features,
+                "categories": [[_to_json(v) for v in values] for values in self.categories],
+                "handle_unknown": self.handle_unknown,
+                "encoding": self.encoding,
+                "unknown_value": self.unknown_value,
+            }, f)
+
+    @classmethod
+    def load(cls, path):
+        """ Load a RecordEncoder written by `save`."""
+        with open(path) as f:
+            spec = json.load(f)
+        record_encoder = cls.__new__(cls)
+        record_encoder._build(spec["categories"], spec["categorical_features"],
+                              spec["continuous_features"], spec["handle_unknown"],
+                              spec.get("encoding", "onehot"), spec.get("unknown_value"))
+        return record_encoder
+
+    def transform_one(self, record, out=None):
+        """ Encode one record into a (1, width) array.
+
+        Inputs
+        ------
+        record : Mapping
+            Feature values keyed by column name (e.g. "native-country").
+        out : np.array
+            Optional preallocated float array of shape (width,) or (1, width).
+        Returns
+        -------
+        X : np.array
+            Processed row of shape (1, width).
+        """
+        if out is None:
+            out = np.zeros((1, self.width))
+        else:
+            out[...] = 0.0
+        row = out.reshape(-1)
+        for i, name in enumerate(self.continuous_features):
+            row[i] = record[name]
+        offset = len(self.continuous_features)
+        for j, (name, lookup) in enumerate(zip(self.categorical_features, self.lookup)):
+            found = lookup.get(record[name])
+            if found is None and self.handle_unknown == "error":
+                raise ValueError(f"Found unknown category {record[name]!r} in feature {name!r}.")
+            if self.encoding == "ordinal":
+                row[offset + j] = self.unknown_value if found is None else found
+            elif found is not None:
+                row[found] = 1.0
+        return out.reshape(1, self.width)
+
+    def transform(self, records):
+        """ Encode a sequence of records into a preallocated (n, width) array."""
+        X = np.zeros((len(records), self.width))
+        for i, record in enumerate(records):
+            self.transform_one(record, out=X[i])
+        return X
+
+
+def _to_json(value):
+    return value.item() if isinstance(value, np.generic) else value
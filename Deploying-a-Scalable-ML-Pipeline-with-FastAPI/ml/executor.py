@@ -0,0 +1,254 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pandas as pd
+
+from ml.bundle import ModelBundle
+from ml.compiled import CompiledGradientBoosting, compile_model
+from ml.data import RecordEncoder, process_data
+from ml.model import inference, load_model
+
+BACKENDS = ("inline", "thread", "process")
+ENGINES = ("mmap", "compiled", "sklearn")
+
+# Artifacts used by the scoring functions below, loaded once per process by
+# `load_state` (in the serving process and in every process-pool worker). A reload
+# builds a new dict and rebinds the name, and every scoring call reads it once, so
+# a call in flight during a swap finishes on the artifacts it started with.
+_state = {}
+
+
+def artifact_paths(model_dir, engine):
+    """ Return the (encoder, model) paths served from `model_dir` for `engine`."""
+    encoder_path = os.path.join(model_dir, "encoder.pkl")
+    if engine == "mmap":
+        return encoder_path, os.path.join(model_dir, "compiled")
+    return encoder_path, os.path.join(model_dir, "model.pkl")
+
+
+def load_state(model_dir, engine, categorical_features, continuous_features, sparse=False,
+               bundle_path=None, generation=0):
+    """ Load the artifacts in `model_dir` for the scoring functions of this process.
+
+    "mmap" memory-maps the arrays exported to `compiled/` read-only, so all worker
+    processes share one copy through the page cache, and reads the RecordEncoder
+    lookup table from `compiled/encoder.json`. Neither model.pkl nor sklearn is
+    loaded; encoder.pkl is only unpickled once `predict_dataframe` needs it.
+    "compiled" unpickles model.pkl and flattens its trees in memory, and "sklearn"
+    serves the unpickled GridSearchCV as it is.
+
+    With `bundle_path`, the encoder and model come from that bundle (see
+    ml/bundle.py) instead of `model_dir`, served by the "sklearn" or "compiled"
+    engine.
+
+    Inputs
+    ------
+    model_dir : str
+        Directory holding encoder.pkl, model.pkl and compiled/.
+    engine : str
+        One of "mmap", "compiled" or "sklearn".
+    categorical_features: list[str]
+        Names of the categorical features.
+    continuous_features: list[str]
+        Names of the continuous features, in training column order.
+    sparse : bool
+        Encode DataFrames in `predict_dataframe` as CSR matrices (default=False).
+    bundle_path : str
+        Model bundle to serve instead of the files in `model_dir` (default=None).
+    generation : int
+        Reload counter of `InferenceBackend`, kept with the state.
+    """
+    global _state
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine!r}, expected one of {ENGINES}.")
+    encoder_path, model_path = artifact_paths(model_dir, engine)
+    bundle = None
+    if bundle_path is not None:
+        if engine == "mmap":
+            raise ValueError("A bundle is served with the 'sklearn' or 'compiled' engine, not 'mmap'.")
+        bundle = ModelBundle.open(bundle_path)
+        bundle.check_features(categorical_features, continuous_features)
+        encoder = bundle.encoder
+        model = bundle.model
+        if engine == "compiled":
+            model = compile_model(model)
+        record_encoder = RecordEncoder(encoder, categorical_features, continuous_features)
+    elif engine == "mmap":
+        encoder = None
+        model = CompiledGradientBoosting.load(model_path, mmap_mode="r")
+        record_encoder = RecordEncoder.load(os.path.join(model_path, "encoder.json"))
+        if (record_encoder.categorical_features != list(categorical_features)
+                or record_encoder.continuous_features != list(continuous_features)):
+            raise ValueError(f"Features in {model_path} do not match the served schema.")
+    else:
+        encoder = load_model(encoder_path)
+        model = load_model(model_path)
+        if engine == "compiled":
+            model = compile_model(model)
+        record_encoder = RecordEncoder(encoder, categorical_features, continuous_features)
+    _state = dict(
+        encoder=encoder,
+        encoder_path=encoder_path,
+        model=model,
+        categorical_features=list(categorical_features),
+        record_encoder=record_encoder,
+        sparse=sparse,
+        bundle=bundle,
+        generation=generation,
+    )
+
+
+def _encoder(state):
+    if state["encoder"] is None:
+        state["encoder"] = load_model(state["encoder_path"])
+    return state["encoder"]
+
+
+def predict_records(records):
+    """ Encode records with the precompiled RecordEncoder and predict them in one call.
+
+    Returns the predictions and a dict of stage name -> seconds spent.
+    """
+    state = _state
+    start = time.perf_counter()
+    X = state["record_encoder"].transform(records)
+    encoded = time.perf_counter()
+    preds = inference(state["model"], X)
+    return preds, {"encode": encoded - start, "predict": time.perf_counter() - encoded}
+
+
+def predict_dataframe(data):
+    """ Encode a DataFrame of feature columns with `process_data` and predict it.
+
+    Returns the predictions and a dict of stage name -> seconds spent.
+    """
+    state = _state
+    start = time.perf_counter()
+    X, _, _, _ = process_data(
+        data,
+        categorical_features=state["categorical_features"],
+        encoder=_encoder(state),
+        training=False,
+        sparse=state["sparse"],
+    )
+    encoded = time.perf_counter()
+    preds = inference(state["model"], X)
+    return preds, {"encode": encoded - start, "predict": time.perf_counter() - encoded}
+
+
+def predict_frame(records):
+    """ Encode records with one vectorized `process_data` call and predict them.
+
+    Returns the predictions and a dict of stage name -> seconds spent.
+    """
+    start = time.perf_counter()
+    data = pd.DataFrame.from_records(records)
+    framed = time.perf_counter()
+    preds, timings = predict_dataframe(data)
+    timings["dataframe"] = framed - start
+    return preds, timings
+
+
+class InferenceBackend:
+    """ Runs the encode+predict stage inline, in a thread pool or in a process pool.
+
+    "inline" calls the scoring function on the event loop, "thread" hands it to a
+    thread pool so the loop keeps serving other requests, and "process" sends it to
+    worker processes that each load the artifacts once at start-up with
+    `load_state`.
+
+    Inputs
+    ------
+    mode : str
+        One of "inline", "thread" or "process".
+    model_dir : str
+        Directory of the artifacts loaded by each process-pool worker.
+    categorical_features: list[str]
+        Names of the categorical features.
+    continuous_features: list[str]
+        Names of the continuous features, in training column order.
+    max_workers : int
+        Pool size for the "thread" and "process" modes (default=cpu count).
+    engine : str
+        Engine loaded by process-pool workers, see `load_state`.
+    sparse : bool
+        Sparse DataFrame encoding in process-pool workers, see `load_state`.
+    bundle_path : str
+        Model bundle loaded by process-pool workers, see `load_state`.
+    """
+
+    def __init__(self, mode, model_dir, categorical_features, continuous_features,
+                 max_workers=None, engine="mmap", sparse=False, bundle_path=None):
+        if mode not in BACKENDS:
+            raise ValueError(f"Unknown backend {mode!r}, expected one of {BACKENDS}.")
+        self.mode = mode
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.state_args = (model_dir, engine, categorical_features, continuous_features, sparse, bundle_path)
+        self.generation = 0
+        if mode == "thread":
+            self.pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        elif mode == "process":
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                initializer=load_state,
+                initargs=self.state_args,
+            )
+        else:
+            self.pool = None
+
+    @property
+    def bundle_path(self):
+        return self.state_args[5]
+
+    async def run(self, fn, *args):
+        """ Run a module-level scoring function such as `predict_records` on the backend."""
+        if self.pool is None:
+            return fn(*args)
+        if self.mode == "process":
+            return await asyncio.get_running_loop().run_in_executor(
+                self.pool, _run_current, self.generation, self.state_args, fn, *args)
+        return await asyncio.get_running_loop().run_in_executor(self.pool, fn, *args)
+
+    async def reload(self, bundle_path):
+        """ Swap in the bundle at `bundle_path` without restarting the pool.
+
+        The bundle is loaded and checked off the event loop; on failure the served
+        state is unchanged. Calls already running finish on the old state. Process
+        workers load the new bundle before their next call; `max_workers` no-op calls
+        are sent right away so that most of them do it now, but a worker none of them
+        reached catches up on its first scoring call. Returns the manifest of the new
+        bundle.
+        """
+        model_dir, engine = self.state_args[:2]
+        # bundles are not memory-mapped; they replace an "mmap" engine by "sklearn"
+        engine = "sklearn" if engine == "mmap" else engine
+        state_args = (model_dir, engine) + self.state_args[2:5] + (bundle_path,)
+        generation = self.generation + 1
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, lambda: load_state(*state_args, generation=generation))
+        self.state_args, self.generation = state_args, generation
+        if self.mode == "process":
+            await asyncio.gather(*(self.run(_noop) for _ in range(self.max_workers)))
+        return _state["bundle"].manifest
+
+    async def warm_up(self, records):
+        """ Score `records` once per pool worker, so no request pays for cold start."""
+        runs = self.max_workers if self.pool is not None else 1
+        await asyncio.gather(*(self.run(predict_records, records) for _ in range(runs)))
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+
+
+def _run_current(generation, state_args, fn, *args):
+    # Process-pool entry point: catch up with a reload before scoring.
+    if _state.get("generation") != generation:
+        load_state(*state_args, generation=generation)
+    return fn(*args)
+
+
+def _noop():
+    return None
@@ -0,0 +1,236 @@
+""" Content-addressed on-disk cache of `process_data` outputs.
+
+Each entry is a directory named after a SHA-256 key of the input frame (its
+columns, dtypes and `pd.util.hash_pandas_object` row hashes), the
+`process_data` options and, in inference mode, a fingerprint of the encoder and
+label binarizer. X and y are stored as .npy files and read back memory-mapped,
+so a cache hit costs one hash of the frame instead of an encoding pass. CSR
+matrices are stored as their data/indices/indptr arrays.
+
+The cache is bounded in bytes and evicts the least recently used entries. To
+invalidate it from the command line:
+
+    python -m ml.feature_cache clear --dir .feature_cache
+    python -m ml.feature_cache stats --dir .feature_cache
+"""
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from ml.data import process_data
+
+# Bump when the layout of an entry or the output of `process_data` changes.
+FORMAT_VERSION = 1
+
+
+# Fitted attributes that determine the output of an encoder or label binarizer.
+_FITTED_ATTRIBUTES = ("categories_", "drop_idx_", "infrequent_categories_", "n_features_in_",
+                      "classes_", "y_type_", "sparse_input_")
+
+
+def _describe(value):
+    # JSON-able description of a parameter or fitted attribute, with element types
+    # so that e.g. 1 and "1" differ
+    if isinstance(value, np.ndarray):
+        return {"dtype": value.dtype.str, "shape": list(value.shape),
+                "values": [_describe(v) for v in value.ravel().tolist()]}
+    if isinstance(value, (list, tuple)):
+        return [_describe(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _describe(v) for k, v in sorted(value.items())}
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return [type(value).__name__, value if not isinstance(value, float) or np.isfinite(value) else repr(value)]
+    return [type(value).__name__, repr(value)]
+
+
+def encoder_fingerprint(encoder, lb):
+    """ Return a hex digest identifying a fitted encoder and label binarizer.
+
+    It hashes their class, parameters and fitted attributes (`categories_`,
+    `classes_`, ...), not their pickle, so it is stable across runs and library
+    versions that fit the same encoder.
+    """
+    description = []
+    for obj in (encoder, lb):
+        if obj is None:
+            description.append(None)
+            continue
+        description.append({
+            "class": type(obj).__name__,
+            "params": _describe(obj.get_params()),
+            "fitted": {name: _describe(getattr(obj, name)) for name in _FITTED_ATTRIBUTES if hasattr(obj, name)},
+        })
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+class FeatureCache:
+    """ LRU-bounded directory of processed X/y arrays keyed on their inputs.
+
+    Inputs
+    ------
+    path : str
+        Directory of the cache entries, created if needed.
+    max_bytes : int
+        Largest total size of the entries. The least recently used ones are
+        evicted past it (default=2 GiB).
+    mmap_mode : str
+        Mode in which cached arrays are loaded, None to read them into memory
+        (default="r").
+    """
+
+    def __init__(self, path, max_bytes=2 * 2**30, mmap_mode="r"):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.mmap_mode = mmap_mode
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, X, categorical_features=[], label=None, training=True, encoder=None, lb=None,
+            sparse=False, encoding="onehot"):
+        """ Return the content address of a `process_data` call."""
+        h = hashlib.sha256()
+        h.update(json.dumps({
+            "version": FORMAT_VERSION,
+            "columns": [str(c) for c in X.columns],
+            "dtypes": [str(t) for t in X.dtypes],
+            "categorical_features": list(categorical_features),
+            "label": label,
+            "training": bool(training),
+            "sparse": bool(sparse),
+            "encoding": encoding,
+        }).encode())
+        h.update(pd.util.hash_pandas_object(X, index=False).to_numpy().tobytes())
+        if not training:
+            h.update(encoder_fingerprint(encoder, lb).encode())
+        return h.hexdigest()
+
+    def process_data(self, X, categorical_features=[], label=None, training=True, encoder=None,
+                     lb=None, sparse=False, encoding="onehot"):
+        """ Cached `process_data`: same inputs and outputs, see ml.data.process_data.
+
+        In training mode the fitted encoder and label binarizer are cached with the
+        arrays; otherwise the ones passed in are returned.
+        """
+        key = self.key(X, categorical_features, label, training, encoder, lb, sparse, encoding)
+        entry = self._load(key)
+        if entry is not None:
+            self.hits += 1
+            X_out, y_out, fitted = entry
+            if training:
+                encoder, lb = fitted
+            return X_out, y_out, encoder, lb
+
+        self.misses += 1
+        X_out, y_out, encoder, lb = process_data(
+            X, categorical_features=categorical_features, label=label, training=training,
+            encoder=encoder, lb=lb, sparse=sparse, encoding=encoding,
+        )
+        self._store(key, X_out, y_out, (encoder, lb) if training else None)
+        return X_out, y_out, encoder, lb
+
+    def _load(self, key):
+        entry = os.path.join(self.path, key)
+        try:
+            with open(os.path.join(entry, "meta.json")) as f:
+                meta = json.load(f)
+            if meta["sparse"]:
+                from scipy import sparse as sp
+
+                X = sp.csr_matrix(tuple(self._array(entry, name) for name in ("data", "indices", "indptr")),
+                                  shape=tuple(meta["shape"]), copy=False)
+            else:
+                X = self._array(entry, "X")
+            y = self._array(entry, "y")
+            fitted = None
+            if meta["fitted"]:
+                with open(os.path.join(entry, "fitted.pkl"), "rb") as f:
+                    fitted = pickle.load(f)
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+        # Directory mtime is the LRU clock.
+        os.utime(entry)
+        return X, y, fitted
+
+    def _array(self, entry, name):
+        return np.load(os.path.join(entry, name + ".npy"), mmap_mode=self.mmap_mode)
+
+    def _store(self, key, X, y, fitted):
+        tmp = tempfile.mkdtemp(prefix=".tmp-", dir=self.path)
+        try:
+            sparse = hasattr(X, "indptr")
+            if sparse:
+                for name in ("data", "indices", "indptr"):
+                    np.save(os.path.join(tmp, name + ".npy"), getattr(X, name))
+            else:
+                np.save(os.path.join(tmp, "X.npy"), np.asarray(X))
+            np.save(os.path.join(tmp, "y.npy"), np.asarray(y))
+            if fitted is not None:
+                with open(os.path.join(tmp, "fitted.pkl"), "wb") as f:
+                    pickle.dump(fitted, f)
+            with open(os.path.join(tmp, "meta.json"), "w") as f:
+                json.dump({"sparse": sparse, "shape": list(X.shape), "fitted": fitted is not None}, f)
+            # an existing entry could not be loaded (we only store on a miss), so it is
+            # corrupt; os.replace cannot replace a non-empty directory
+            shutil.rmtree(os.path.join(self.path, key), ignore_errors=True)
+            os.replace(tmp, os.path.join(self.path, key))
+        except OSError:
+            # Another process stored the same key first.
+            shutil.rmtree(tmp, ignore_errors=True)
+        self._evict()
+
+    def entries(self):
+        """ Return (key, bytes, last use) of every entry, least recently used first."""
+        entries = []
+        for name in os.listdir(self.path):
+            entry = os.path.join(self.path, name)
+            if name.startswith(".") or not os.path.isdir(entry):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+            entries.append((name, size, os.path.getmtime(entry)))
+        return sorted(entries, key=lambda e: e[2])
+
+    def _evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for name, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """ Remove every entry."""
+        for name in os.listdir(self.path):
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+    def stats(self):
+        """ Return entry count, bytes used and hit/miss counters as a dict."""
+        entries = self.entries()
+        return {
+            "path": self.path,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["clear", "stats"])
+    parser.add_argument("--dir", default=".feature_cache")
+    args = parser.parse_args()
+
+    cache = FeatureCache(args.dir)
+    if args.command == "clear":
+        cache.clear()
+    print(json.dumps(cache.stats(), indent=2))
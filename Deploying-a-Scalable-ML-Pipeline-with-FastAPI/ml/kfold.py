@@ -0,0 +1,162 @@
+""" K-fold training and evaluation with fold models fitted in parallel processes.
+
+The encoded matrix and the labels are copied once into POSIX shared memory. Each
+worker process maps them at start-up, so a fold task only carries its row
+indices, not a pickled copy of X.
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from ml.model import compute_model_metrics, search_space
+
+# Shared arrays attached by `_attach` in each worker process.
+_shared = {}
+
+
+class SharedArrays:
+    """ Context manager copying named numpy arrays into shared memory blocks.
+
+    `spec` describes the blocks so that `attach_arrays` can map them from another
+    process. The blocks are unlinked on exit.
+    """
+
+    def __init__(self, arrays):
+        self._blocks = []
+        self.spec = {}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+            np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+            self._blocks.append(block)
+            self.spec[name] = (block.name, array.shape, array.dtype.str)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+
+
+def attach_arrays(spec):
+    """ Map the blocks described by `SharedArrays.spec`; returns (blocks, arrays)."""
+    blocks, arrays = [], {}
+    for name, (block_name, shape, dtype) in spec.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+    return blocks, arrays
+
+
+def _attach(spec, shape):
+    blocks, arrays = attach_arrays(spec)
+    if "indptr" in arrays:
+        from scipy import sparse as sp
+
+        X = sp.csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]), shape=shape, copy=False)
+    else:
+        X = arrays["X"]
+    _shared.update(blocks=blocks, X=X, y=arrays["y"])
+
+
+def _fit_fold(estimator, train_idx, test_idx):
+    start = time.perf_counter()
+    X, y = _shared["X"], _shared["y"]
+    model = estimator.fit(X[train_idx], y[train_idx])
+    preds = model.predict(X[test_idx])
+    return model, preds, time.perf_counter() - start
+
+
+class FoldEnsemble:
+    """ Soft-voting ensemble of the fold models of `kfold_train`.
+
+    Predicts the class whose probability, averaged over the fold models, is the
+    highest.
+    """
+
+    def __init__(self, models):
+        self.models = list(models)
+        self.classes_ = self.models[0].classes_
+
+    def predict_proba(self, X):
+        return np.mean([model.predict_proba(X) for model in self.models], axis=0)
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+def kfold_train(X, y, params=None, backend="gradient_boosting", n_categorical=0, n_splits=5,
+                workers=None, random_state=0):
+    """ Train and evaluate one model per stratified fold on a pool of processes.
+
+    Inputs
+    ------
+    X : np.array or scipy.sparse.csr_matrix
+        Encoded data, as returned by `process_data`.
+    y : np.array
+        Labels.
+    params : dict
+        Hyperparameters of the backend estimator, e.g. the `best_params_` of
+        `train_model` (default=None, the estimator defaults).
+    backend : str
+        Model backend, see `train_model` (default="gradient_boosting").
+    n_categorical : int
+        Number of integer coded categorical columns, for the "hist" backend.
+    n_splits : int
+        Number of folds (default=5).
+    workers : int
+        Number of worker processes (default=min(n_splits, cpu count)).
+    random_state : int
+        Seed of the fold assignment (default=0).
+    Returns
+    -------
+    result : dict
+        "models" (one per fold), "folds" (per-fold precision, recall, fbeta, rows
+        and seconds), "mean"/"std" of precision, recall and fbeta over the folds,
+        "oof" (the metrics of the out-of-fold predictions over all rows), "oof_preds",
+        "seconds" (wall clock) and "workers".
+    """
+    from sklearn.model_selection import StratifiedKFold
+
+    start = time.perf_counter()
+    estimator, _ = search_space(backend, X.shape[1], n_categorical)
+    estimator.set_params(**(params or {}))
+    workers = workers or min(n_splits, os.cpu_count() or 1)
+    splits = list(StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=random_state).split(
+        np.zeros(len(y)), y))
+
+    if hasattr(X, "indptr"):
+        arrays = {"data": X.data, "indices": X.indices, "indptr": X.indptr}
+    else:
+        arrays = {"X": X}
+    arrays["y"] = np.asarray(y)
+
+    with SharedArrays(arrays) as shared, ProcessPoolExecutor(
+            max_workers=workers, initializer=_attach, initargs=(shared.spec, X.shape)) as pool:
+        futures = [pool.submit(_fit_fold, estimator, train_idx, test_idx) for train_idx, test_idx in splits]
+        results = [future.result() for future in futures]
+
+    y = np.asarray(y)
+    oof_preds = np.empty_like(y)
+    folds = []
+    for (_, test_idx), (_, preds, seconds) in zip(splits, results):
+        oof_preds[test_idx] = preds
+        precision, recall, fbeta = compute_model_metrics(y[test_idx], preds)
+        folds.append({"precision": precision, "recall": recall, "fbeta": fbeta,
+                      "rows": len(test_idx), "seconds": seconds})
+    metrics = ("precision", "recall", "fbeta")
+    return {
+        "models": [model for model, _, _ in results],
+        "folds": folds,
+        "mean": {m: float(np.mean([f[m] for f in folds])) for m in metrics},
+        "std": {m: float(np.std([f[m] for f in folds])) for m in metrics},
+        "oof": dict(zip(metrics, compute_model_metrics(y, oof_preds))),
+        "oof_preds": oof_preds,
+        "seconds": time.perf_counter() - start,
+        "workers": workers,
+    }
@@ -0,0 +1,142 @@
+import bisect
+import time
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                   0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384)
+
+
+class Histogram:
+    """ Cumulative histogram in the Prometheus sense: bucket counts, sum and count."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """ Registry of labelled histograms and counters rendered in Prometheus text format.
+
+    Observations are meant to be made from the event loop thread only. When
+    `enabled` is False every hook returns immediately, so instrumentation can stay
+    in place on the hot path.
+
+    Inputs
+    ------
+    enabled : bool
+        Whether observations are recorded (default=True).
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._histograms = {}
+        self._counters = {}
+        self._help = {}
+
+    def describe(self, name, text):
+        """ Set the HELP text of a metric."""
+        self._help[name] = text
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        """ Add one observation to histogram `name` with the given labels."""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        hist = self._histograms.get(key)
+        if hist is None:
+            hist = self._histograms[key] = Histogram(buckets)
+        hist.observe(value)
+
+    def observe_stages(self, timings):
+        """ Record a dict of stage name -> seconds in `inference_stage_seconds`."""
+        if not self.enabled:
+            return
+        for stage, seconds in timings.items():
+            self.observe("inference_stage_seconds", seconds, stage=stage)
+
+    def inc(self, name, amount=1, **labels):
+        """ Increase counter `name` with the given labels."""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def reset(self):
+        self._histograms.clear()
+        self._counters.clear()
+
+    def render(self):
+        """ Return every metric in the Prometheus text exposition format."""
+        lines = []
+        seen = set()
+
+        def header(name, kind):
+            if name not in seen:
+                seen.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(self._counters.items()):
+            header(name, "counter")
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), hist in sorted(self._histograms.items()):
+            header(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(hist.buckets + (float("inf"),), hist.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {hist.sum!r}")
+            lines.append(f"{name}_count{_labels(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class MetricsMiddleware:
+    """ ASGI middleware timing every HTTP request and counting responses per status.
+
+    Requests are labelled with the path template of the route they matched (e.g.
+    "/items/{id}"), so the number of series stays bounded; requests that match no
+    route share the path label "<unmatched>".
+
+    It also stores the arrival time in the request state as `start_time`, so a
+    handler can tell how long routing and pydantic validation took before it ran.
+    """
+
+    def __init__(self, app, metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.metrics.enabled:
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        scope.setdefault("state", {})["start_time"] = start
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # the router stores the matched route in the scope it was handed
+            path = getattr(scope.get("route"), "path", None) or "<unmatched>"
+            self.metrics.observe("http_request_duration_seconds", time.perf_counter() - start, path=path)
+            self.metrics.inc("http_requests_total", path=path, status=status[0])
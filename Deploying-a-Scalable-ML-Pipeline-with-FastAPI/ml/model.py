@@ -1,9 +1,13 @@
+import math
 import pickle
-from sklearn.metrics import fbeta_score, precision_score, recall_score
+import time
+
+import numpy as np
+import pandas as pd
+
 from ml.data import process_data
-# TODO: add necessary import
-from sklearn.ensemble import GradientBoostingClassifier
-from sklearn.model_selection import GridSearchCV
+# sklearn is imported inside the training and evaluation functions, so that serving
+# a precompiled model (see ml/compiled.py) starts without loading it.
 
 import multiprocessing
 import logging
@@ -13,8 +17,59 @@ logging.basicConfig(filename='journal.log',
                     filemode='w',
                     format='%(name)s - %(levelname)s - %(message)s')
 
+MODEL_BACKENDS = ("gradient_boosting", "hist")
+SEARCH_MODES = ("grid", "halving")
+
+
+def search_space(backend, n_features, n_categorical=0):
+    """ Returns the unfitted estimator and the parameter grid of a model backend.
+
+    Inputs
+    ------
+    backend : str
+        One of MODEL_BACKENDS, see `train_model`.
+    n_features : int
+        Number of columns of the training data.
+    n_categorical : int
+        Number of integer coded categorical columns at the end of the training
+        data, only used by the "hist" backend (default=0).
+    Returns
+    -------
+    estimator : sklearn estimator
+    parameters : dict
+    """
+    if backend == "gradient_boosting":
+        from sklearn.ensemble import GradientBoostingClassifier
+
+        estimator = GradientBoostingClassifier(random_state=0)
+        parameters = {
+            'n_estimators': [10, 20, 30],
+            'max_depth': [5, 10],
+            'min_samples_split': [20, 50, 100],
+            'learning_rate': [1.0],  # 0.1,0.5,
+        }
+    elif backend == "hist":
+        from sklearn.ensemble import HistGradientBoostingClassifier
+
+        estimator = HistGradientBoostingClassifier(
+            categorical_features=list(range(n_features - n_categorical, n_features)),
+            early_stopping=False,
+            random_state=0,
+        )
+        parameters = {
+            'max_iter': [100, 200],
+            'max_leaf_nodes': [15, 31],
+            'learning_rate': [0.1, 0.2],
+        }
+    else:
+        raise ValueError(f"Unknown model backend {backend!r}, expected one of {MODEL_BACKENDS}.")
+
+    return estimator, parameters
+
+
 # Optional: implement hyperparameter tuning.
-def train_model(X_train, y_train):
+def train_model(X_train, y_train, backend="gradient_boosting", n_categorical=0, search="grid",
+                budget=None, factor=3):
     """
     Trains a machine learning model and returns it.
 
@@ -24,36 +79,266 @@ def train_model(X_train, y_train):
         Training data.
     y_train : np.array
         Labels.
+    backend : str
+        "gradient_boosting" grid-searches an exact GradientBoostingClassifier on one
+        hot encoded data. "hist" grid-searches a HistGradientBoostingClassifier that
+        treats the last `n_categorical` columns as native categorical features, for
+        data from `process_data(encoding="ordinal")` (default="gradient_boosting").
+    n_categorical : int
+        Number of integer coded categorical columns at the end of `X_train`, only
+        used by the "hist" backend (default=0).
+    search : str
+        "grid" cross-validates every candidate on all rows with GridSearchCV.
+        "halving" ranks the candidates on growing row subsamples and only promotes
+        the best 1/`factor` of them to the next round, see `halving_search`
+        (default="grid").
+    budget : float
+        Wall-clock budget in seconds of the "halving" search. No round is started
+        whose estimated time, with the final refit, would not fit within it; the
+        refit itself always runs (default=None, no limit).
+    factor : int
+        Elimination rate of the "halving" search (default=3).
     Returns
     -------
     model
         Trained machine learning model.
     """
-    # TODO: implement the function
-    parameters = {
-        'n_estimators': [10, 20, 30],
-        'max_depth': [5, 10],
-        'min_samples_split': [20, 50, 100],
-        'learning_rate': [1.0],  # 0.1,0.5,
-    }
-
-    njobs = multiprocessing.cpu_count() - 1
-    logging.info("Searching best hyperparameters on {} cores".format(njobs))
-
-    clf = GridSearchCV(GradientBoostingClassifier(random_state=0),
-                       param_grid=parameters,
-                       cv=min(3, len(X_train)),
-                       n_jobs=njobs,
-                       verbose=2,
-                       )
-
-    clf.fit(X_train, y_train)
+    from sklearn.model_selection import GridSearchCV
+
+    estimator, parameters = search_space(backend, X_train.shape[1], n_categorical)
+
+    njobs = max(1, multiprocessing.cpu_count() - 1)
+    logging.info("Searching best {} hyperparameters on {} cores".format(backend, njobs))
+
+    if search == "grid":
+        clf = GridSearchCV(estimator,
+                           param_grid=parameters,
+                           cv=min(3, len(X_train)),
+                           n_jobs=njobs,
+                           verbose=2,
+                           )
+        clf.fit(X_train, y_train)
+    elif search == "halving":
+        clf = halving_search(estimator, parameters, X_train, y_train, cv=min(3, len(X_train)),
+                             n_jobs=njobs, budget=budget, factor=factor)
+    else:
+        raise ValueError(f"Unknown search {search!r}, expected one of {SEARCH_MODES}.")
     logging.info("********* Best parameters found ***********")
     logging.info("BEST PARAMS: {}".format(clf.best_params_))
 
     return clf
 
 
+class HalvingSearch:
+    """ Result of `halving_search`: the best candidate refitted on all rows.
+
+    It exposes the GridSearchCV attributes used by the rest of the pipeline
+    (`best_estimator_`, `best_params_`, `best_score_`, `predict`), plus `rounds_`,
+    one dict per round with its row count, candidate count, best score and seconds.
+    """
+
+    def __init__(self, best_estimator, best_params, best_score, rounds):
+        self.best_estimator_ = best_estimator
+        self.best_params_ = best_params
+        self.best_score_ = best_score
+        self.rounds_ = rounds
+
+    @property
+    def classes_(self):
+        return self.best_estimator_.classes_
+
+    def predict(self, X):
+        return self.best_estimator_.predict(X)
+
+    def predict_proba(self, X):
+        return self.best_estimator_.predict_proba(X)
+
+
+def halving_search(estimator, parameters, X, y, cv=3, n_jobs=1, budget=None, factor=3, random_state=0):
+    """
+    Successive halving over a parameter grid, within an optional wall-clock budget.
+
+    The first round cross-validates every candidate on a random subsample of
+    len(X) / factor**k rows, with k such that a single candidate is left after the
+    last round. Each round keeps the best 1/`factor` of the candidates and gives
+    them `factor` times more rows. The winner is then refitted on all rows.
+
+    With a `budget`, the time of one fit per row is measured first on the rows
+    of round 0 (a single fit of the first candidate), then updated after every
+    round. Before a round starts, its duration plus that of the final refit are
+    estimated from it (linear in rows and fits, divided by the parallel jobs);
+    if they would overrun `budget`, the search stops and the current leader wins
+    (the first candidate if no round ran). The final refit always runs, so a
+    budget too small for it alone is exceeded by that refit; and the estimates
+    are estimates. Per-round timings are logged.
+
+    Inputs
+    ------
+    estimator : sklearn estimator
+        Unfitted estimator to tune.
+    parameters : dict
+        Parameter grid, as for GridSearchCV.
+    X : np.array or scipy.sparse.csr_matrix
+        Training data.
+    y : np.array
+        Labels.
+    cv : int
+        Number of cross-validation folds per round (default=3).
+    n_jobs : int
+        Parallel fits within a round (default=1).
+    budget : float
+        Wall-clock budget in seconds (default=None, no limit).
+    factor : int
+        Elimination rate and row growth per round (default=3).
+    random_state : int
+        Seed of the row subsamples (default=0).
+    Returns
+    -------
+    search : HalvingSearch
+    """
+    from sklearn.base import clone
+    from sklearn.model_selection import GridSearchCV, ParameterGrid
+
+    start = time.perf_counter()
+    candidates = list(ParameterGrid(parameters))
+    n_rows = X.shape[0]
+    n_rounds = max(1, math.ceil(math.log(len(candidates), factor)))
+    # Nested subsamples: every round sees the rows of the previous one.
+    order = np.random.RandomState(random_state).permutation(n_rows)
+    min_rows = min(n_rows, 20 * cv)
+
+    rounds = []
+    best_score = float("nan")
+    parallel = max(1, n_jobs)
+    if budget is not None:
+        # seconds of one fit per training row, from a single small fit
+        n_probe = max(min_rows, n_rows // factor ** n_rounds)
+        probe_start = time.perf_counter()
+        clone(estimator).set_params(**candidates[0]).fit(X[order[:n_probe]], y[order[:n_probe]])
+        per_row = (time.perf_counter() - probe_start) / n_probe
+    for i in range(n_rounds):
+        n_samples = max(min_rows, n_rows // factor ** (n_rounds - i))
+        if budget is not None:
+            # cv fits per candidate, each on (cv - 1) / cv of the rows, then the refit on all rows
+            fits = len(candidates) * cv
+            estimate = per_row * n_samples * (cv - 1) / cv * fits / min(parallel, fits) + per_row * n_rows
+            if time.perf_counter() - start + estimate > budget:
+                logging.info("Halving round {} skipped: {:.1f}s estimated with the refit, {:.1f}s of {:.1f}s "
+                             "budget used".format(i, estimate, time.perf_counter() - start, budget))
+                break
+        round_start = time.perf_counter()
+        rows = order[:n_samples]
+        grid = GridSearchCV(estimator,
+                            param_grid=[{k: [v] for k, v in c.items()} for c in candidates],
+                            cv=cv,
+                            n_jobs=n_jobs,
+                            refit=False,
+                            )
+        grid.fit(X[rows], y[rows])
+        scores = grid.cv_results_["mean_test_score"]
+        ranked = np.argsort(-np.nan_to_num(scores, nan=-np.inf), kind="stable")
+        best_score = float(scores[ranked[0]])
+        rounds.append({"round": i, "rows": int(n_samples), "candidates": len(candidates),
+                       "best_score": best_score, "seconds": time.perf_counter() - round_start})
+        logging.info("Halving round {}: {} candidates on {} rows in {:.2f}s, best score {:.4f}".format(
+            i, len(candidates), n_samples, rounds[-1]["seconds"], best_score))
+        fits = len(candidates) * cv
+        per_row = rounds[-1]["seconds"] * min(parallel, fits) / (fits * n_samples * (cv - 1) / cv)
+        candidates = [candidates[j] for j in ranked[:max(1, math.ceil(len(candidates) / factor))]]
+
+    best_params = candidates[0]
+    refit_start = time.perf_counter()
+    best_estimator = clone(estimator).set_params(**best_params).fit(X, y)
+    logging.info("Halving refit of {} on {} rows in {:.2f}s, {:.2f}s in total".format(
+        best_params, n_rows, time.perf_counter() - refit_start, time.perf_counter() - start))
+    return HalvingSearch(best_estimator, best_params, best_score, rounds)
+
+
+def warm_start_model(model, X_train, y_train, n_more, column_map=None):
+    """
+    Continues boosting a trained model on new training data.
+
+    The hyperparameters of the model (the `best_params_` of a search) are kept, and
+    `n_more` estimators (iterations for a HistGradientBoostingClassifier) are
+    added with `warm_start=True`, so the existing trees are neither refitted nor
+    searched again. If the encoder was extended with `extend_encoder`, the trees
+    of a GradientBoostingClassifier are first moved to the new one hot layout
+    with `column_map`.
+
+    Inputs
+    ------
+    model
+        Model returned by `train_model` (or a previous `warm_start_model`).
+    X_train : np.array
+        Training data in the current encoder layout, old and new rows.
+    y_train : np.array
+        Labels.
+    n_more : int
+        Number of boosting stages to add.
+    column_map : np.array
+        Old column index -> new column index, as returned by `extend_encoder`
+        (default=None, unchanged layout).
+    Returns
+    -------
+    model
+        The updated estimator; the input model is left untouched.
+    """
+    import copy
+
+    estimator = copy.deepcopy(getattr(model, "best_estimator_", model))
+    if not hasattr(estimator, "warm_start"):
+        raise ValueError(f"{type(estimator).__name__} cannot be warm started.")
+    if column_map is not None and hasattr(estimator, "estimators_"):
+        _remap_tree_features(estimator, column_map, X_train.shape[1])
+    if hasattr(estimator, "max_iter"):
+        estimator.set_params(warm_start=True, max_iter=estimator.max_iter + n_more)
+    else:
+        estimator.set_params(warm_start=True, n_estimators=estimator.n_estimators + n_more)
+    start = time.perf_counter()
+    estimator.fit(X_train, y_train)
+    estimator.set_params(warm_start=False)
+    logging.info("Warm start: {} more stages on {} rows in {:.2f}s".format(
+        n_more, X_train.shape[0], time.perf_counter() - start))
+    return estimator
+
+
+# sklearn versions whose Tree pickle state ("max_depth", "node_count", "nodes",
+# "values", nodes with a "feature" field) `_remap_tree_features` was checked against.
+TREE_STATE_VERSIONS = ((1, 3), (1, 5))
+
+
+def _remap_tree_features(estimator, column_map, n_features):
+    # Rebuild each tree through its pickle state with the split features renumbered.
+    # The state layout is private to sklearn, so only the versions above are accepted.
+    import re
+
+    import sklearn
+    from sklearn.tree._tree import Tree
+
+    version = tuple(int(v) for v in re.findall(r"\d+", sklearn.__version__)[:2])
+    if not TREE_STATE_VERSIONS[0] <= version <= TREE_STATE_VERSIONS[1]:
+        raise ValueError(
+            f"Carrying trees over an extended encoder is not supported with scikit-learn "
+            f"{sklearn.__version__} (supported: {'.'.join(map(str, TREE_STATE_VERSIONS[0]))} to "
+            f"{'.'.join(map(str, TREE_STATE_VERSIONS[1]))}); retrain without --incremental."
+        )
+    for tree in estimator.estimators_.ravel():
+        state = tree.tree_.__getstate__()
+        if not {"max_depth", "node_count", "nodes", "values"} <= set(state) or \
+                "feature" not in state["nodes"].dtype.names:
+            raise ValueError(f"Unexpected tree state in scikit-learn {sklearn.__version__}; "
+                             "retrain without --incremental.")
+        nodes = state["nodes"].copy()
+        split = nodes["feature"] >= 0
+        nodes["feature"][split] = column_map[nodes["feature"][split]]
+        state["nodes"] = nodes
+        remapped = Tree(n_features, np.array([tree.tree_.n_classes[0]], dtype=np.intp), tree.tree_.n_outputs)
+        remapped.__setstate__(state)
+        tree.tree_ = remapped
+        tree.n_features_in_ = n_features
+        tree.max_features_ = n_features if tree.max_features is None else tree.max_features_
+
+
 def compute_model_metrics(y, preds):
     """
     Validates the trained machine learning model using precision, recall, and F1.
@@ -70,6 +355,8 @@ def compute_model_metrics(y, preds):
     recall : float
     fbeta : float
     """
+    from sklearn.metrics import fbeta_score, precision_score, recall_score
+
     fbeta = fbeta_score(y, preds, beta=1, zero_division=1)
     precision = precision_score(y, preds, zero_division=1)
     recall = recall_score(y, preds, zero_division=1)
@@ -118,7 +405,7 @@ def load_model(path):
 
 
 def performance_on_categorical_slice(
-    data, column_name, slice_value, categorical_features, label, encoder, lb, model
+    data, column_name, slice_value, categorical_features, label, encoder, lb, model, sparse=False
 ):
 
     """ Computes the model metrics on a slice of the data specified by a column name and
@@ -146,6 +433,8 @@ def performance_on_categorical_slice(
         Trained sklearn LabelBinarizer, only used if training=False.
     model : ???
         Model used for the task.
+    sparse : bool
+        Encode the slice as a scipy.sparse CSR matrix (default=False).
 
     Returns
     -------
@@ -164,8 +453,88 @@ def performance_on_categorical_slice(
         label=label,
         training=False,
         encoder=encoder,
-        lb=lb
+        lb=lb,
+        sparse=sparse,
     )
     preds = model.predict(X_slice) # your code here to get prediction on X_slice using the inference function
     precision, recall, fbeta = compute_model_metrics(y_slice, preds)
-    return precision, recall, fbeta
\ No newline at end of file
+    return precision, recall, fbeta
+
+
+def compute_slice_metrics(data, slices, y, preds):
+    """ Computes the model metrics on every slice of the given columns in one pass.
+
+    Unlike `performance_on_categorical_slice`, nothing is encoded or predicted per
+    slice: the predictions on the whole of `data` are reduced to confusion counts,
+    and the counts are summed per slice with one groupby per column. The metrics
+    are the ones of `compute_model_metrics`, with the same zero_division=1 rule.
+
+    Inputs
+    ------
+    data : pd.DataFrame
+        Dataframe the predictions were made on, row for row.
+    slices : list[str or tuple[str]]
+        Columns to slice on. A tuple of columns slices on every combination of
+        their values; a tuple of one column is the same as the column itself.
+    y : np.array
+        Known labels, binarized.
+    preds : np.array
+        Predicted labels, binarized.
+    Returns
+    -------
+    metrics : pd.DataFrame
+        One row per slice, in the order of `slices` and then of the sorted slice
+        values, with columns feature, value, count, precision, recall and fbeta.
+        For a tuple of columns, feature is the tuple and value a tuple of values.
+    """
+    y = np.asarray(y).astype(bool)
+    preds = np.asarray(preds).astype(bool)
+    counts = pd.DataFrame({
+        "count": np.ones(len(y), dtype=np.int64),
+        "tp": y & preds,
+        "fp": ~y & preds,
+        "fn": y & ~preds,
+    })
+    frames = []
+    for columns in slices:
+        if isinstance(columns, tuple) and len(columns) == 1:
+            columns = columns[0]
+        keys = [data[c].to_numpy() for c in (columns if isinstance(columns, tuple) else [columns])]
+        grouped = counts.groupby(keys, sort=True).sum()
+        tp, fp, fn = (grouped[c].to_numpy() for c in ("tp", "fp", "fn"))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            precision = np.where(tp + fp > 0, tp / (tp + fp), 1.0)
+            recall = np.where(tp + fn > 0, tp / (tp + fn), 1.0)
+            fbeta = np.where(tp + fp + fn > 0, 2 * tp / (2 * tp + fp + fn), 1.0)
+        frames.append(pd.DataFrame({
+            "feature": [columns] * len(grouped),
+            "value": list(grouped.index),
+            "count": grouped["count"].to_numpy(),
+            "precision": precision,
+            "recall": recall,
+            "fbeta": fbeta,
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def write_slice_report(metrics, path):
+    """ Writes the output of `compute_slice_metrics` to `path` in one go.
+
+    Each slice takes two lines, in the format of slice_output.txt:
+
+        feature: value, Count: n
+        Precision: p | Recall: r | F1: f
+
+    Slices over several columns are written as "a x b: value_a, value_b".
+    """
+    lines = []
+    for row in metrics.itertuples(index=False):
+        feature, value = row.feature, row.value
+        if isinstance(feature, tuple):
+            feature = " x ".join(feature)
+        if isinstance(value, tuple):
+            value = ", ".join(str(v) for v in value)
+        lines.append(f"{feature}: {value}, Count: {row.count:,}")
+        lines.append(f"Precision: {row.precision:.4f} | Recall: {row.recall:.4f} | F1: {row.fbeta:.4f}")
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
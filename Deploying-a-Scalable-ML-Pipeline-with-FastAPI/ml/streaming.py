@@ -0,0 +1,116 @@
+import codecs
+import csv
+import io
+import json
+
+import pandas as pd
+from starlette.responses import StreamingResponse
+
+FORMATS = ("csv", "ndjson")
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """ StreamingResponse that leaves `receive` to the request body stream.
+
+    Starlette's StreamingResponse listens on `receive` for a client disconnect while
+    it sends, which would consume the body of an upload that is still being read by
+    the response generator. A disconnect still surfaces as ClientDisconnect from
+    `request.stream()` or as a failed send.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def iter_lines(byte_chunks):
+    """ Yield decoded text lines from an async iterator of byte chunks."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    async for chunk in byte_chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending.strip():
+        yield pending.rstrip("\r")
+
+
+async def iter_records(lines):
+    """ Join the lines of a quoted CSV field that spans several lines into one record.
+
+    A record is complete once it holds an even number of double quotes, which holds
+    for RFC 4180 CSV since an escaped quote inside a field is doubled.
+    """
+    record = None
+    async for line in lines:
+        record = line if record is None else record + "\n" + line
+        if record.count('"') % 2 == 0:
+            yield record
+            record = None
+    if record is not None:
+        yield record
+
+
+async def iter_frames(byte_chunks, fmt, columns, chunk_rows):
+    """ Parse a streamed CSV or NDJSON upload into DataFrames of at most `chunk_rows` rows.
+
+    Only one chunk of rows is held in memory at a time, whatever the size of the
+    upload. Each frame holds exactly `columns`, in that order; other columns such as
+    the label are dropped.
+
+    Inputs
+    ------
+    byte_chunks : async iterator of bytes
+        Raw request body, e.g. `request.stream()`.
+    fmt : str
+        "csv" (with a header line, like data/census.csv; quoted fields may contain
+        newlines) or "ndjson".
+    columns : list[str]
+        Feature columns expected in every row.
+    chunk_rows : int
+        Number of rows per yielded frame.
+    Returns
+    -------
+    frames : async iterator of pd.DataFrame
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}, expected one of {FORMATS}.")
+    lines = iter_lines(byte_chunks)
+    header = None
+    if fmt == "csv":
+        lines = iter_records(lines)
+        async for line in lines:
+            if line.strip():
+                header = line
+                break
+        else:
+            return
+        missing = set(columns) - {name.strip() for name in next(csv.reader([header]))}
+        if missing:
+            raise ValueError(f"Missing columns: {sorted(missing)}")
+
+    buffer = []
+    async for line in lines:
+        if not line.strip():
+            continue
+        buffer.append(line)
+        if len(buffer) >= chunk_rows:
+            yield _to_frame(buffer, fmt, header, columns)
+            buffer = []
+    if buffer:
+        yield _to_frame(buffer, fmt, header, columns)
+
+
+def _to_frame(lines, fmt, header, columns):
+    if fmt == "csv":
+        data = pd.read_csv(io.StringIO("\n".join([header] + lines)), skipinitialspace=True)
+        data.columns = data.columns.str.strip()
+    else:
+        data = pd.DataFrame.from_records([json.loads(line) for line in lines])
+        missing = set(columns) - set(data.columns)
+        if missing:
+            raise ValueError(f"Missing columns: {sorted(missing)}")
+    return data[columns]
@@ -67,3 +67,763 @@ def test_data_split_shape():
     assert len(train) == 80
     assert len(test) == 20
 
+## Test 4
+def test_batch_inference_matches_single_inference():
+    """
+    Ensure /inference/batch returns one label per record, in input order,
+    matching what /inference/ returns for each record on its own.
+    """
+    from fastapi.testclient import TestClient
+    from main import app
+
+    client = TestClient(app)
+    records = [
+        {
+            "age": 37, "workclass": "Private", "fnlgt": 178356, "education": "HS-grad",
+            "education-num": 10, "marital-status": "Married-civ-spouse",
+            "occupation": "Prof-specialty", "relationship": "Husband", "race": "White",
+            "sex": "Male", "capital-gain": 0, "capital-loss": 0, "hours-per-week": 40,
+            "native-country": "United-States",
+        },
+        {
+            "age": 22, "workclass": "Private", "fnlgt": 201490, "education": "Some-college",
+            "education-num": 10, "marital-status": "Never-married",
+            "occupation": "Adm-clerical", "relationship": "Own-child", "race": "White",
+            "sex": "Female", "capital-gain": 0, "capital-loss": 0, "hours-per-week": 20,
+            "native-country": "United-States",
+        },
+    ]
+    r = client.post("/inference/batch", json=records)
+    assert r.status_code == 200
+    results = r.json()["results"]
+    expected = [client.post("/inference/", json=rec).json()["result"] for rec in records]
+    assert results == expected
+    assert results == [">50K", "<=50K"]
+
+## Test 5
+def test_record_encoder_matches_process_data():
+    """
+    Ensure RecordEncoder produces exactly the rows of process_data(training=False),
+    including records with unknown categories.
+    """
+    from ml.data import RecordEncoder, process_data
+
+    cat_features = [
+        "workclass", "education", "marital-status", "occupation",
+        "relationship", "race", "sex", "native-country",
+    ]
+    data = pd.read_csv("data/census.csv")
+    _, _, encoder, _ = process_data(data, categorical_features=cat_features,
+                                    label="salary", training=True)
+    data = data.drop(columns=["salary"])
+
+    sample = data.sample(200, random_state=0).reset_index(drop=True)
+    sample.loc[0, "native-country"] = "Atlantis"
+    sample.loc[1, "workclass"] = "Unknown-gov"
+    expected, _, _, _ = process_data(sample, categorical_features=cat_features,
+                                     training=False, encoder=encoder)
+
+    continuous = [c for c in data.columns if c not in cat_features]
+    record_encoder = RecordEncoder(encoder, cat_features, continuous)
+    records = sample.to_dict(orient="records")
+    np.testing.assert_array_equal(record_encoder.transform(records), expected)
+    np.testing.assert_array_equal(record_encoder.transform_one(records[0]), expected[:1])
+
+## Test 6
+def test_micro_batcher_coalesces_concurrent_requests():
+    """
+    Ensure concurrent submissions are scored in one call and each caller
+    receives the prediction for its own row.
+    """
+    import asyncio
+    from ml.batching import MicroBatcher
+
+    calls = []
+
+    def predict(records):
+        calls.append(len(records))
+        return np.array(records) * 10
+
+    async def run():
+        batcher = MicroBatcher(predict, max_batch_size=4, max_wait_ms=50)
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(6)))
+        return results, batcher.stats()
+
+    results, stats = asyncio.run(run())
+    assert [int(r[0]) for r in results] == [0, 10, 20, 30, 40, 50]
+    assert calls == [4, 2]
+    assert stats["batches"] == 2
+    assert stats["requests"] == 6
+    assert stats["batch_size_counts"] == {"2": 1, "4": 1}
+
+## Test 7
+def test_prediction_cache_lru_and_invalidation(tmp_path):
+    """
+    Ensure the prediction cache evicts least recently used entries, counts
+    hits and misses, and clears itself when an artifact file changes.
+    """
+    import os
+    from ml.cache import PredictionCache
+
+    artifact = tmp_path / "model.pkl"
+    artifact.write_bytes(b"v1")
+    cache = PredictionCache(["a", "b"], maxsize=2, artifact_paths=[str(artifact)], check_interval=0)
+
+    k1, k2, k3 = (cache.key({"b": i, "a": 0}) for i in range(3))
+    cache.put(k1, "<=50K")
+    cache.put(k2, ">50K")
+    assert cache.get(k1) == "<=50K"
+    cache.put(k3, ">50K")  # evicts k2, the least recently used entry
+    assert cache.get(k2) is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (1, 1, 1)
+
+    artifact.write_bytes(b"version 2")
+    os.utime(artifact, ns=(0, 0))
+    assert cache.get(k1) is None
+    assert cache.stats()["invalidations"] == 1
+
+## Test 8
+def test_compiled_model_matches_sklearn_on_census(tmp_path):
+    """
+    Ensure the array-backed engine exported from the saved model predicts the
+    same labels as sklearn on every row of census.csv, also after a save/load
+    round trip, and that saving over a mapped export does not change it.
+    """
+    from ml.compiled import ARRAYS, CompiledGradientBoosting, compile_model
+    from ml.data import process_data
+    from ml.model import inference, load_model
+
+    cat_features = [
+        "workclass", "education", "marital-status", "occupation",
+        "relationship", "race", "sex", "native-country",
+    ]
+    data = pd.read_csv("data/census.csv").drop(columns=["salary"])
+    encoder = load_model("model/encoder.pkl")
+    model = load_model("model/model.pkl")
+    X, _, _, _ = process_data(data, categorical_features=cat_features, encoder=encoder, training=False)
+
+    compiled = compile_model(model)
+    np.testing.assert_array_equal(inference(compiled, X), inference(model, X))
+    np.testing.assert_allclose(compiled.decision_function(X),
+                               model.best_estimator_.decision_function(X), atol=1e-9)
+
+    loaded = CompiledGradientBoosting.load("model/compiled", mmap_mode="r")
+    np.testing.assert_array_equal(inference(loaded, X), inference(model, X))
+
+    # saving over a directory that is mapped leaves the mapped arrays intact
+    path = tmp_path / "compiled"
+    compiled.save(str(path))
+    mapped = CompiledGradientBoosting.load(str(path), mmap_mode="r")
+    expected = inference(mapped, X)
+    stump = CompiledGradientBoosting(**{name: getattr(compiled, name)[:1] for name in ARRAYS[:-1]},
+                                     classes=compiled.classes, base=0.0, max_depth=0,
+                                     n_features_in=compiled.n_features_in_)
+    stump.save(str(path))
+    np.testing.assert_array_equal(inference(mapped, X), expected)
+    assert CompiledGradientBoosting.load(str(path)).max_depth == 0
+    assert [p.name for p in tmp_path.iterdir()] == ["compiled"]
+
+## Test 9
+def test_metrics_render_prometheus_and_disable():
+    """
+    Ensure stage timings render as a cumulative Prometheus histogram and that a
+    disabled registry records nothing.
+    """
+    from ml.metrics import Metrics
+
+    metrics = Metrics()
+    metrics.observe_stages({"encode": 0.00002, "predict": 0.003})
+    metrics.observe("inference_stage_seconds", 0.004, stage="predict")
+    metrics.inc("http_requests_total", path="/inference/", status=200)
+    text = metrics.render()
+    assert "# TYPE inference_stage_seconds histogram" in text
+    assert 'inference_stage_seconds_bucket{stage="predict",le="0.0025"} 0' in text
+    assert 'inference_stage_seconds_bucket{stage="predict",le="0.005"} 2' in text
+    assert 'inference_stage_seconds_count{stage="encode"} 1' in text
+    assert 'http_requests_total{path="/inference/",status="200"} 1' in text
+
+    disabled = Metrics(enabled=False)
+    disabled.observe_stages({"encode": 0.1})
+    disabled.inc("http_requests_total")
+    assert disabled.render().strip() == ""
+
+    # the middleware labels by route template, and unmatched paths share one label
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from ml.metrics import MetricsMiddleware
+
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    async def get_item(item_id: int):
+        return {"item_id": item_id}
+
+    served = Metrics()
+    app.add_middleware(MetricsMiddleware, metrics=served)
+    client = TestClient(app)
+    for path in ("/items/1", "/items/2", "/missing/1", "/missing/2"):
+        client.get(path)
+    text = served.render()
+    assert 'http_requests_total{path="/items/{item_id}",status="200"} 2' in text
+    assert 'http_requests_total{path="<unmatched>",status="404"} 2' in text
+    assert "/missing" not in text and "/items/1" not in text
+
+## Test 10
+def test_streaming_file_inference_matches_batch_scoring():
+    """
+    Ensure /inference/file scores a CSV upload chunk by chunk, in row order,
+    with the same labels as process_data + inference on the whole file.
+    """
+    import json
+    from fastapi.testclient import TestClient
+    from main import app, cat_features
+    from ml.data import apply_labels, process_data
+    from ml.model import inference, load_model
+
+    encoder = load_model("model/encoder.pkl")
+    model = load_model("model/model.pkl")
+
+    with open("data/census.csv") as f:
+        lines = [next(f) for _ in range(251)]
+    data = pd.read_csv("data/census.csv", nrows=250)
+    X, _, _, _ = process_data(data.drop(columns=["salary"]), categorical_features=cat_features,
+                              encoder=encoder, training=False)
+    expected = apply_labels(inference(model, X))
+
+    client = TestClient(app)
+    r = client.post("/inference/file?chunk_rows=100", content="".join(lines).encode(),
+                    headers={"content-type": "text/csv"})
+    assert r.status_code == 200
+    messages = [json.loads(line) for line in r.text.splitlines()]
+    assert [len(m["results"]) for m in messages[:-1]] == [100, 100, 50]
+    assert sum((m["results"] for m in messages[:-1]), []) == expected
+    assert messages[-1]["rows"] == 250
+
+    r = client.post("/inference/file", content=b"age,workclass\n1,Private\n",
+                    headers={"content-type": "text/csv"})
+    assert r.status_code == 400
+
+    # a quoted field spanning lines is one row; a chunk that cannot be scored is
+    # reported in-band and the next chunk is still scored
+    rows = lines[1:7]
+    rows[1] = rows[1].replace("Private", '"Pri\nvate"', 1)
+    rows[3] = "abc" + rows[3][rows[3].index(","):]
+    r = client.post("/inference/file?chunk_rows=2", content="".join([lines[0]] + rows).encode(),
+                    headers={"content-type": "text/csv"})
+    messages = [json.loads(line) for line in r.text.splitlines()]
+    assert len(messages[0]["results"]) == 2
+    assert messages[1]["rows"] == 2 and messages[1]["chunk_rows"] == 2 and "error" in messages[1]
+    assert messages[2]["results"] == expected[4:6]
+    assert messages[-1]["rows"] == 4 and messages[-1]["failed_rows"] == 2
+
+## Test 11
+def test_batch_score_cli_keeps_row_order(tmp_path):
+    """
+    Ensure the offline scorer writes one prediction per input row, in input
+    order, across several chunks.
+    """
+    from batch_score import cat_features, score_file
+    from ml.data import apply_labels, process_data
+    from ml.model import inference, load_model
+
+    data = pd.read_csv("data/census.csv", nrows=300)
+    data.to_csv(tmp_path / "input.csv", index=False)
+    summary = score_file(str(tmp_path / "input.csv"), str(tmp_path / "output.csv"),
+                         "model/encoder.pkl", "model/model.pkl", workers=2, chunksize=70)
+    assert summary["rows"] == 300
+    assert summary["chunks"] == 5
+
+    X, _, _, _ = process_data(data.drop(columns=["salary"]), categorical_features=cat_features,
+                              encoder=load_model("model/encoder.pkl"), training=False)
+    expected = apply_labels(inference(load_model("model/model.pkl"), X))
+    assert pd.read_csv(tmp_path / "output.csv")["prediction"].tolist() == expected
+
+## Test 12
+def test_mmap_engine_serves_without_sklearn_artifacts():
+    """
+    Ensure the memory-mapped engine and the JSON lookup table exported to
+    model/compiled/ predict like the pickled encoder and model.
+    """
+    from ml import executor
+    from ml.data import process_data
+    from ml.model import inference, load_model
+
+    cat_features = [
+        "workclass", "education", "marital-status", "occupation",
+        "relationship", "race", "sex", "native-country",
+    ]
+    data = pd.read_csv("data/census.csv", nrows=500).drop(columns=["salary"])
+    continuous = [c for c in data.columns if c not in cat_features]
+    X, _, _, _ = process_data(data, categorical_features=cat_features,
+                              encoder=load_model("model/encoder.pkl"), training=False)
+    expected = inference(load_model("model/model.pkl"), X)
+
+    executor.load_state("model", "mmap", cat_features, continuous)
+    assert isinstance(executor._state["model"].value, np.memmap)
+    preds, _ = executor.predict_records(data.to_dict(orient="records"))
+    np.testing.assert_array_equal(preds, expected)
+    preds, _ = executor.predict_dataframe(data)
+    np.testing.assert_array_equal(preds, expected)
+
+## Test 13
+def test_process_data_sparse_matches_dense():
+    """
+    Ensure the CSR encoding path yields the same matrix, labels and slice
+    metrics as the dense path, and that encoders are interchangeable.
+    """
+    from scipy import sparse as sp
+    from ml.data import process_data
+    from ml.model import performance_on_categorical_slice
+
+    cat_features = [
+        "workclass", "education", "marital-status", "occupation",
+        "relationship", "race", "sex", "native-country",
+    ]
+    data = pd.read_csv("data/census.csv", nrows=2000)
+    X_dense, y_dense, dense_encoder, lb = process_data(
+        data, categorical_features=cat_features, label="salary", training=True)
+    X_sparse, y_sparse, sparse_encoder, _ = process_data(
+        data, categorical_features=cat_features, label="salary", training=True, sparse=True)
+    assert sp.isspmatrix_csr(X_sparse) or isinstance(X_sparse, sp.csr_array)
+    np.testing.assert_array_equal(X_sparse.toarray(), X_dense)
+    np.testing.assert_array_equal(y_sparse, y_dense)
+
+    X_mixed, _, _, _ = process_data(data, categorical_features=cat_features, label="salary",
+                                    training=False, encoder=sparse_encoder, lb=lb)
+    np.testing.assert_array_equal(X_mixed, X_dense)
+
+    model = GradientBoostingClassifier(n_estimators=5, random_state=0).fit(X_sparse, y_sparse)
+    args = (data, "sex", "Female", cat_features, "salary", dense_encoder, lb, model)
+    assert performance_on_categorical_slice(*args, sparse=True) == performance_on_categorical_slice(*args)
+
+## Test 14
+def test_hist_backend_on_ordinal_encoding(tmp_path):
+    """
+    Ensure the ordinal encoding is one code column per categorical feature,
+    that RecordEncoder reproduces it (unknown categories as NaN) after a
+    save/load round trip, and that the hist backend trains on it.
+    """
+    from ml.data import RecordEncoder, process_data
+    from ml.model import inference
+
+    cat_features = [
+        "workclass", "education", "marital-status", "occupation",
+        "relationship", "race", "sex", "native-country",
+    ]
+    data = pd.read_csv("data/census.csv", nrows=600)
+    continuous = [c for c in data.columns if c not in cat_features + ["salary"]]
+    X, y, encoder, lb = process_data(data, categorical_features=cat_features, label="salary",
+                                     training=True, encoding="ordinal")
+    assert X.shape == (len(data), len(continuous) + len(cat_features))
+
+    features = data.drop(columns=["salary"])
+    features.loc[features.index[0], "native-country"] = "Atlantis"
+    X_expected, _, _, _ = process_data(features, categorical_features=cat_features,
+                                       encoder=encoder, training=False)
+    assert np.isnan(X_expected[0, -1])
+    record_encoder = RecordEncoder(encoder, cat_features, continuous)
+    record_encoder.save(tmp_path / "encoder.json")
+    loaded = RecordEncoder.load(tmp_path / "encoder.json")
+    for enc in (record_encoder, loaded):
+        np.testing.assert_array_equal(enc.transform(features.to_dict(orient="records")), X_expected)
+
+    model = train_model(X, y, backend="hist", n_categorical=len(cat_features))
+    assert model.best_estimator_.is_categorical_.sum() == len(cat_features)
+    assert inference(model, X_expected).shape == (len(data),)
+
+## Test 15
+def test_halving_search_promotes_best_and_respects_budget():
+    """
+    Ensure the halving search narrows the grid over rounds of growing
+    subsamples, refits the winner on all rows, and stops early on a budget.
+    """
+    from ml.model import HalvingSearch, inference
+
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(2700, 4))
+    y = (X[:, 0] + 0.5 * X[:, 1] > 0).astype(int)
+
+    model = train_model(X, y, search="halving")
+    assert isinstance(model, HalvingSearch)
+    assert [r["candidates"] for r in model.rounds_] == [18, 6, 2]
+    assert [r["rows"] for r in model.rounds_] == [100, 300, 900]
+    assert isinstance(model.best_estimator_, GradientBoostingClassifier)
+    assert model.best_estimator_.n_features_in_ == 4
+    assert inference(model, X).shape == (2700,)
+
+    # no round fits in a zero budget: only the first candidate is refitted
+    model = train_model(X, y, search="halving", budget=0)
+    assert model.rounds_ == []
+    assert set(model.best_params_) == {"n_estimators", "max_depth", "min_samples_split", "learning_rate"}
+    assert model.best_estimator_.n_features_in_ == 4
+
+    # a budget larger than every estimate runs all the rounds
+    model = train_model(X, y, search="halving", budget=1e6)
+    assert len(model.rounds_) == 3
+
+## Test 16
+def test_feature_cache_hits_evicts_and_invalidates(tmp_path):
+    """
+    Ensure cached process_data returns the same arrays memory-mapped, keys on
+    the data and the encoder, evicts least recently used entries and clears.
+    """
+    import os
+    from ml.data import process_data
+    from ml.feature_cache import FeatureCache
+
+    cat_features = [
+        "workclass", "education", "marital-status", "occupation",
+        "relationship", "race", "sex", "native-country",
+    ]
+    data = pd.read_csv("data/census.csv", nrows=1000)
+    train, test = data.iloc[:800], data.iloc[800:]
+    cache = FeatureCache(str(tmp_path))
+
+    X, y, encoder, lb = process_data(train, categorical_features=cat_features, label="salary")
+    for _ in range(2):
+        X_c, y_c, encoder_c, lb_c = cache.process_data(train, categorical_features=cat_features, label="salary")
+        np.testing.assert_array_equal(X_c, X)
+        np.testing.assert_array_equal(y_c, y)
+    assert isinstance(X_c, np.memmap)
+    assert list(encoder_c.categories_[0]) == list(encoder.categories_[0])
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    X_test, _, _, _ = cache.process_data(test, categorical_features=cat_features, label="salary",
+                                         training=False, encoder=encoder, lb=lb)
+    _, _, other, _ = process_data(test, categorical_features=cat_features, label="salary")
+    cache.process_data(test, categorical_features=cat_features, label="salary",
+                       training=False, encoder=other, lb=lb)
+    assert (cache.hits, cache.misses) == (1, 3)
+
+    X_sparse, _, _, _ = cache.process_data(test, categorical_features=cat_features, label="salary",
+                                           training=False, encoder=encoder, lb=lb, sparse=True)
+    X_sparse, _, _, _ = cache.process_data(test, categorical_features=cat_features, label="salary",
+                                           training=False, encoder=encoder, lb=lb, sparse=True)
+    np.testing.assert_array_equal(X_sparse.toarray(), X_test)
+
+    # the fingerprint depends on the fitted state, not on the pickle
+    from ml.feature_cache import encoder_fingerprint
+    _, _, refitted, refitted_lb = process_data(train, categorical_features=cat_features, label="salary")
+    assert encoder_fingerprint(refitted, refitted_lb) == encoder_fingerprint(encoder, lb)
+    assert encoder_fingerprint(other, lb) != encoder_fingerprint(encoder, lb)
+
+    # a corrupt entry is a miss, and is replaced by the next store
+    key = cache.key(train, categorical_features=cat_features, label="salary")
+    os.remove(os.path.join(str(tmp_path), key, "y.npy"))
+    hits, misses = cache.hits, cache.misses
+    for _ in range(2):
+        _, y_c, _, _ = cache.process_data(train, categorical_features=cat_features, label="salary")
+        np.testing.assert_array_equal(y_c, y)
+    assert (cache.hits - hits, cache.misses - misses) == (1, 1)
+
+    newest = cache.entries()[-1]
+    cache.max_bytes = newest[1]
+    cache._evict()
+    assert [e[0] for e in cache.entries()] == [newest[0]]
+    cache.clear()
+    assert cache.stats()["entries"] == 0 and os.listdir(tmp_path) == []
+
+## Test 17
+def test_slice_metrics_match_per_slice_evaluation(tmp_path):
+    """
+    Ensure the grouped slice metrics equal performance_on_categorical_slice
+    for every slice, and that the report keeps the slice_output.txt format.
+    """
+    from ml.data import process_data
+    from ml.model import (
+        compute_slice_metrics,
+        inference,
+        performance_on_categorical_slice,
+        write_slice_report,
+    )
+
+    cat_features = [
+        "workclass", "education", "marital-status", "occupation",
+        "relationship", "race", "sex", "native-country",
+    ]
+    data = pd.read_csv("data/census.csv", nrows=1500)
+    X, y, encoder, lb = process_data(data, categorical_features=cat_features, label="salary")
+    model = GradientBoostingClassifier(n_estimators=5, random_state=0).fit(X, y)
+    preds = inference(model, X)
+
+    metrics = compute_slice_metrics(data, cat_features + [("race", "sex")], y, preds)
+    for row in metrics[metrics["feature"] != ("race", "sex")].itertuples(index=False):
+        expected = performance_on_categorical_slice(
+            data, row.feature, row.value, cat_features, "salary", encoder, lb, model)
+        assert (row.precision, row.recall, row.fbeta) == pytest.approx(expected)
+        assert row.count == (data[row.feature] == row.value).sum()
+    pairs = metrics[metrics["feature"] == ("race", "sex")]
+    assert pairs["count"].sum() == len(data)
+
+    write_slice_report(metrics, tmp_path / "slices.txt")
+    lines = (tmp_path / "slices.txt").read_text().splitlines()
+    assert len(lines) == 2 * len(metrics)
+    assert lines[0].startswith(f"workclass: {metrics['value'][0]}, Count: ")
+    assert lines[1].startswith("Precision: ")
+    assert lines[-2].startswith("race x sex: White, Male, Count: ")
+
+    # a slice over one column, given as a 1-tuple, reports its values whole
+    single = compute_slice_metrics(data, [("race",)], y, preds)
+    assert list(single["feature"].unique()) == ["race"]
+    write_slice_report(single, tmp_path / "race.txt")
+    assert (tmp_path / "race.txt").read_text().splitlines()[0].startswith(f"race: {single['value'][0]}, Count: ")
+    assert "race: White, Count: " in (tmp_path / "race.txt").read_text()
+
+## Test 18
+def test_kfold_train_in_shared_memory_matches_serial_folds():
+    """
+    Ensure the parallel K-fold fits equal fitting each fold in-process, for
+    dense and CSR data, and that the fold ensemble predicts every row.
+    """
+    import os
+    from sklearn.model_selection import StratifiedKFold
+    from ml.data import process_data
+    from ml.kfold import FoldEnsemble, kfold_train
+
+    cat_features = [
+        "workclass", "education", "marital-status", "occupation",
+        "relationship", "race", "sex", "native-country",
+    ]
+    data = pd.read_csv("data/census.csv", nrows=900)
+    params = {"n_estimators": 5, "max_depth": 3}
+    shm_before = set(os.listdir("/dev/shm")) if os.path.isdir("/dev/shm") else set()
+    for sparse in (False, True):
+        X, y, _, _ = process_data(data, categorical_features=cat_features, label="salary", sparse=sparse)
+        result = kfold_train(X, y, params=params, n_splits=3, workers=2)
+        assert len(result["models"]) == len(result["folds"]) == 3
+        assert sum(f["rows"] for f in result["folds"]) == len(y)
+
+        splits = StratifiedKFold(n_splits=3, shuffle=True, random_state=0).split(np.zeros(len(y)), y)
+        for (train_idx, test_idx), model in zip(splits, result["models"]):
+            serial = GradientBoostingClassifier(random_state=0, **params).fit(X[train_idx], y[train_idx])
+            np.testing.assert_array_equal(model.predict(X[test_idx]), serial.predict(X[test_idx]))
+            np.testing.assert_array_equal(result["oof_preds"][test_idx], serial.predict(X[test_idx]))
+
+        ensemble = FoldEnsemble(result["models"])
+        assert set(ensemble.predict(X)) <= {0, 1} and len(ensemble.predict(X)) == len(y)
+    if shm_before:
+        assert set(os.listdir("/dev/shm")) == shm_before
+
+## Test 19
+def test_warm_start_carries_trees_over_extended_encoder():
+    """
+    Ensure extend_encoder appends unseen categories, that the remapped trees
+    predict the old rows exactly as before, and that warm starting adds stages.
+    """
+    from ml.data import extend_encoder, process_data
+    from ml.model import warm_start_model
+
+    cat_features = [
+        "workclass", "education", "marital-status", "occupation",
+        "relationship", "race", "sex", "native-country",
+    ]
+    data = pd.read_csv("data/census.csv", nrows=1500)
+    old = data[data["native-country"] != "Mexico"]
+    X, y, encoder, lb = process_data(old, categorical_features=cat_features, label="salary")
+    model = GradientBoostingClassifier(n_estimators=5, max_depth=3, random_state=0).fit(X, y)
+
+    extended, column_map = extend_encoder(encoder, data, cat_features, n_continuous=6)
+    assert list(extended.categories_[-1][:-1]) == list(encoder.categories_[-1])
+    assert extended.categories_[-1][-1] == "Mexico"
+    X_old, _, _, _ = process_data(old, categorical_features=cat_features, label="salary",
+                                  training=False, encoder=extended, lb=lb)
+    np.testing.assert_array_equal(X_old[:, column_map], X)
+
+    carried = warm_start_model(model, X_old, y, 0, column_map)
+    np.testing.assert_allclose(carried.decision_function(X_old), model.decision_function(X))
+    X_new, y_new, _, _ = process_data(data, categorical_features=cat_features, label="salary",
+                                      training=False, encoder=extended, lb=lb)
+    updated = warm_start_model(model, X_new, y_new, 3, column_map)
+    assert updated.n_estimators == 8 and updated.estimators_.shape == (8, 1)
+    assert model.n_estimators == 5
+
+    # the tree state layout is private to sklearn: other versions are refused
+    import sklearn
+    from unittest import mock
+    with mock.patch.object(sklearn, "__version__", "9.0.0"), pytest.raises(ValueError, match="9.0.0"):
+        warm_start_model(model, X_old, y, 1, column_map)
+
+def _lifespan_backend(main):
+    # The app lifespan shuts its backend down on exit; give each run its own.
+    from ml.executor import InferenceBackend
+    model_dir, engine, cat_features, continuous_features, sparse, bundle_path = main.backend.state_args
+    return InferenceBackend(main.backend.mode, model_dir, cat_features, continuous_features,
+                            max_workers=main.backend.max_workers, engine=engine, sparse=sparse,
+                            bundle_path=bundle_path)
+
+## Test 20
+def test_model_bundle_round_trip_and_hot_swap(tmp_path):
+    """
+    Ensure a bundle loads its members lazily with checksums, and that
+    POST /admin/reload swaps the served model, clears the cache, and keeps
+    the old model when the new bundle is bad or the token is missing.
+    """
+    import zipfile
+    from fastapi.testclient import TestClient
+    from sklearn.dummy import DummyClassifier
+    import main
+    from ml import executor
+    from ml.bundle import ModelBundle, save_bundle
+    from ml.data import process_data
+    from ml.model import load_model
+
+    data = pd.read_csv("data/census.csv", nrows=1000)
+    encoder = load_model("model/encoder.pkl")
+    _, y, _, lb = process_data(data, categorical_features=main.cat_features, label="salary")
+    X, _, _, _ = process_data(data, categorical_features=main.cat_features, label="salary",
+                              training=False, encoder=encoder, lb=lb)
+    args = (encoder, lb, main.cat_features, main.continuous_features)
+    shipped = save_bundle(str(tmp_path / "shipped.bundle"), load_model("model/model.pkl"), *args,
+                          metadata={"f1": 0.7})
+    always_high = DummyClassifier(strategy="constant", constant=1).fit(X, y)
+    save_bundle(str(tmp_path / "high.bundle"), always_high, *args, version="high")
+
+    bundle = ModelBundle.open(str(tmp_path / "shipped.bundle"))
+    assert bundle.version == shipped["version"] and bundle.metadata == {"f1": 0.7}
+    assert bundle._loaded == {}
+    assert list(bundle.lb.classes_) == ["<=50K", ">50K"]
+    assert set(bundle._loaded) == {"lb"}
+    bundle.verify()
+
+    tampered = tmp_path / "tampered.bundle"
+    with zipfile.ZipFile(tmp_path / "shipped.bundle") as src, zipfile.ZipFile(tampered, "w") as dst:
+        for item in src.infolist():
+            content = src.read(item)
+            dst.writestr(item, content + b"x" if item.filename == "model.pkl" else content)
+
+    # a bundle whose model pickle needs a module this environment lacks, with valid checksums
+    import hashlib
+    import json
+    incompatible = tmp_path / "incompatible.bundle"
+    foreign = b"cno_such_module\nModel\n)R."
+    with zipfile.ZipFile(tmp_path / "shipped.bundle") as src, zipfile.ZipFile(incompatible, "w") as dst:
+        manifest = json.loads(src.read("manifest.json"))
+        manifest["checksums"]["model"] = hashlib.sha256(foreign).hexdigest()
+        dst.writestr("manifest.json", json.dumps(manifest))
+        for name in ("encoder.pkl", "lb.pkl"):
+            dst.writestr(name, src.read(name))
+        dst.writestr("model.pkl", foreign)
+
+    sample = data.drop(columns=["salary"]).iloc[0].to_dict()
+    original = (main.backend, main.admin_token)
+    main.backend, main.admin_token = _lifespan_backend(main), "secret"
+    headers = {"X-Admin-Token": "secret"}
+    try:
+        with TestClient(main.app) as client:
+            assert client.post("/admin/reload", json={"path": str(tmp_path / "high.bundle")}).status_code == 403
+            r = client.post("/admin/reload", json={"path": str(tmp_path / "shipped.bundle")}, headers=headers)
+            assert r.status_code == 200 and r.json()["bundle_id"] == shipped["bundle_id"]
+            shipped_result = client.post("/inference/", json=sample).json()["result"]
+
+            r = client.post("/admin/reload", json={"path": str(tmp_path / "high.bundle")}, headers=headers)
+            assert r.json()["version"] == "high"
+            assert main.cache.stats()["size"] == 0
+            assert client.post("/inference/", json=sample).json()["result"] == ">50K"
+
+            r = client.post("/admin/reload", json={"path": str(tampered)}, headers=headers)
+            assert r.status_code == 400 and "Checksum" in r.json()["detail"]
+            r = client.post("/admin/reload", json={"path": str(incompatible)}, headers=headers)
+            assert r.status_code == 400 and "no_such_module" in r.json()["detail"]
+            assert client.post("/admin/reload", json={"path": str(tmp_path / "high.bundle")},
+                               headers={"X-Admin-Token": "secreT"}).status_code == 403
+            assert client.post("/inference/", json=sample).json()["result"] == ">50K"
+        assert shipped_result in ("<=50K", ">50K")
+    finally:
+        main.backend, main.admin_token = original
+        executor.load_state(*main.backend.state_args)
+        main.cache.clear()
+
+## Test 21
+def test_load_generator_in_process_counts_every_error():
+    """
+    Ensure local_api drives main.app in-process and reports every request,
+    and that exceptions raised by the app are counted instead of aborting.
+    """
+    import argparse
+    import asyncio
+    import json
+    import httpx
+    import local_api
+    import main
+
+    args = argparse.Namespace(
+        census="data/census.csv", in_process=True, url=None, concurrency=4, rps=None, duration=10.0,
+        requests=12, get_fraction=0.25, sample_fraction=0.5, seed=0, timeout=10.0, smoke=False, json=True)
+    original = main.backend
+    main.backend = _lifespan_backend(main)
+    try:
+        report, elapsed = asyncio.run(local_api.run(args))
+    finally:
+        main.backend = original
+    assert report["total"]["requests"] == 12 and report["total"]["errors"] == 0
+    assert report["/inference/"]["requests"] > 0 and report["/inference/"]["p50_ms"] > 0
+    json.dumps({"seconds": elapsed, "endpoints": report})
+
+    async def broken_app(scope, receive, send):
+        raise RuntimeError("boom")
+
+    async def drive():
+        transport = httpx.ASGITransport(app=broken_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://in-process") as client:
+            load = local_api.LoadGenerator(client, [], get_fraction=0.5)
+            await load.closed_loop(2, float("inf"), 6)
+            return load.report(1.0)
+
+    broken = asyncio.run(drive())
+    assert broken["total"]["requests"] == 6 and broken["total"]["errors"] == 6
+    assert broken["total"]["error_kinds"] == {"RuntimeError": 6}
+
+    idle = local_api.LoadGenerator(None, [], get_fraction=0.5).report(1.0)
+    assert idle == {"total": {"requests": 0, "rps": 0.0, "p50_ms": None, "p95_ms": None, "p99_ms": None,
+                              "errors": 0, "error_rate": 0.0, "error_kinds": {}}}
+
+def _worker_state():
+    # Runs in a process-pool worker: what its initializer loaded.
+    import os
+    from ml import executor
+    return os.getpid(), type(executor._state.get("model")).__name__, executor._state.get("generation")
+
+## Test 22
+def test_inference_backend_modes_predict_alike():
+    """
+    Ensure the inline, thread and process backends score the same records to
+    the same predictions, and that process workers load the state themselves.
+    """
+    import asyncio
+    import os
+    import main
+    from ml import executor
+    from ml.model import load_model
+
+    records = pd.read_csv("data/census.csv", nrows=60).drop(columns=["salary"]).to_dict(orient="records")
+    expected = load_model("model/model.pkl").predict(
+        executor.RecordEncoder(load_model("model/encoder.pkl"), main.cat_features,
+                               main.continuous_features).transform(records))
+
+    original = executor._state
+    try:
+        for mode in executor.BACKENDS:
+            executor.load_state("model", "mmap", main.cat_features, main.continuous_features)
+            if mode == "process":
+                # workers must not inherit the state of this process
+                executor._state = {}
+            backend = executor.InferenceBackend(mode, "model", main.cat_features, main.continuous_features,
+                                                max_workers=2, engine="mmap")
+            try:
+                if mode == "process":
+                    pid, model_type, generation = backend.pool.submit(_worker_state).result()
+                    assert pid != os.getpid()
+                    assert model_type == "CompiledGradientBoosting" and generation == 0
+
+                async def score():
+                    return await asyncio.gather(backend.run(executor.predict_records, records),
+                                                backend.run(executor.predict_frame, records))
+
+                (by_record, _), (by_frame, _) = asyncio.run(score())
+                np.testing.assert_array_equal(by_record, expected, err_msg=mode)
+                np.testing.assert_array_equal(by_frame, expected, err_msg=mode)
+            finally:
+                backend.shutdown()
+    finally:
+        executor._state = original
@@ -1,17 +1,66 @@
+import argparse
 import os
+import shutil
+import time
 
 import pandas as pd
+import sklearn
 from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import LabelBinarizer
 
-from ml.data import process_data
+from ml.bundle import save_bundle
+from ml.compiled import compile_model
+from ml.data import RecordEncoder, extend_encoder, process_data
+from ml.feature_cache import FeatureCache
+from ml.kfold import FoldEnsemble, kfold_train
 from ml.model import (
+    MODEL_BACKENDS,
+    SEARCH_MODES,
     compute_model_metrics,
+    compute_slice_metrics,
     inference,
     load_model,
-    performance_on_categorical_slice,
     save_model,
+    search_space,
     train_model,
+    warm_start_model,
+    write_slice_report,
 )
+parser = argparse.ArgumentParser(description="Train the census salary model and evaluate it on slices.")
+parser.add_argument("--sparse", action="store_true",
+                    help="keep the one hot features in CSR form for encoding, training and evaluation")
+parser.add_argument("--backend", choices=MODEL_BACKENDS, default="gradient_boosting",
+                    help="'hist' trains a histogram booster on integer coded categoricals")
+parser.add_argument("--search", choices=SEARCH_MODES, default="grid",
+                    help="'halving' ranks candidates on subsamples and only promotes the best ones")
+parser.add_argument("--budget", type=float, default=None,
+                    help="wall-clock budget in seconds of the halving search; rounds whose estimated time, "
+                         "with the final refit, would exceed it are skipped (the refit always runs)")
+parser.add_argument("--feature-cache", default=".feature_cache",
+                    help="directory caching the processed arrays across runs ('' to disable)")
+parser.add_argument("--slice", action="append", default=[], metavar="COL,COL",
+                    help="also report slices over combinations of these columns (repeatable)")
+parser.add_argument("--kfold", type=int, default=0, metavar="K",
+                    help="also cross-validate the best hyperparameters on K folds of the whole data")
+parser.add_argument("--kfold-workers", type=int, default=None,
+                    help="processes training the fold models in parallel (default: one per fold, up to the cpu count)")
+parser.add_argument("--kfold-ensemble", action="store_true",
+                    help="serve a soft-voting ensemble of the K fold models as model/model.pkl")
+parser.add_argument("--new-data", action="append", default=[], metavar="CSV",
+                    help="newly arrived census rows to add to data/census.csv (repeatable)")
+parser.add_argument("--incremental", action="store_true",
+                    help="extend the saved encoder and continue boosting the saved model instead of searching again")
+parser.add_argument("--more-estimators", type=int, default=10,
+                    help="boosting stages added by --incremental")
+parser.add_argument("--compare-full", action="store_true",
+                    help="with --incremental, also run a full retrain and compare the two")
+args = parser.parse_args()
+if args.sparse and args.backend == "hist":
+    parser.error("--sparse only applies to the one hot encoding of the gradient_boosting backend")
+if args.kfold_ensemble and not args.kfold:
+    parser.error("--kfold-ensemble needs --kfold K")
+encoding = "ordinal" if args.backend == "hist" else "onehot"
+
 # TODO: load the cencus.csv data
 project_path = os.getcwd()
 data_path = os.path.join(project_path, "data", "census.csv")
@@ -26,6 +75,22 @@ train, test = train_test_split( data,
                                 stratify=data['salary']
                                 )   # Your code here
 
+# newly arrived rows are split on their own and added to each side, so the census
+# split stays the one the saved model was trained and evaluated on
+if args.new_data:
+    new = pd.concat([pd.read_csv(path) for path in args.new_data], ignore_index=True)
+    if len(new) < 2:
+        new_train, new_test = new, new.iloc[:0]
+    else:
+        try:
+            new_train, new_test = train_test_split(new, test_size=0.20, random_state=10, stratify=new["salary"])
+        except ValueError:
+            # too few rows of a class to stratify
+            new_train, new_test = train_test_split(new, test_size=0.20, random_state=10)
+    train = pd.concat([train, new_train], ignore_index=True)
+    test = pd.concat([test, new_test], ignore_index=True)
+    data = pd.concat([data, new], ignore_index=True)
+
 # DO NOT MODIFY
 cat_features = [
     "workclass",
@@ -38,35 +103,110 @@ cat_features = [
     "native-country",
 ]
 
-# TODO: use the process_data function provided to process the data.
-X_train, y_train, encoder, lb = process_data(
-    train,
-    categorical_features=cat_features,
-    label="salary",
-    training=True
+# reruns with the same data and options load the encoded arrays memory-mapped
+# instead of encoding again; `python -m ml.feature_cache clear` invalidates them
+feature_cache = FeatureCache(args.feature_cache) if args.feature_cache else None
+encode = feature_cache.process_data if feature_cache is not None else process_data
+
+model_path = os.path.join(project_path, "model", "model.pkl")
+encoder_path = os.path.join(project_path, "model", "encoder.pkl")
+continuous_features = [c for c in train.columns if c not in cat_features + ["salary"]]
+
+if args.incremental:
+    # keep the layout and hyperparameters of the saved model: the saved encoder
+    # learns the new categories and the trees are carried over to its columns
+    start = time.perf_counter()
+    previous_model = load_model(model_path)
+    previous_encoder = load_model(encoder_path)
+    args.backend = "hist" if hasattr(previous_encoder, "unknown_value") else "gradient_boosting"
+    encoding = "ordinal" if args.backend == "hist" else "onehot"
+    encoder, column_map = extend_encoder(previous_encoder, train, cat_features, len(continuous_features))
+    lb = LabelBinarizer().fit(train["salary"].values)
+    X_train, y_train, _, _ = encode(
+        train,
+        categorical_features=cat_features,
+        label="salary",
+        training=False,
+        encoder=encoder,
+        lb=lb,
+        sparse=args.sparse,
     )
-    # your code here
-     # use the train dataset
-    # use training=True
-    # do not need to pass encoder and lb as input
+else:
+    # TODO: use the process_data function provided to process the data.
+    X_train, y_train, encoder, lb = encode(
+        train,
+        categorical_features=cat_features,
+        label="salary",
+        training=True,
+        sparse=args.sparse,
+        encoding=encoding,
+        )
+        # your code here
+         # use the train dataset
+        # use training=True
+        # do not need to pass encoder and lb as input
 
-X_test, y_test, _, _ = process_data(
+X_test, y_test, _, _ = encode(
     test,
     categorical_features=cat_features,
     label="salary",
     training=False,
     encoder=encoder,
     lb=lb,
+    sparse=args.sparse,
 )
 
-# TODO: use the train_model function to train the model on the training dataset
-model = train_model(X_train, y_train) # your code here
+if args.incremental:
+    model = warm_start_model(previous_model, X_train, y_train, args.more_estimators, column_map)
+    incremental_seconds = time.perf_counter() - start
+else:
+    # TODO: use the train_model function to train the model on the training dataset
+    model = train_model(X_train, y_train, backend=args.backend, n_categorical=len(cat_features),
+                        search=args.search, budget=args.budget) # your code here
+
+# hyperparameters of the model (an incrementally updated model is the bare
+# estimator, without best_params_)
+best_params = getattr(model, "best_params_", None) or {
+    k: model.get_params()[k] for k in search_space(args.backend, X_train.shape[1])[1]}
+
+# Optional enhancement: K-fold cross validation of the best hyperparameters on the
+# whole data, with the fold models trained in parallel processes
+if args.kfold:
+    X_all, y_all, _, _ = process_data(
+        data,
+        categorical_features=cat_features,
+        label="salary",
+        training=False,
+        encoder=encoder,
+        lb=lb,
+        sparse=args.sparse,
+    )
+    kfold = kfold_train(X_all, y_all, params=best_params, backend=args.backend,
+                        n_categorical=len(cat_features), n_splits=args.kfold, workers=args.kfold_workers)
+    for i, fold in enumerate(kfold["folds"]):
+        print(f"Fold {i}: Precision: {fold['precision']:.4f} | Recall: {fold['recall']:.4f} "
+              f"| F1: {fold['fbeta']:.4f} ({fold['seconds']:.1f}s)")
+    mean, std = kfold["mean"], kfold["std"]
+    print(f"{args.kfold}-fold mean: Precision: {mean['precision']:.4f} ± {std['precision']:.4f} "
+          f"| Recall: {mean['recall']:.4f} ± {std['recall']:.4f} | F1: {mean['fbeta']:.4f} ± {std['fbeta']:.4f} "
+          f"in {kfold['seconds']:.1f}s on {kfold['workers']} processes")
+    if args.kfold_ensemble:
+        # the ensemble replaces the single model before any artifact is written, so
+        # model.pkl, the bundle, the metrics and the slice report all describe it
+        model = FoldEnsemble(kfold["models"])
 
 # save the model and the encoder
-model_path = os.path.join(project_path, "model", "model.pkl")
 save_model(model, model_path)
-encoder_path = os.path.join(project_path, "model", "encoder.pkl")
 save_model(encoder, encoder_path)
+# export the trees of the best estimator as flat arrays, and the encoder as a lookup
+# table, so the API can memory-map them without unpickling
+# (histogram boosters and fold ensembles cannot be compiled; drop a stale export so
+# the API serves model.pkl with the sklearn engine instead)
+compiled_path = os.path.join(project_path, "model", "compiled")
+if args.backend == "hist" or args.kfold_ensemble:
+    shutil.rmtree(compiled_path, ignore_errors=True)
+else:
+    compile_model(model).save(compiled_path, RecordEncoder(encoder, cat_features, continuous_features))
 
 # load the model
 model = load_model(
@@ -80,23 +220,53 @@ preds = inference(model, X_test) # your code here
 p, r, fb = compute_model_metrics(y_test, preds)
 print(f"Precision: {p:.4f} | Recall: {r:.4f} | F1: {fb:.4f}")
 
-# TODO: compute the performance on model slices using the performance_on_categorical_slice function
-# iterate through the categorical features
-for col in cat_features:
-    # iterate through the unique values in one categorical feature
-    for slicevalue in sorted(test[col].unique()):
-        count = test[test[col] == slicevalue].shape[0]
-        p, r, fb = performance_on_categorical_slice(
-            # your code herecd
-            test,  # use test, col and slicevalue as part of the input
-            col,
-            slicevalue,
-            categorical_features=cat_features,
-            label="salary",
-            encoder=encoder,
-            lb=lb,
-            model=model,
-        )
-        with open("slice_output.txt", "a") as f:
-            print(f"{col}: {slicevalue}, Count: {count:,}", file=f)
-            print(f"Precision: {p:.4f} | Recall: {r:.4f} | F1: {fb:.4f}", file=f)
\ No newline at end of file
+# save encoder, label binarizer, model, feature order and training metadata as one
+# versioned file, which the API can serve (INFERENCE_BUNDLE) and hot-swap
+bundle = save_bundle(
+    os.path.join(project_path, "model", "model.bundle"),
+    model,
+    encoder,
+    lb,
+    cat_features,
+    continuous_features,
+    label="salary",
+    metadata={
+        "backend": args.backend,
+        "search": "incremental" if args.incremental else args.search,
+        "params": best_params,
+        "train_rows": len(train),
+        "test_rows": len(test),
+        "precision": p,
+        "recall": r,
+        "f1": fb,
+        "sklearn": sklearn.__version__,
+        # the fold models were trained on the test rows too: their out-of-fold
+        # metrics are the held-out estimate of the ensemble
+        "kfold_ensemble": kfold["oof"] if args.kfold_ensemble else None,
+    },
+)
+print(f"Saved bundle {bundle['version']} ({bundle['bundle_id']})")
+
+# compute the performance on every slice of the categorical features from the
+# test predictions above, in one grouped pass, and write the report once
+# (see performance_on_categorical_slice to evaluate a single slice)
+slices = cat_features + [tuple(spec.split(",")) if "," in spec else spec for spec in args.slice]
+write_slice_report(compute_slice_metrics(test, slices, y_test, preds), "slice_output.txt")
+
+# compare the incremental update with a full retrain (new encoder and search) on
+# the same split; nothing from the full retrain is saved
+if args.incremental and args.compare_full:
+    start = time.perf_counter()
+    X_full, y_full, full_encoder, full_lb = process_data(
+        train, categorical_features=cat_features, label="salary", training=True,
+        sparse=args.sparse, encoding=encoding)
+    full_model = train_model(X_full, y_full, backend=args.backend, n_categorical=len(cat_features),
+                             search=args.search, budget=args.budget)
+    full_seconds = time.perf_counter() - start
+    X_full_test, y_full_test, _, _ = process_data(
+        test, categorical_features=cat_features, label="salary", training=False,
+        encoder=full_encoder, lb=full_lb, sparse=args.sparse)
+    full = compute_model_metrics(y_full_test, inference(full_model, X_full_test))
+    for name, seconds, (p, r, fb) in [("incremental", incremental_seconds, compute_model_metrics(y_test, preds)),
+                                      ("full", full_seconds, full)]:
+        print(f"{name:<12} {seconds:>8.1f}s | Precision: {p:.4f} | Recall: {r:.4f} | F1: {fb:.4f}")
@@ -0,0 +1,85 @@
+# Benchmark of the db write paths, in rows per second:
+#   - single: insert_weather_data, one ORM session and commit per row, on a plain create_engine with SQLite's
+#     defaults (rollback journal, synchronous=FULL), i.e. the path main.py used before the bulk API
+#   - bulk-plain: insert_weather_rows, batched executemany transactions, on the same untuned engine
+#   - bulk: insert_weather_rows through the shared engine of get_engine, with journal_mode=WAL and synchronous=NORMAL
+#
+# Each run writes into a fresh SQLite file in a temporary directory. The single path is only run up to
+# --max-single rows, since at one commit per row 1M rows would take a very long time.
+#
+# Usage:
+#   python benchmark_db.py
+#   python benchmark_db.py --sizes 1000 10000 --batch-size 5000
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine
+
+from database import Base, dispose_engine, insert_weather_data, insert_weather_rows, recreate_table
+from weather_data import WeatherData
+
+
+# Builds 'n' WeatherData objects with their statistics filled in, as if fetched from the API
+def make_weather(n):
+    date = datetime(2024, 8, 29)
+    weather_list = []
+    for i in range(n):
+        weather = WeatherData(latitude=-90 + (i % 18000) / 100, longitude=-180 + i / n * 360, date=date)
+        weather.avg_temp, weather.min_temp, weather.max_temp = 52.6, -7.3, 94.8
+        weather.avg_wind_speed, weather.min_wind_speed, weather.max_wind_speed = 10.0, 5.0, 15.0
+        weather.sum_precipitation, weather.min_precipitation, weather.max_precipitation = 233.872, 0.0, 2.0
+        weather_list.append(weather)
+    return weather_list
+
+
+def single(engine, weather_list, batch_size):
+    for weather in weather_list:
+        insert_weather_data(engine, weather)
+
+
+def bulk(engine, weather_list, batch_size):
+    insert_weather_rows(engine, weather_list, batch_size=batch_size)
+
+
+# Untuned engine, as database.py used to create: no shared engine and no PRAGMAs
+def plain_engine(url):
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def run(path, weather_list, batch_size, tmp, name, tuned):
+    url = f"sqlite:///{os.path.join(tmp, name + '.db')}"
+    engine = recreate_table(url) if tuned else plain_engine(url)
+    start = time.perf_counter()
+    path(engine, weather_list, batch_size)
+    seconds = time.perf_counter() - start
+    if tuned:
+        dispose_engine(url)
+    else:
+        engine.dispose()
+    return seconds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rows per second of the one-at-a-time and bulk db inserts.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--batch-size", type=int, default=10000, help="rows per transaction of the bulk path")
+    parser.add_argument("--max-single", type=int, default=10000, help="largest size run on the single path")
+    args = parser.parse_args()
+
+    print(f"{'rows':>9} {'path':>10} {'seconds':>9} {'rows/s':>11} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            weather_list = make_weather(n)
+            single_seconds = None
+            if n <= args.max_single:
+                single_seconds = run(single, weather_list, args.batch_size, tmp, f"single{n}", tuned=False)
+                print(f"{n:>9} {'single':>10} {single_seconds:>9.2f} {n / single_seconds:>11,.0f}")
+            for name, tuned in (("bulk-plain", False), ("bulk", True)):
+                seconds = run(bulk, weather_list, args.batch_size, tmp, f"{name}{n}", tuned)
+                speedup = f"{single_seconds / seconds:>7.1f}x" if single_seconds else f"{'':>8}"
+                print(f"{n:>9} {name:>10} {seconds:>9.2f} {n / seconds:>11,.0f} {speedup}")
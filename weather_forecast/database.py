@@ -4,7 +4,14 @@
 # using python classes
 # sessionmaker - factory for creating new SQLAlchemy Session objects,
 # which manage connections and transactions with the database.
-from sqlalchemy import create_engine, Column, Integer, Float
+# event - used to tune every new SQLite connection, insert - core INSERT statement used by the bulk writes
+import threading
+from datetime import date
+
+# func, select - used to compute the aggregates of the daily observations in SQL
+# sqlite_insert - INSERT with ON CONFLICT, to overwrite a day that is fetched again
+from sqlalchemy import create_engine, event, func, insert, select, Column, Date, Integer, Float
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import declarative_base, sessionmaker
 
 # Base handles the internal SQLAlchemy mechanics needed to map Python classes to database tables.
@@ -29,20 +36,71 @@ class WeatherRecord(Base):
     min_precipitation_inches = Column(Float)
     max_precipitation_inches = Column(Float)
 
-def recreate_table():
-    engine = create_engine('sqlite:///weather.db') # This creates a connection to an SQLite database file
-                                                    # named weather.db. The sqlite:/// prefix indicates that
-                                                    # the database is an SQLite file.
-    Base.metadata.drop_all(engine)  # Drop all tables, this is useful for dynamic dates/resetting the db schema
-    Base.metadata.create_all(engine)  # Recreate all tables
+# Daily time series table 'daily_observation': one row per location and day, with the daily variables of the
+# Open-Meteo archive (NULL for missing values). (latitude, longitude, date) is the primary key, so SQLite keeps a
+# unique index on it: looking up the last stored day of a location, or its days in a date range, is an index seek.
+# Unlike 'weather_data', this table is never dropped, it only grows by the days that are missing (see sync()).
+DAILY_VARIABLES = ('temperature_2m_max', 'temperature_2m_min', 'temperature_2m_mean', 'precipitation_sum',
+                   'wind_speed_10m_max')
+
+class DailyObservation(Base):
+    __tablename__ = 'daily_observation'
+    latitude = Column(Float, primary_key=True)
+    longitude = Column(Float, primary_key=True)
+    date = Column(Date, primary_key=True)
+    temperature_2m_max = Column(Float)
+    temperature_2m_min = Column(Float)
+    temperature_2m_mean = Column(Float)
+    precipitation_sum = Column(Float)
+    wind_speed_10m_max = Column(Float)
+
+# One engine per database URL, shared by every caller in the process. An engine owns a pool of connections,
+# so reusing it avoids reconnecting (and re-running the PRAGMAs below) on every call.
+_engines = {}
+_engines_lock = threading.Lock()
+
+# Every new SQLite connection is switched to WAL mode, where readers do not block the writer and a commit
+# appends to the log instead of rewriting pages. synchronous=NORMAL then only syncs the log at checkpoints,
+# which is still safe against corruption in WAL mode; a power loss can at most lose the last commits.
+# (In-memory databases ignore journal_mode=WAL.)
+def _tune_sqlite(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+# Returns the shared engine connected to the db at 'url' and makes sure the table exists, without dropping
+# existing rows. Used by the bulk ingestion in ingest.py, which adds to the table instead of resetting it.
+def get_engine(url='sqlite:///weather.db'):
+    with _engines_lock:
+        engine = _engines.get(url)
+        if engine is None:
+            engine = create_engine(url)  # The sqlite:/// prefix indicates that the database is an SQLite file.
+            if engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', _tune_sqlite)
+            Base.metadata.create_all(engine)
+            _engines[url] = engine
     return engine
 
-def insert_weather_data(engine, weather_data):
-    Session = sessionmaker(bind=engine)
-    session = Session()
+# Closes the connections of the shared engine of 'url' and forgets it, e.g. once a temporary database is deleted.
+# The next get_engine(url) creates a new one.
+def dispose_engine(url):
+    with _engines_lock:
+        engine = _engines.pop(url, None)
+    if engine is not None:
+        engine.dispose()
+
+# Drops and recreates the 'weather_data' table, this is useful for dynamic dates/resetting the summary rows.
+# The 'daily_observation' store is kept.
+def recreate_table(url='sqlite:///weather.db'):
+    engine = get_engine(url)  # This is the shared connection to the SQLite database file named weather.db.
+    WeatherRecord.__table__.drop(engine, checkfirst=True)
+    Base.metadata.create_all(engine)  # Recreate the missing tables
+    return engine
 
-    # creates a new instance of WeatherRecord with attributes populated from the weather_data object
-    record = WeatherRecord(
+# creates a new instance of WeatherRecord with attributes populated from the weather_data object
+def weather_record(weather_data):
+    return WeatherRecord(
         latitude=weather_data.latitude,
         longitude=weather_data.longitude,
         month=weather_data.date.month,
@@ -58,10 +116,109 @@ def insert_weather_data(engine, weather_data):
         min_precipitation_inches=weather_data.min_precipitation,
         max_precipitation_inches=weather_data.max_precipitation
         )
+
+def insert_weather_data(engine, weather_data):
+    Session = sessionmaker(bind=engine)
+    session = Session()
+
+    record = weather_record(weather_data)
     session.add(record) #adds the new record to the session, staging it for insertion into the database.
     session.commit() #commits the transaction, which inserts the record into the database
     session.close() #closes the session, releasing the connection back to the connection pool
 
+# Same columns as weather_record, as a plain dict for the bulk insert below
+def weather_row(weather_data):
+    return {
+        'latitude': weather_data.latitude,
+        'longitude': weather_data.longitude,
+        'month': weather_data.date.month,
+        'day': weather_data.date.day,
+        'year': weather_data.date.year,
+        'avg_temp_Fahrenheit': weather_data.avg_temp,
+        'min_temp_Fahrenheit': weather_data.min_temp,
+        'max_temp_Fahrenheit': weather_data.max_temp,
+        'avg_wind_speed_mph': weather_data.avg_wind_speed,
+        'min_wind_speed_mph': weather_data.min_wind_speed,
+        'max_wind_speed_mph': weather_data.max_wind_speed,
+        'sum_precipitation_inches': weather_data.sum_precipitation,
+        'min_precipitation_inches': weather_data.min_precipitation,
+        'max_precipitation_inches': weather_data.max_precipitation,
+    }
+
+# Bulk insert of many rows: 'rows' may mix WeatherData objects and dicts keyed by WeatherRecord column names
+# (missing columns are stored as NULL). The rows are written 'batch_size' at a time, one transaction per batch,
+# with a core INSERT run as a single executemany: the statement is compiled and prepared once per batch instead
+# of building an ORM object and flushing it per row. Returns the number of rows inserted.
+def insert_weather_rows(engine, rows, batch_size=10000):
+    statement = insert(WeatherRecord.__table__)
+    columns = [column.name for column in WeatherRecord.__table__.columns if column.name != 'id']
+    inserted = 0
+    batch = []
+
+    def flush():
+        with engine.begin() as connection:  # commits at the end of the block, rolls back on error
+            connection.execute(statement, batch)
+
+    for row in rows:
+        row = weather_row(row) if not isinstance(row, dict) else row
+        # Every dict of an executemany needs the same keys
+        batch.append({column: row.get(column) for column in columns})
+        if len(batch) >= batch_size:
+            flush()
+            inserted += len(batch)
+            batch = []
+    if batch:
+        flush()
+        inserted += len(batch)
+    return inserted
+
+# Inserts many WeatherData objects in one transaction, one commit per batch instead of one per record
+def insert_weather_batch(engine, weather_list):
+    return insert_weather_rows(engine, weather_list, batch_size=max(1, len(weather_list)))
+
+# Returns the last day stored for the location, or None if it has no observations yet
+def last_observed_date(engine, latitude, longitude):
+    query = (select(func.max(DailyObservation.date))
+             .where(DailyObservation.latitude == latitude, DailyObservation.longitude == longitude))
+    with engine.connect() as connection:
+        return connection.execute(query).scalar()
+
+# Stores the days of an archive 'daily' payload for the location, in one executemany transaction.
+# A day that is already stored is overwritten, since the archive may revise its most recent days.
+# Returns the number of days written.
+def insert_daily_observations(engine, latitude, longitude, daily):
+    rows = [
+        {'latitude': latitude, 'longitude': longitude, 'date': date.fromisoformat(day),
+         **{variable: daily[variable][i] for variable in DAILY_VARIABLES}}
+        for i, day in enumerate(daily['time'])
+    ]
+    if not rows:
+        return 0
+    statement = sqlite_insert(DailyObservation.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=['latitude', 'longitude', 'date'],
+        set_={variable: statement.excluded[variable] for variable in DAILY_VARIABLES},
+    )
+    with engine.begin() as connection:
+        connection.execute(statement, rows)
+    return len(rows)
+
+# Computes count, sum, mean, min and max of every daily variable of the location between 'start' and 'end'
+# (inclusive) with a single SQL query. Like the numpy statistics, NULL (missing) values are left out and a
+# variable with no values gives a count of 0 and None for the rest.
+# Returns {variable: {'count': ..., 'sum': ..., 'mean': ..., 'min': ..., 'max': ...}}
+def daily_aggregates(engine, latitude, longitude, start, end):
+    names = ('count', 'sum', 'mean', 'min', 'max')
+    functions = (func.count, func.sum, func.avg, func.min, func.max)
+    columns = [function(getattr(DailyObservation, variable))
+               for variable in DAILY_VARIABLES for function in functions]
+    query = (select(*columns)
+             .where(DailyObservation.latitude == latitude, DailyObservation.longitude == longitude,
+                    DailyObservation.date >= start, DailyObservation.date <= end))
+    with engine.connect() as connection:
+        values = iter(connection.execute(query).one())
+    return {variable: {name: next(values) for name in names} for variable in DAILY_VARIABLES}
+
 #querying and displaying weather data from the db
 def query_weather_data(engine):
     Session = sessionmaker(bind=engine)
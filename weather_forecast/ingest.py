@@ -0,0 +1,151 @@
+# Bulk ingestion: fetches the 5-year weather statistics of many locations concurrently and stores them in the db.
+#
+# One WeatherData object handles one latitude/longitude. To ingest thousands of sites, this module runs many of
+# them on a bounded thread pool that shares one requests.Session:
+#   - keep-alive: the session's connection pool holds at most 'workers' connections, which are reused
+#     across locations instead of opening a new TCP/TLS connection per request
+#   - retries: connection errors, 429 and 5xx answers are retried with exponential backoff, honoring Retry-After
+#   - rate limiting: new locations are started at most 'rate' times per second
+#   - batching: finished locations are inserted 'batch_size' at a time, one commit per batch
+#
+# Usage, with a CSV file having 'latitude' and 'longitude' columns:
+#   python ingest.py locations.csv --workers 16 --rate 10 --batch-size 200
+import argparse
+import csv
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from database import get_engine, insert_weather_batch
+from weather_data import ARCHIVE_URL, WeatherData
+
+# Answers worth retrying: rate limited, or a temporary server side failure
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+# Builds a session whose connection pool is shared by all worker threads.
+# pool_block=True makes a thread wait for a free connection instead of opening an extra one,
+# so there are never more than 'pool_size' connections open per host.
+def make_session(pool_size=8, retries=3, backoff=0.5):
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=["GET"],
+        respect_retry_after_header=True,
+        raise_on_status=False,  # hand back the last failed response instead of raising
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# Spaces out calls to wait() so that at most 'rate' of them return per second, across all threads.
+# A rate of None or 0 means no limit.
+class RateLimiter:
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next)
+            self._next = at + self.interval
+        time.sleep(max(0.0, at - now))
+
+
+# Fetches and computes the statistics of one location; returns the WeatherData object.
+# Raises requests.RequestException if the request could not be completed, or ValueError
+# if the API answered with an error status after all retries, or with a payload that is not
+# an archive response (e.g. a 200 without 'daily'), so that one bad location cannot stop the run.
+def fetch_location(latitude, longitude, date, session, limiter, base_url=ARCHIVE_URL, timeout=30):
+    limiter.wait()
+    weather = WeatherData(latitude, longitude, date, session=session, base_url=base_url, timeout=timeout)
+    try:
+        if weather.load_daily() is None:
+            raise ValueError(f"Error fetching data: {weather.status_code}")
+        weather.fetch_weather_data()
+    except (KeyError, TypeError, IndexError) as exc:
+        raise ValueError(f"Unexpected archive response: {type(exc).__name__}: {exc}") from exc
+    return weather
+
+
+# Ingests every (latitude, longitude) pair in 'locations' into the db behind 'engine'.
+# Returns a summary dict: number of locations, rows inserted, batches committed, seconds taken,
+# and the failed locations as (latitude, longitude, error message) tuples.
+def ingest_locations(locations, engine, date=None, workers=8, rate=10.0, batch_size=100, retries=3,
+                     backoff=0.5, base_url=ARCHIVE_URL, timeout=30):
+    date = date or datetime.today()
+    start = time.perf_counter()
+    limiter = RateLimiter(rate)
+    session = make_session(pool_size=workers, retries=retries, backoff=backoff)
+
+    batch, failed = [], []
+    inserted = batches = 0
+    # Only this thread writes to the db, the worker threads only fetch
+    with session, ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(fetch_location, latitude, longitude, date, session, limiter, base_url, timeout):
+                (latitude, longitude)
+            for latitude, longitude in locations
+        }
+        for future in as_completed(futures):
+            try:
+                batch.append(future.result())
+            except (requests.RequestException, ValueError) as exc:
+                failed.append((*futures[future], str(exc)))
+                continue
+            if len(batch) >= batch_size:
+                insert_weather_batch(engine, batch)
+                inserted += len(batch)
+                batches += 1
+                batch = []
+    if batch:
+        insert_weather_batch(engine, batch)
+        inserted += len(batch)
+        batches += 1
+
+    return {
+        "locations": len(futures),
+        "inserted": inserted,
+        "batches": batches,
+        "failed": failed,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+# Reads (latitude, longitude) pairs from a CSV file with 'latitude' and 'longitude' columns
+def read_locations(path):
+    with open(path, newline="") as f:
+        return [(float(row["latitude"]), float(row["longitude"])) for row in csv.DictReader(f)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch the weather statistics of many locations into the db.")
+    parser.add_argument("locations", help="CSV file with latitude and longitude columns")
+    parser.add_argument("--db", default="sqlite:///weather.db", help="database URL")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent requests and pooled connections")
+    parser.add_argument("--rate", type=float, default=10.0, help="locations started per second, 0 for no limit")
+    parser.add_argument("--batch-size", type=int, default=100, help="rows per db commit")
+    parser.add_argument("--retries", type=int, default=3, help="retries per request")
+    parser.add_argument("--backoff", type=float, default=0.5, help="exponential backoff factor in seconds")
+    parser.add_argument("--timeout", type=float, default=30, help="request timeout in seconds")
+    parser.add_argument("--base-url", default=ARCHIVE_URL)
+    args = parser.parse_args()
+
+    summary = ingest_locations(read_locations(args.locations), get_engine(args.db), workers=args.workers,
+                               rate=args.rate, batch_size=args.batch_size, retries=args.retries,
+                               backoff=args.backoff, base_url=args.base_url, timeout=args.timeout)
+    print(f"Inserted {summary['inserted']} of {summary['locations']} locations in {summary['batches']} "
+          f"batches, {summary['seconds']:.1f}s")
+    for latitude, longitude, error in summary["failed"]:
+        print(f"Failed {latitude}, {longitude}: {error}")
@@ -20,12 +20,19 @@ def main():
     longitude = -80.9001
     today = datetime.today()
 
+    # recreate_table is called to ensure that the db tables exist. Only the summary table 'weather_data' is dropped
+    # and recreated (reset daily); the daily observations stored by earlier runs are kept
+    # this function returns an 'engine' object which is the sqlalchemy connection to the db
+    engine = recreate_table()
+
     # An instance of the 'WeatherData' class is created using lat, long, current date
     weather = WeatherData(latitude, longitude, today)
 
-    # The 'fetch_weather_data()' method is called on this instance to retrieve the weather data for the location
-    # and date range, most recent 5 years
-    weather.fetch_weather_data()
+    # The 'sync()' method is called on this instance to download the days missing from the local daily store
+    # (the whole 5 years on the first run, then only the new days), and to compute the weather data for the
+    # location and date range, most recent 5 years, from the store
+    stored = weather.sync(engine)
+    print(f"Stored {stored} new days of observations")
 
     # Generating the 3 weather variables in part c2
     print("\nWeather Variables Asked in Part C2:")
@@ -40,10 +47,6 @@ def main():
     print("\nAll raw weather data from API (use this to verify if data inserted are correct):")
     print(weather)
 
-    # recreate_table is called to ensure that the db table for weather data exists, and reset it daily
-    # this function returns an 'engine' object which is the sqlalchemy connection to the db
-    engine = recreate_table()
-
     # This is called to insert the weather data fetched by the 'WeatherData' object into the db.
     # The 'engine' is passed to connect to the appropriate db
     insert_weather_data(engine, weather)
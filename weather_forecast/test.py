@@ -1,8 +1,22 @@
+import json
+import os
+import tempfile
+import threading
+import time
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+import numpy as np
+from urllib.parse import parse_qs, urlparse
 from sqlalchemy.orm import sessionmaker
-from database import recreate_table, query_weather_data, WeatherRecord
+from database import DailyObservation, dispose_engine, get_engine, insert_weather_rows, recreate_table, query_weather_data, WeatherRecord
+from ingest import ingest_locations
 from weather_data import WeatherData
-from datetime import datetime
+from weather_stats import DailySeries
+from datetime import date, datetime, timedelta
+
+# Recorded Open-Meteo archive response served by the stand-in server below
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "archive_response.json")
 
 class TestWeatherDataDatabase(unittest.TestCase):
 
@@ -11,8 +25,8 @@ class TestWeatherDataDatabase(unittest.TestCase):
         # Print all data inserted in the tests
         print("All records inserted/used in the test database:")
 
-        # Set up the database for testing
-        cls.engine = recreate_table()
+        # Set up the database for testing, in memory so that weather.db is left alone
+        cls.engine = recreate_table("sqlite://")
 
         # Example weather data to be inserted
         cls.weather_data = WeatherData(latitude=40.0806, longitude=-80.9001, date=datetime(2024, 8, 29))
@@ -189,5 +203,360 @@ class TestWeatherDataDatabase(unittest.TestCase):
         session.commit()
         session.close()
 
+class TestBulkInsert(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = recreate_table("sqlite://")
+
+    def test_batched_insert(self):
+        #Test inserting a mix of WeatherData objects and row dicts over several batches
+        weather = WeatherData(latitude=40.0806, longitude=-80.9001, date=datetime(2024, 8, 29))
+        weather.avg_temp = 52.6
+        weather.sum_precipitation = 233.872
+        rows = [weather] + [{"latitude": float(i), "longitude": -80.0, "year": 2024, "avg_temp_Fahrenheit": 50.0}
+                            for i in range(2500)]
+
+        self.assertEqual(insert_weather_rows(self.engine, rows, batch_size=1000), 2501)
+
+        session = sessionmaker(bind=self.engine)()
+        self.assertEqual(session.query(WeatherRecord).count(), 2501)
+        first = session.query(WeatherRecord).filter_by(latitude=40.0806).one()
+        self.assertEqual((first.month, first.day, first.year), (8, 29, 2024))
+        self.assertEqual(first.avg_temp_Fahrenheit, 52.6)
+        self.assertEqual(first.sum_precipitation_inches, 233.872)
+        self.assertIsNone(first.max_temp_Fahrenheit)
+        self.assertIsNone(session.query(WeatherRecord).filter_by(latitude=7.0).one().max_temp_Fahrenheit)
+        session.close()
+
+    def test_shared_engine_in_wal_mode(self):
+        #Test that one engine is shared per URL and that SQLite files are switched to WAL mode
+        with tempfile.TemporaryDirectory() as tmp:
+            url = f"sqlite:///{os.path.join(tmp, 'bulk.db')}"
+            engine = get_engine(url)
+            self.assertIs(get_engine(url), engine)
+            with engine.connect() as connection:
+                self.assertEqual(connection.exec_driver_sql("PRAGMA journal_mode").scalar(), "wal")
+                self.assertEqual(connection.exec_driver_sql("PRAGMA synchronous").scalar(), 1)  # NORMAL
+            dispose_engine(url)
+            self.assertIsNot(get_engine(url), engine)
+            dispose_engine(url)
+
+class TestWeatherDataFetch(unittest.TestCase):
+
+    def setUp(self):
+        # A small recorded-style archive response, 'None' marks a missing day
+        self.response = mock.Mock(status_code=200)
+        self.response.json.return_value = {"daily": {
+            "time": ["2024-08-27", "2024-08-28", "2024-08-29"],
+            "temperature_2m_max": [80.0, 90.0, None],
+            "temperature_2m_min": [60.0, 50.0, 55.0],
+            "temperature_2m_mean": [70.0, 71.0, None],
+            "precipitation_sum": [0.0, 1.5, 0.5],
+            "wind_speed_10m_max": [10.0, 12.0, 8.0],
+        }}
+
+    def test_single_request_for_all_statistics(self):
+        #Test that every statistic comes from one HTTP request
+        weather = WeatherData(latitude=40.0806, longitude=-80.9001, date=datetime(2024, 8, 29))
+        with mock.patch("weather_data.requests.get", return_value=self.response) as get:
+            weather.fetch_weather_data()
+            weather.fetch_mean_temperature()
+            weather.fetch_max_wind_speed()
+            weather.fetch_precipitation_sum()
+
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(get.call_args[0][0], weather.archive_url())
+        self.assertEqual(weather.avg_temp, 70.5)
+        self.assertEqual(weather.min_temp, 50.0)
+        self.assertEqual(weather.max_temp, 90.0)
+        self.assertEqual(weather.avg_wind_speed, 10.0)
+        self.assertEqual(weather.max_wind_speed, 12.0)
+        self.assertEqual(weather.sum_precipitation, 2.0)
+        self.assertEqual(weather.max_precipitation, 1.5)
+
+    def test_failed_request_is_not_retried(self):
+        #Test that a failed fetch prints an error and the derived metrics do not fetch again
+        weather = WeatherData(latitude=40.0806, longitude=-80.9001, date=datetime(2024, 8, 29))
+        with mock.patch("weather_data.requests.get", return_value=mock.Mock(status_code=500)) as get:
+            weather.fetch_weather_data()
+            weather.fetch_mean_temperature()
+
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(weather.status_code, 500)
+        self.assertIsNone(weather.avg_temp)
+
+class TestWeatherStats(unittest.TestCase):
+
+    def setUp(self):
+        # Three months of two variables, with missing days and one variable missing for all of March
+        rng = np.random.default_rng(0)
+        self.days = [str(d) for d in np.arange('2024-01-01', '2024-04-01', dtype='datetime64[D]')]
+        self.daily = {"time": self.days}
+        for name in ("temperature_2m_mean", "precipitation_sum"):
+            values = [round(float(v), 2) for v in rng.normal(50, 10, len(self.days))]
+            for i in rng.choice(len(self.days), 10, replace=False):
+                values[i] = None
+            self.daily[name] = values
+        march = self.days.index('2024-03-01')
+        self.daily["precipitation_sum"][march:] = [None] * (len(self.days) - march)
+        self.series = DailySeries.from_daily(self.daily)
+
+    # Reference: the plain Python way, leaving out the 'None' values
+    def expected(self, values):
+        values = [val for val in values if val is not None]
+        if not values:
+            return {"count": 0, "sum": None, "mean": None, "min": None, "max": None}
+        return {"count": len(values), "sum": sum(values), "mean": sum(values) / len(values),
+                "min": min(values), "max": max(values)}
+
+    def assertAggregates(self, aggregates, variable, column, values):
+        for name, value in self.expected(values).items():
+            actual = aggregates.get(variable, name)
+            actual = actual if column is None else actual[column]
+            if value is None:
+                self.assertTrue(np.isnan(actual), name)
+            else:
+                self.assertAlmostEqual(float(actual), value, places=9, msg=name)
+
+    def test_whole_series(self):
+        #Test that the vectorized aggregates match the Python ones
+        aggregates = self.series.aggregate()
+        for variable in ("temperature_2m_mean", "precipitation_sum"):
+            self.assertAggregates(aggregates, variable, None, self.daily[variable])
+
+    def test_monthly_and_yearly(self):
+        #Test the calendar month and year groups, including a month with no data
+        monthly = self.series.monthly()
+        self.assertEqual([str(p) for p in monthly.periods], ['2024-01', '2024-02', '2024-03'])
+        for column, month in enumerate(['2024-01', '2024-02', '2024-03']):
+            for variable in ("temperature_2m_mean", "precipitation_sum"):
+                values = [v for d, v in zip(self.days, self.daily[variable]) if d.startswith(month)]
+                self.assertAggregates(monthly, variable, column, values)
+
+        yearly = self.series.yearly()
+        self.assertEqual([str(p) for p in yearly.periods], ['2024'])
+        self.assertAggregates(yearly, "temperature_2m_mean", 0, self.daily["temperature_2m_mean"])
+
+    def test_rolling(self):
+        #Test every trailing 7-day window
+        rolling = self.series.rolling(7)
+        self.assertEqual(len(rolling.periods), len(self.days) - 6)
+        self.assertEqual(str(rolling.periods[0]), self.days[6])
+        for column in (0, 30, len(self.days) - 7):
+            for variable in ("temperature_2m_mean", "precipitation_sum"):
+                self.assertAggregates(rolling, variable, column, self.daily[variable][column:column + 7])
+        self.assertEqual(len(self.series.rolling(len(self.days) + 1).periods), 0)
+        with self.assertRaises(ValueError):
+            self.series.rolling(0)
+
+    def test_unsorted_days(self):
+        #Test that the days are put in order before grouping
+        shuffled = {name: values[::-1] for name, values in self.daily.items()}
+        series = DailySeries.from_daily(shuffled)
+        np.testing.assert_array_equal(series.dates, self.series.dates)
+        np.testing.assert_array_equal(series.values, self.series.values)
+
+# Stand-in for a requests.Session answering archive requests for any date range. Each value is derived from the
+# day, and days after 'available_until' are answered with None like the archive does for days not published yet.
+class FakeArchiveSession:
+    def __init__(self, available_until):
+        self.available_until = available_until
+        self.ranges = []
+
+    def get(self, url, timeout=None):
+        query = parse_qs(urlparse(url).query)
+        start = date.fromisoformat(query["start_date"][0])
+        end = date.fromisoformat(query["end_date"][0])
+        self.ranges.append((start, end))
+        days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+        daily = {"time": [day.isoformat() for day in days]}
+        for offset, variable in enumerate(("temperature_2m_max", "temperature_2m_min", "temperature_2m_mean",
+                                           "precipitation_sum", "wind_speed_10m_max")):
+            daily[variable] = [None if day > self.available_until or day.day == 13
+                               else float((day.toordinal() * (offset + 3)) % 97) for day in days]
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {"daily": daily}
+        return response
+
+class TestIncrementalSync(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = recreate_table("sqlite://")
+        session = sessionmaker(bind=self.engine)()
+        session.query(DailyObservation).delete()
+        session.commit()
+        session.close()
+
+    def sync(self, day, archive):
+        weather = WeatherData(latitude=40.0806, longitude=-80.9001, date=day, session=archive)
+        return weather, weather.sync(self.engine)
+
+    def test_only_missing_days_are_fetched(self):
+        #Test that the first sync stores 5 years, and later ones only the days after the last stored day
+        archive = FakeArchiveSession(available_until=date(2024, 8, 26))
+        weather, stored = self.sync(datetime(2024, 8, 29), archive)
+        self.assertEqual(archive.ranges, [(date(2019, 8, 29), date(2024, 8, 29))])
+        # the 3 days not published yet are left for the next sync
+        self.assertEqual(stored, (date(2024, 8, 26) - date(2019, 8, 29)).days + 1)
+
+        # The 4 new days, and the last 7 stored days again
+        archive.available_until = date(2024, 8, 30)
+        _, stored = self.sync(datetime(2024, 8, 30), archive)
+        self.assertEqual(archive.ranges[-1], (date(2024, 8, 20), date(2024, 8, 30)))
+        self.assertEqual(stored, 11)
+
+        # Nothing is missing anymore, so no request is made
+        _, stored = self.sync(datetime(2024, 8, 30), archive)
+        self.assertEqual(len(archive.ranges), 2)
+        self.assertEqual(stored, 0)
+
+        session = sessionmaker(bind=self.engine)()
+        self.assertEqual(session.query(DailyObservation).count(), (date(2024, 8, 30) - date(2019, 8, 29)).days + 1)
+        session.close()
+
+    def test_recent_days_are_revised(self):
+        #Test that a stored day with missing values is completed by a later sync
+        archive = FakeArchiveSession(available_until=date(2024, 8, 30))
+        self.sync(datetime(2024, 8, 14), archive)
+        session = sessionmaker(bind=self.engine)()
+        incomplete = session.query(DailyObservation).filter_by(date=date(2024, 8, 13)).one()
+        self.assertIsNone(incomplete.temperature_2m_max)
+        session.close()
+
+        # the archive has since filled in the 13th
+        archive.get = lambda url, timeout=None, get=archive.get: self.fill_13th(get(url, timeout))
+        self.sync(datetime(2024, 8, 16), archive)
+        self.assertEqual(archive.ranges[-1], (date(2024, 8, 8), date(2024, 8, 16)))
+        session = sessionmaker(bind=self.engine)()
+        self.assertEqual(session.query(DailyObservation).filter_by(date=date(2024, 8, 13)).one().temperature_2m_max,
+                         42.0)
+        session.close()
+
+    def fill_13th(self, response):
+        daily = response.json.return_value["daily"]
+        for i, day in enumerate(daily["time"]):
+            if day.endswith("-13"):
+                for variable in daily:
+                    if variable != "time":
+                        daily[variable][i] = 42.0
+        return response
+
+    def test_sql_aggregates_match_full_download(self):
+        #Test that the statistics computed in SQL from the store equal the ones of a full 5-year download
+        archive = FakeArchiveSession(available_until=date(2024, 8, 30))
+        self.sync(datetime(2024, 8, 20), archive)
+        synced, _ = self.sync(datetime(2024, 8, 30), archive)
+
+        downloaded = WeatherData(latitude=40.0806, longitude=-80.9001, date=datetime(2024, 8, 30), session=archive)
+        downloaded.fetch_weather_data()
+
+        for name in ("avg_temp", "min_temp", "max_temp", "avg_wind_speed", "min_wind_speed", "max_wind_speed",
+                     "sum_precipitation", "min_precipitation", "max_precipitation"):
+            self.assertAlmostEqual(getattr(synced, name), getattr(downloaded, name), places=6, msg=name)
+        self.assertIsNone(synced.data)
+
+# Local stand-in for the Open-Meteo archive API. It serves the recorded response for every location, except
+# that the statuses queued in 'failures[latitude]' are answered first. It records the requested latitudes
+# and the client address of each request, to count the connections used.
+class ArchiveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def do_GET(self):
+        server = self.server
+        latitude = float(parse_qs(urlparse(self.path).query)["latitude"][0])
+        with server.lock:
+            server.requests.append(latitude)
+            server.clients.add(self.client_address)
+            queued = server.failures.get(latitude)
+            status = queued.pop(0) if queued else 200
+        # a queued "no daily" answers 200 with a payload that has no 'daily' part
+        body = server.body if status == 200 else b'{"error": true}'
+        if status == "no daily":
+            status = 200
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class TestBulkIngestion(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), ArchiveHandler)
+        with open(FIXTURE, "rb") as f:
+            self.server.body = f.read()
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.clients = set()
+        self.server.failures = {}
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/v1/archive"
+        # In-memory db, emptied for each test, so the tests do not touch weather.db
+        self.engine = recreate_table("sqlite://")
+        self.locations = [(40.0 + i / 100, -80.9) for i in range(30)]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def ingest(self, **kwargs):
+        kwargs = {"workers": 4, "rate": 0, "batch_size": 8, "backoff": 0, **kwargs}
+        return ingest_locations(self.locations, self.engine, date=datetime(2024, 8, 29),
+                                base_url=self.base_url, **kwargs)
+
+    def test_all_locations_inserted_in_batches(self):
+        #Test that every location is fetched once and stored, batch_size rows per commit
+        summary = self.ingest()
+
+        self.assertEqual(summary["inserted"], 30)
+        self.assertEqual(summary["batches"], 4)
+        self.assertEqual(summary["failed"], [])
+        self.assertEqual(sorted(self.server.requests), [latitude for latitude, _ in self.locations])
+
+        with open(FIXTURE) as f:
+            daily = json.load(f)["daily"]
+        session = sessionmaker(bind=self.engine)()
+        records = session.query(WeatherRecord).all()
+        self.assertEqual(sorted(r.latitude for r in records), [latitude for latitude, _ in self.locations])
+        record = records[0]
+        self.assertEqual(record.max_temp_Fahrenheit, max(v for v in daily["temperature_2m_max"] if v is not None))
+        self.assertEqual(record.year, 2024)
+        session.close()
+
+    def test_connections_are_reused(self):
+        #Test that the requests go over at most 'workers' keep-alive connections
+        self.ingest(workers=3)
+        self.assertEqual(len(self.server.requests), 30)
+        self.assertLessEqual(len(self.server.clients), 3)
+
+    def test_retries_then_reports_failures(self):
+        #Test that temporary errors are retried, and locations still failing are reported and skipped
+        self.server.failures = {40.0: [503, 429], 40.01: [500, 500, 500, 500]}
+        summary = self.ingest(retries=3)
+
+        self.assertEqual(summary["inserted"], 29)
+        self.assertEqual([(latitude, error) for latitude, _, error in summary["failed"]],
+                         [(40.01, "Error fetching data: 500")])
+        self.assertEqual(self.server.requests.count(40.0), 3)
+        self.assertEqual(self.server.requests.count(40.01), 4)
+
+    def test_malformed_response_is_reported(self):
+        #Test that a 200 answer without 'daily' fails that location only
+        self.server.failures = {40.02: ["no daily"]}
+        summary = self.ingest()
+
+        self.assertEqual(summary["inserted"], 29)
+        self.assertEqual([(latitude, error.split(":")[0]) for latitude, _, error in summary["failed"]],
+                         [(40.02, "Unexpected archive response")])
+
+    def test_rate_limit(self):
+        #Test that no more than 'rate' locations start per second
+        start = time.perf_counter()
+        self.ingest(rate=100, workers=8)
+        self.assertGreaterEqual(time.perf_counter() - start, 29 / 100)
+
 if __name__ == "__main__":
     unittest.main()
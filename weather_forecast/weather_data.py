@@ -1,17 +1,35 @@
 import requests #Python library used to make HTTP requests. This library simplifies the process
                 # of sending HTTP requests to interact with web services (APIs) and retrieve data.
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from database import DAILY_VARIABLES, daily_aggregates, insert_daily_observations, last_observed_date
+from weather_stats import AGGREGATES, Aggregates, DailySeries
+
+# Number of stored days that WeatherData.sync requests again, since the archive may still revise recent days
+REVISION_DAYS = 7
+
+# Open-Meteo historical weather endpoint. It can be swapped for a local stand-in server in tests.
+ARCHIVE_URL = "https://archive-api.open-meteo.com/v1/archive"
 
 # Part C1 in the task.
 # As specified in the task, this is the class that contains and encapsulate all the data and methods
 # related to weather data for a specific location and date
 class WeatherData:
-    def __init__(self, latitude, longitude, date):
+    # 'session' is an optional requests.Session to send the request through, so that many instances can share
+    # pooled keep-alive connections (see ingest.py). Without one, a plain requests.get is used.
+    # 'timeout' is the request timeout in seconds, None waits forever.
+    def __init__(self, latitude, longitude, date, session=None, base_url=ARCHIVE_URL, timeout=None):
         self.latitude = latitude
         self.longitude = longitude
         self.date = date
         self.year = date.year
         self.month = date.month
         self.day = date.day
+        self.session = session
+        self.base_url = base_url
+        self.timeout = timeout
         self.avg_temp = None
         self.min_temp = None
         self.max_temp = None
@@ -21,7 +39,10 @@ class WeatherData:
         self.sum_precipitation = None
         self.min_precipitation = None
         self.max_precipitation = None
-        self.data = None
+        self.data = None  # 'daily' part of the API response, downloaded once by load_daily
+        self.status_code = None  # status code of that one request
+        self._series = None  # self.data as numpy arrays, see series()
+        self._statistics = None  # per-instance cache of the whole-period statistics derived from self.data
 
     # This is a special method that returns a string representation of the object
     # When inspecting an object in an interactive session, Python calls the '__repr__'
@@ -33,101 +54,143 @@ class WeatherData:
                 f"avg_wind_speed={self.avg_wind_speed}, min_wind_speed={self.min_wind_speed}, max_wind_speed={self.max_wind_speed}, "
                 f"sum_precipitation={self.sum_precipitation}, min_precipitation={self.min_precipitation}, max_precipitation={self.max_precipitation})")
 
-    # This part shows the method for fetching weather data for the specified location and date range
-    # URL is directly copied from open meteo right after changing the location, timezone, and daily weather variables
+    # First day of the most recent 5 years ending on self.date.
     # In task part 2, it is specified that the data should be the most recent 5 years, so I made the start and end dates dynamic.
-    def fetch_weather_data(self):
-        start_date = (self.date.replace(year=self.date.year - 5)).strftime('%Y-%m-%d')
-        end_date = self.date.strftime('%Y-%m-%d')
-        url = (f"https://archive-api.open-meteo.com/v1/archive?"
-               f"latitude={self.latitude}&longitude={self.longitude}&start_date={start_date}&end_date={end_date}"
-               f"&daily=temperature_2m_max,temperature_2m_min,temperature_2m_mean,precipitation_sum,wind_speed_10m_max"
-               f"&temperature_unit=fahrenheit&wind_speed_unit=mph&precipitation_unit=inch&timezone=America%2FNew_York")
-
-        # This is the GET request sent to the constructed URL. The URL is taken directly from open-meteo and edited.
-        # Response's status code 200 indicates success, and the response is parsed as JSON and stored in the 'data' variable
-        response = requests.get(url)
+    def window_start(self):
+        return self.date.replace(year=self.date.year - 5)
+
+    # This builds the Open-Meteo archive URL for the days from start_date to end_date, by default the most recent
+    # 5 years ending on self.date.
+    # URL is directly copied from open meteo right after changing the location, timezone, and daily weather variables
+    def archive_url(self, start_date=None, end_date=None):
+        start_date = (start_date or self.window_start()).strftime('%Y-%m-%d')
+        end_date = (end_date or self.date).strftime('%Y-%m-%d')
+        return (f"{self.base_url}?"
+                f"latitude={self.latitude}&longitude={self.longitude}&start_date={start_date}&end_date={end_date}"
+                f"&daily=temperature_2m_max,temperature_2m_min,temperature_2m_mean,precipitation_sum,wind_speed_10m_max"
+                f"&temperature_unit=fahrenheit&wind_speed_unit=mph&precipitation_unit=inch&timezone=America%2FNew_York")
+
+    # This is the single network call of the class. The first call downloads the 5-year daily payload and keeps
+    # its 'daily' part (one list per weather variable, 'None' for missing days) in self.data.
+    # Every later call, and every statistic below, reuses it, so one instance makes at most one HTTP request.
+    # If the request failed, the status code is kept and None is returned without retrying.
+    def load_daily(self):
+        if self.data is None and self.status_code is None:
+            self.data = self.fetch_range()
+        return self.data
+
+    # Sends the GET request for the days from start_date to end_date (see archive_url) and returns the 'daily'
+    # part of the response, or None if the request failed. The status code is kept in self.status_code.
+    def fetch_range(self, start_date=None, end_date=None):
+        # This is the GET request sent to the constructed URL.
+        # Response's status code 200 indicates success, and the response is parsed as JSON
+        http = self.session if self.session is not None else requests
+        response = http.get(self.archive_url(start_date, end_date), timeout=self.timeout)
+        self.status_code = response.status_code
         if response.status_code == 200:
-            data = response.json()
-
-            # Processing the retrieved data.
-            # This code calculates the average, minimum, maximum,and sum for the relevant weather parameters.
-            # Mean = add up all the given values, then divide by how many values there are. This calculation
-            # is the dame as getting the average. So, for ease of use, I am using avg all throughout.
-            # Filter out None values before summing and averaging. 'None' values represent missing data
-            temp_mean_values = [val for val in data['daily']['temperature_2m_mean'] if val is not None]
-            temp_min_values = [val for val in data['daily']['temperature_2m_min'] if val is not None]
-            temp_max_values = [val for val in data['daily']['temperature_2m_max'] if val is not None]
-            wind_speed_values = [val for val in data['daily']['wind_speed_10m_max'] if val is not None]
-            precipitation_values = [val for val in data['daily']['precipitation_sum'] if val is not None]
-
-            # Calculate averages, min, and max while handling empty lists
-            self.avg_temp = sum(temp_mean_values) / len(temp_mean_values) if temp_mean_values else None
-            self.min_temp = min(temp_min_values) if temp_min_values else None
-            self.max_temp = max(temp_max_values) if temp_max_values else None
-
-            self.avg_wind_speed = sum(wind_speed_values) / len(wind_speed_values) if wind_speed_values else None
-            self.min_wind_speed = min(wind_speed_values) if wind_speed_values else None
-            self.max_wind_speed = max(wind_speed_values) if wind_speed_values else None
-
-            self.sum_precipitation = sum(precipitation_values) if precipitation_values else None
-            self.min_precipitation = min(precipitation_values) if precipitation_values else None
-            self.max_precipitation = max(precipitation_values) if precipitation_values else None
-
-        # This is for handling errors. If the API request fails (status code is not 200), an error message is
-        # printed with the relevant status code
-        else:
-            print(f"Error fetching data: {response.status_code}")
+            return response.json()['daily']
+        return None
+
+    # Incremental sync with the local daily store (database.DailyObservation) behind 'engine'.
+    # When days are missing after the last stored day of this location, they are requested together with the
+    # last REVISION_DAYS stored days, which the archive may still complete or revise; the stored copies are
+    # overwritten. So a daily refresh downloads about a week instead of 5 years, a store that is already up to date
+    # sends no request, and a location seen for the first time gets its whole 5-year window.
+    # The archive publishes each day with a delay of a few days, and answers 'None' for days not available yet.
+    # Those trailing empty days are not stored, so that the next sync asks for them again.
+    # The statistics of the 5-year window are then computed in SQL from the store, even if the request failed
+    # (with whatever is stored). Returns the number of days stored, re-fetched days included.
+    def sync(self, engine):
+        end = self.date.date() if isinstance(self.date, datetime) else self.date
+        start = self.window_start()
+        start = start.date() if isinstance(start, datetime) else start
+        last = last_observed_date(engine, self.latitude, self.longitude)
+        fetch_from = max(start, last + timedelta(days=1 - REVISION_DAYS)) if last is not None else start
+
+        stored = 0
+        if last is None or last < end:
+            daily = self.fetch_range(fetch_from, end)
+            if daily is None:
+                print(f"Error fetching data: {self.status_code}")
+            else:
+                available = len(daily['time'])
+                while available and all(daily[variable][available - 1] is None for variable in DAILY_VARIABLES):
+                    available -= 1
+                daily = {name: values[:available] for name, values in daily.items()}
+                stored = insert_daily_observations(engine, self.latitude, self.longitude, daily)
+
+        aggregates = daily_aggregates(engine, self.latitude, self.longitude, start, end)
+        self._statistics = Aggregates(
+            DAILY_VARIABLES, None,
+            {name: np.array([np.nan if aggregates[variable][name] is None else aggregates[variable][name]
+                             for variable in DAILY_VARIABLES], dtype=np.float64)
+             for name in AGGREGATES})
+        self.fetch_weather_data()
+        return stored
+
+    # True if the statistics can be computed: they were already computed by sync(), or the 5-year payload
+    # is (or can be) downloaded
+    def _has_data(self):
+        return self._statistics is not None or self.load_daily() is not None
+
+    # Turns the daily payload into a weather_stats.DailySeries (float arrays, NaN for missing days) once per instance.
+    # Use it for the monthly, yearly and rolling N-day aggregates, e.g. weather.series().monthly()
+    def series(self):
+        if self._series is None:
+            self._series = DailySeries.from_daily(self.load_daily())
+        return self._series
+
+    # Looks up one aggregate ('mean', 'min', 'max' or 'sum') of one daily variable over the whole 5 years.
+    # All aggregates of all variables are computed together the first time and kept on the instance.
+    # Missing days are left out, and a variable with no data at all gives None.
+    # Mean = add up all the given values, then divide by how many values there are. This calculation
+    # is the dame as getting the average. So, for ease of use, I am using avg all throughout.
+    def _statistic(self, variable, name):
+        if self._statistics is None:
+            self._statistics = self.series().aggregate()
+        value = float(self._statistics.get(variable, name))
+        return None if np.isnan(value) else value
+
+    # This part shows the method for fetching weather data for the specified location and date range
+    # It calculates the average, minimum, maximum, and sum for the relevant weather parameters
+    def fetch_weather_data(self):
+        if not self._has_data():
+            # This is for handling errors. If the API request fails (status code is not 200), an error message is
+            # printed with the relevant status code
+            print(f"Error fetching data: {self.status_code}")
+            return
+
+        self.avg_temp = self._statistic('temperature_2m_mean', 'mean')
+        self.min_temp = self._statistic('temperature_2m_min', 'min')
+        self.max_temp = self._statistic('temperature_2m_max', 'max')
+
+        self.avg_wind_speed = self._statistic('wind_speed_10m_max', 'mean')
+        self.min_wind_speed = self._statistic('wind_speed_10m_max', 'min')
+        self.max_wind_speed = self._statistic('wind_speed_10m_max', 'max')
+
+        self.sum_precipitation = self._statistic('precipitation_sum', 'sum')
+        self.min_precipitation = self._statistic('precipitation_sum', 'min')
+        self.max_precipitation = self._statistic('precipitation_sum', 'max')
 
 # separate methods for part c2
+# These derive their variable from the same in-memory data, so they make no extra request
     def fetch_mean_temperature(self):
-        start_date = (self.date.replace(year=self.date.year - 5)).strftime('%Y-%m-%d')
-        end_date = self.date.strftime('%Y-%m-%d')
-        url = (f"https://archive-api.open-meteo.com/v1/archive?"
-               f"latitude={self.latitude}&longitude={self.longitude}&start_date={start_date}&end_date={end_date}"
-               f"&daily=temperature_2m_max,temperature_2m_min,temperature_2m_mean,precipitation_sum,wind_speed_10m_max"
-               f"&temperature_unit=fahrenheit&wind_speed_unit=mph&precipitation_unit=inch&timezone=America%2FNew_York")
-
-        response = requests.get(url)
-        if response.status_code == 200:
-            data = response.json()
-
-            temp_mean_values = [val for val in data['daily']['temperature_2m_mean'] if val is not None]
-            self.avg_temp = sum(temp_mean_values) / len(temp_mean_values) if temp_mean_values else None
-            print(f"Mean Temperature: {self.avg_temp} Fahrenheit")
-        else:
-            print(f"Error fetching mean temperature data: {response.status_code}")
+        if not self._has_data():
+            print(f"Error fetching mean temperature data: {self.status_code}")
+            return
+        self.avg_temp = self._statistic('temperature_2m_mean', 'mean')
+        print(f"Mean Temperature: {self.avg_temp} Fahrenheit")
 
     def fetch_max_wind_speed(self):
-        start_date = (self.date.replace(year=self.date.year - 5)).strftime('%Y-%m-%d')
-        end_date = self.date.strftime('%Y-%m-%d')
-        url = (f"https://archive-api.open-meteo.com/v1/archive?"
-               f"latitude={self.latitude}&longitude={self.longitude}&start_date={start_date}&end_date={end_date}"
-               f"&daily=temperature_2m_max,temperature_2m_min,temperature_2m_mean,precipitation_sum,wind_speed_10m_max"
-               f"&temperature_unit=fahrenheit&wind_speed_unit=mph&precipitation_unit=inch&timezone=America%2FNew_York")
-
-        response = requests.get(url)
-        if response.status_code == 200:
-            data = response.json()
-            wind_speed_values = [val for val in data['daily']['wind_speed_10m_max'] if val is not None]
-            self.max_wind_speed = max(wind_speed_values) if wind_speed_values else None
-            print(f"Maximum Wind Speed: {self.max_wind_speed} mph")
-        else:
-            print(f"Error fetching maximum wind speed data: {response.status_code}")
+        if not self._has_data():
+            print(f"Error fetching maximum wind speed data: {self.status_code}")
+            return
+        self.max_wind_speed = self._statistic('wind_speed_10m_max', 'max')
+        print(f"Maximum Wind Speed: {self.max_wind_speed} mph")
 
     def fetch_precipitation_sum(self):
-        start_date = (self.date.replace(year=self.date.year - 5)).strftime('%Y-%m-%d')
-        end_date = self.date.strftime('%Y-%m-%d')
-        url = (f"https://archive-api.open-meteo.com/v1/archive?"
-               f"latitude={self.latitude}&longitude={self.longitude}&start_date={start_date}&end_date={end_date}"
-               f"&daily=temperature_2m_max,temperature_2m_min,temperature_2m_mean,precipitation_sum,wind_speed_10m_max"
-               f"&temperature_unit=fahrenheit&wind_speed_unit=mph&precipitation_unit=inch&timezone=America%2FNew_York")
-
-        response = requests.get(url)
-        if response.status_code == 200:
-            data = response.json()
-            precipitation_values = [val for val in data['daily']['precipitation_sum'] if val is not None]
-            self.sum_precipitation = sum(precipitation_values) if precipitation_values else None
-            print(f"Sum Precipitation: {self.sum_precipitation} inch")
-        else:
-            print(f"Error fetching precipitation data: {response.status_code}")
+        if not self._has_data():
+            print(f"Error fetching precipitation data: {self.status_code}")
+            return
+        self.sum_precipitation = self._statistic('precipitation_sum', 'sum')
+        print(f"Sum Precipitation: {self.sum_precipitation} inch")
@@ -0,0 +1,108 @@
+# numpy statistics layer for the 'daily' part of an Open-Meteo archive response.
+#
+# The daily payload is one list per weather variable, with 'None' for missing days. DailySeries turns it into a
+# single float matrix (one row per variable, one column per day) with NaN for the missing values, so every
+# aggregate of every variable is computed by a handful of array operations instead of Python loops.
+#
+# Aggregates are: count (number of non-missing days), sum, mean, min and max. A group whose days are all
+# missing has a count of 0 and NaN for the other aggregates. They can be computed over:
+#   - the whole series: aggregate()
+#   - each calendar month or year: monthly(), yearly()
+#   - every trailing window of N days: rolling(N)
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+AGGREGATES = ("count", "sum", "mean", "min", "max")
+
+# Identity of each reduction, so that reducing an empty range gives count 0 instead of an error
+_INITIAL = {np.add: 0, np.minimum: np.inf, np.maximum: -np.inf}
+
+
+# Computes all the aggregates of 'values' (variables x days, NaN for missing) in one go.
+# 'reduce(ufunc, array)' applies np.add / np.minimum / np.maximum over the days of each group.
+def _summarize(values, reduce):
+    present = ~np.isnan(values)
+    count = reduce(np.add, present.astype(np.int64))
+    total = reduce(np.add, np.where(present, values, 0.0))
+    low = reduce(np.minimum, np.where(present, values, np.inf))
+    high = reduce(np.maximum, np.where(present, values, -np.inf))
+
+    empty = count == 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+    for array in (total, mean, low, high):
+        array[empty] = np.nan
+    return {"count": count, "sum": total, "mean": mean, "min": low, "max": high}
+
+
+# Result of an aggregation: 'stats[name]' is an array with one row per variable, and one column per period
+# (a 1-D array per aggregate when 'periods' is None, i.e. for the whole series).
+class Aggregates:
+    def __init__(self, variables, periods, stats):
+        self.variables = variables
+        self.periods = periods
+        self.stats = stats
+
+    def __repr__(self):
+        return f"Aggregates(variables={list(self.variables)}, periods={0 if self.periods is None else len(self.periods)})"
+
+    # Returns one aggregate of one variable: a scalar for the whole series, else one value per period
+    def get(self, variable, name):
+        return self.stats[name][self.variables.index(variable)]
+
+
+class DailySeries:
+    # 'dates' is a datetime64[D] array of the days, sorted ascending, and 'values' a float array of shape
+    # (len(variables), len(dates)) with NaN for missing values.
+    def __init__(self, dates, variables, values):
+        self.dates = dates
+        self.variables = tuple(variables)
+        self.values = values
+
+    # Builds the series from an archive 'daily' dict ('time' plus one list per variable).
+    # 'variables' defaults to every variable in the payload. None becomes NaN in the float conversion.
+    @classmethod
+    def from_daily(cls, daily, variables=None):
+        variables = [name for name in daily if name != 'time'] if variables is None else list(variables)
+        dates = np.array(daily['time'], dtype='datetime64[D]')
+        values = np.array([daily[name] for name in variables], dtype=np.float64).reshape(len(variables), len(dates))
+        # The archive API answers in date order; sort anyway since the grouping below relies on it
+        if np.any(dates[1:] < dates[:-1]):
+            order = np.argsort(dates, kind='stable')
+            dates, values = dates[order], values[:, order]
+        return cls(dates, variables, values)
+
+    def __len__(self):
+        return len(self.dates)
+
+    # Aggregates over the whole series; each stat is an array with one value per variable
+    def aggregate(self):
+        stats = _summarize(self.values, lambda ufunc, a: ufunc.reduce(a, axis=1, initial=_INITIAL[ufunc]))
+        return Aggregates(self.variables, None, stats)
+
+    # Aggregates per period of the given numpy datetime unit, 'M' for months or 'Y' for years.
+    # The days are sorted, so each period is one contiguous run of columns and reduceat handles all of them at once.
+    def group(self, unit):
+        keys = self.dates.astype(f'datetime64[{unit}]')
+        if len(keys) == 0:
+            return Aggregates(self.variables, keys, {name: np.empty((len(self.variables), 0)) for name in AGGREGATES})
+        starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+        stats = _summarize(self.values, lambda ufunc, a: ufunc.reduceat(a, starts, axis=1))
+        return Aggregates(self.variables, keys[starts], stats)
+
+    def monthly(self):
+        return self.group('M')
+
+    def yearly(self):
+        return self.group('Y')
+
+    # Aggregates over every trailing window of 'window' consecutive days. The periods are the last day of each
+    # window, so there are len(self) - window + 1 of them. The windows are strided views, not copies.
+    def rolling(self, window):
+        if window < 1:
+            raise ValueError(f"window must be at least 1 day, got {window}")
+        if window > len(self):
+            return Aggregates(self.variables, self.dates[:0],
+                              {name: np.empty((len(self.variables), 0)) for name in AGGREGATES})
+        stats = _summarize(self.values, lambda ufunc, a: ufunc.reduce(sliding_window_view(a, window, axis=1), axis=2))
+        return Aggregates(self.variables, self.dates[window - 1:], stats)